@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmarks for the acquisition and preprocessing paths.
+- Synthetic LV95 data: clustered building register (GKODE/GKODN/GGDENR, 10k-1M
+  rows) and solar installations (_x/_y + popup fields) next to a fraction of them
+- Downloads run against stub_wms.py in a background thread (deterministic PNGs,
+  configurable --latency, --error-rate, --blank-rate); nothing leaves the machine
+- Cases: parquet (CSV cache build), match, sample, download (per tile),
+  mosaic, map (folium canvas + cluster), chips (PNG decode vs chipstore),
+  startup (fresh processes: --help and a canvas map, cold vs through mapd.py)
+- Everything runs in a scratch directory; results go to --out as JSON and,
+  with --baseline, are compared per case (slower than --tolerance -> exit 1)
+
+Examples:
+  python bench.py --rows 100000 --out bench.json --save-baseline bench_baseline.json
+  python bench.py --rows 100000 --baseline bench_baseline.json --cases match,sample
+  python bench.py --generate /tmp/synth --rows 1000000   # data only
+Dep: pip install numpy pandas requests pillow folium pyproj (pyarrow for the Parquet cache)
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Bern canton extent in LV95 (EPSG:2056)
+EXTENT = (2_555_000.0, 1_130_000.0, 2_640_000.0, 1_230_000.0)
+N_TOWNS = 300
+SOLAR_FRACTION = 0.05
+CASES = ("parquet", "match", "sample", "download", "mosaic", "map", "chips", "startup")
+TOLERANCE = 0.2  # fraction slower than the baseline that counts as a regression
+
+
+def synth_buildings(n, seed=0):
+    """Buildings clustered around N_TOWNS towns (sizes ~ Zipf) plus 10% scattered."""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = EXTENT
+    towns = np.column_stack([rng.uniform(minx, maxx, N_TOWNS), rng.uniform(miny, maxy, N_TOWNS)])
+    weight = 1.0 / np.arange(1, N_TOWNS + 1)
+    town = rng.choice(N_TOWNS, size=n, p=weight / weight.sum())
+    spread = 300.0 + 2000.0 * weight[town] ** 0.5
+    x = towns[town, 0] + rng.normal(0.0, 1.0, n) * spread
+    y = towns[town, 1] + rng.normal(0.0, 1.0, n) * spread
+    scattered = rng.random(n) < 0.1
+    x[scattered] = rng.uniform(minx, maxx, scattered.sum())
+    y[scattered] = rng.uniform(miny, maxy, scattered.sum())
+    return pd.DataFrame({"EGID": np.arange(1, n + 1),
+                         "GKODE": np.round(np.clip(x, minx, maxx), 3),
+                         "GKODN": np.round(np.clip(y, miny, maxy), 3),
+                         "GGDENR": 300 + town})
+
+
+def synth_solar(buildings, fraction=SOLAR_FRACTION, seed=1):
+    """Solar installations within ~5 m of a random fraction of the buildings."""
+    rng = np.random.default_rng(seed)
+    n = max(1, int(len(buildings) * fraction))
+    src = buildings.iloc[rng.choice(len(buildings), size=n, replace=False)]
+    return pd.DataFrame({
+        "_x": np.round(src["GKODE"].to_numpy() + rng.normal(0.0, 2.5, n), 3),
+        "_y": np.round(src["GKODN"].to_numpy() + rng.normal(0.0, 2.5, n), 3),
+        "Address": [f"Teststrasse {i % 200 + 1}" for i in range(n)],
+        "Municipality": "Gemeinde " + src["GGDENR"].astype(str).to_numpy(),
+        "PostCode": 3000 + src["GGDENR"].to_numpy() % 1000,
+        "Canton": "BE",
+        "TotalPower": np.round(rng.gamma(2.0, 6.0, n), 1),
+        "BeginningOfOperation": [f"{y}-06-01" for y in rng.integers(2005, 2024, n)],
+    })
+
+
+def generate(out_dir, rows, seed=0):
+    """Write buildings_BE.csv and BernSolarPanelBuildings.csv; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    buildings = synth_buildings(rows, seed)
+    paths = (os.path.join(out_dir, "buildings_BE.csv"),
+             os.path.join(out_dir, "BernSolarPanelBuildings.csv"))
+    buildings.to_csv(paths[0], index=False)
+    synth_solar(buildings, seed=seed + 1).to_csv(paths[1], index=False)
+    return paths
+
+
+def timed(fn, repeat=1):
+    """Best of repeat runs: (seconds, last return value)."""
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+class StubServer:
+    """stub_wms.py served from a daemon thread on a free local port."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, blank_rate=0.0):
+        from stub_wms import serve
+        self.server = serve(0, latency, error_rate, blank_rate=blank_rate)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_cases(cases, buildings_csv, solar_csv, args):
+    """Run the selected cases in the current directory; returns {case: result}."""
+    results = {}
+
+    def record(name, seconds, count, unit):
+        results[name] = {"seconds": round(seconds, 4), "count": count, "unit": unit,
+                         "rate": round(count / seconds, 2) if seconds else 0.0}
+        print(f"[INFO] {name:<12} {seconds:8.3f}s  {count / seconds if seconds else 0:>12,.1f} {unit}")
+
+    from datacache import CACHE_DIR, ensure_parquet
+    if "parquet" in cases:
+        def build():
+            shutil.rmtree(CACHE_DIR, ignore_errors=True)
+            ensure_parquet(buildings_csv)
+        seconds, _ = timed(build, args.repeat)
+        record("parquet", seconds, args.rows, "rows/s")
+    # later cases measure warm reads, as on every run after the first
+    for path in (buildings_csv, solar_csv):
+        ensure_parquet(path)
+
+    if "match" in cases:
+        from match import match
+        seconds, out = timed(lambda: match(buildings_csv, solar_csv), args.repeat)
+        record("match", seconds, out[4], "rows/s")
+
+    if "sample" in cases:
+        from sample import sample
+        n = min(24000, args.rows // 10)
+        seconds, _ = timed(lambda: sample(buildings_csv, solar_csv, n), args.repeat)
+        record("sample", seconds, args.rows, "rows/s")
+
+    jobs_df = pd.read_csv(solar_csv, usecols=["_x", "_y"]).head(args.tiles)
+    if {"download", "mosaic", "chips"} & set(cases):
+        from wms import csv_jobs, download_tiles
+        from mosaic import download_mosaic
+        with StubServer(args.latency, args.error_rate, args.blank_rate) as stub:
+            # chips packs the per-tile download output
+            wanted = {"download": "download" in cases or "chips" in cases,
+                      "mosaic": "mosaic" in cases}
+            for name, fn in (("download", download_tiles), ("mosaic", download_mosaic)):
+                if not wanted[name]:
+                    continue
+                out_dir = f"tiles-{name}"
+
+                def fetch():
+                    shutil.rmtree(out_dir, ignore_errors=True)
+                    os.makedirs(out_dir)
+                    return fn(csv_jobs(jobs_df, out_dir, "_x", "_y"), 256, 256, 0.075,
+                              url=stub.url, workers=args.workers, verbose=False)
+                seconds, stats = timed(fetch, args.repeat)
+                if stats["failed"]:
+                    print(f"[WARN] {name}: {stats['failed']} tiles failed")
+                record(name, seconds, stats["ok"], "tiles/s")
+
+    if "map" in cases:
+        from folium_map import build_map
+        from projection import LV95, WGS84, transform
+        df = pd.read_csv(solar_csv)
+        df["lon"], df["lat"] = transform(df["_x"].to_numpy(), df["_y"].to_numpy(), LV95, WGS84)
+        for mode in ("canvas", "cluster"):
+            seconds, _ = timed(lambda: build_map(df, mode).save(f"map_{mode}.html"), args.repeat)
+            record(f"map-{mode}", seconds, len(df), "points/s")
+
+    if "chips" in cases:
+        from chipstore import pack
+        from chipstore import bench as chip_bench
+        seconds, meta = timed(lambda: pack([("tiles-download", 1)], "chipstore"), args.repeat)
+        record("chips-pack", seconds, meta["count"], "chips/s")
+        batch, batches = 32, 20
+        rates = chip_bench("chipstore", [("tiles-download", 1)], batch, batches)
+        for k, v in rates.items():
+            record(f"chips-{k}", batch * batches / v, batch * batches, "images/s")
+
+    if "startup" in cases:
+        here = os.path.dirname(os.path.abspath(__file__))
+
+        def run(script, *argv, env=None):
+            subprocess.run([sys.executable, os.path.join(here, script), *argv],
+                           check=True, capture_output=True, env=env)
+        for tool in ("plotmap", "folium_map"):
+            seconds, _ = timed(lambda: run(f"{tool}.py", "--help"), args.repeat)
+            record(f"start-{tool}", seconds, 1, "runs/s")
+        map_args = ["--csv", solar_csv, "--mode", "canvas", "--out", "map_startup.html"]
+        seconds, _ = timed(lambda: run("folium_map.py", *map_args), args.repeat)
+        record("start-map", seconds, 1, "runs/s")
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        env = {**os.environ, "MAPD_PORT": str(port)}
+        daemon = subprocess.Popen([sys.executable, os.path.join(here, "mapd.py"), "serve"],
+                                  env=env, stdout=subprocess.PIPE, text=True)
+        try:
+            daemon.stdout.readline()  # printed once the libraries are loaded
+            seconds, _ = timed(lambda: run("mapd.py", "folium_map", *map_args, env=env),
+                               args.repeat)
+            record("start-mapd", seconds, 1, "runs/s")
+        finally:
+            daemon.terminate()
+            daemon.wait()
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Print per-case time ratios against the baseline; returns the regressed cases."""
+    regressed = []
+    print(f"\n{'case':<14} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, r in results.items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None or not base["seconds"]:
+            print(f"{name:<14} {'-':>10} {r['seconds']:>9.3f}s {'new':>7}")
+            continue
+        ratio = r["seconds"] / base["seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  SLOWER"
+            regressed.append(name)
+        elif ratio < 1 - tolerance:
+            flag = "  faster"
+        print(f"{name:<14} {base['seconds']:>9.3f}s {r['seconds']:>9.3f}s {ratio:>6.2f}x{flag}")
+    return regressed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the dataset and download paths")
+    ap.add_argument("--rows", type=int, default=100_000,
+                    help="Synthetic buildings (default: 100000; 10k-1M is typical)")
+    ap.add_argument("--cases", default=",".join(CASES),
+                    help=f"Comma-separated subset of {','.join(CASES)}")
+    ap.add_argument("--tiles", type=int, default=200, help="Chips per download case (default: 200)")
+    ap.add_argument("--workers", type=int, default=16, help="Download workers (default: 16)")
+    ap.add_argument("--latency", type=float, default=0.05, help="Stub WMS seconds per request")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Stub WMS 429/503 fraction")
+    ap.add_argument("--blank-rate", type=float, default=0.0, help="Stub WMS blank tile fraction")
+    ap.add_argument("--repeat", type=int, default=1, help="Best of N runs per case")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--work-dir", default="", help="Scratch directory (default: a temp dir)")
+    ap.add_argument("--out", default="", help="Write the results as JSON")
+    ap.add_argument("--baseline", default="", help="Compare against this results JSON")
+    ap.add_argument("--save-baseline", default="", help="Also write the results here")
+    ap.add_argument("--tolerance", type=float, default=TOLERANCE,
+                    help=f"Slowdown counted as a regression (default: {TOLERANCE})")
+    ap.add_argument("--generate", default="", help="Only write the synthetic CSVs to this directory")
+    args = ap.parse_args()
+
+    if args.generate:
+        t0 = time.perf_counter()
+        paths = generate(args.generate, args.rows, args.seed)
+        print(f"[OK] Wrote {args.rows} buildings to {paths[0]} and solar points to "
+              f"{paths[1]} in {time.perf_counter() - t0:.1f}s")
+        return
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        ap.error(f"unknown case(s) {unknown}; choose from {list(CASES)}")
+
+    # the scripts write .cache/ and outputs relative to the cwd: keep them in the scratch dir
+    out = os.path.abspath(args.out) if args.out else ""
+    saves = [os.path.abspath(p) for p in (args.save_baseline,) if p]
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else ""
+    cwd = os.getcwd()
+    work = args.work_dir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(work, exist_ok=True)
+    os.chdir(work)
+    try:
+        t0 = time.perf_counter()
+        buildings_csv, solar_csv = generate("data", args.rows, args.seed)
+        print(f"[INFO] Synthetic data: {args.rows} buildings in {time.perf_counter() - t0:.1f}s "
+              f"({work})")
+        results = run_cases(cases, buildings_csv, solar_csv, args)
+    finally:
+        os.chdir(cwd)
+        if not args.work_dir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {"meta": {"rows": args.rows, "tiles": args.tiles, "workers": args.workers,
+                       "latency": args.latency, "error_rate": args.error_rate,
+                       "repeat": args.repeat, "python": platform.python_version(),
+                       "machine": platform.machine(), "cpus": os.cpu_count(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "cases": results}
+    for path in [out] + saves:
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"[OK] Results saved in {path}")
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("rows") != args.rows:
+            print(f"[WARN] Baseline used {baseline['meta'].get('rows')} rows, this run {args.rows}")
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(f"[WARN] Slower than baseline by more than {args.tolerance:.0%}: "
+                  f"{', '.join(regressed)}")
+            sys.exit(1)
+        print("[OK] No regressions")
+
+
+if __name__ == "__main__":
+    main()
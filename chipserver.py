@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Local chip server: decoded orthophoto chips by LV95 coordinate, shared across jobs.
+- GET /chip?x=&y=&size=256&m=0.075[&format=raw|png] returns the chip centred
+  on (x, y) (named ortho_{int(x)}_{int(y)}.png, as in the download scripts)
+- Lookup: size-bounded in-memory LRU of decoded arrays -> chip directories on
+  disk (--dir size:m_per_px:path) -> WMS fallback; fetched chips are written
+  to --cache-dir, so no chip is requested from the WMS twice
+- Concurrent requests for the same chip wait on a single fetch
+- format=raw answers uint8 HxWx3 bytes (shape in X-Chip-Shape), format=png the
+  encoded chip, usable as an <img src> in map popups; GET /stats for hit rates
+- ChipClient is the Python side (keep-alive connection per thread, numpy arrays)
+
+Example:
+  python chipserver.py --port 8765 --max-mb 2048 &
+  python infer.py --weights model.torchscript --chip-server http://127.0.0.1:8765/
+Dep: pip install numpy pillow requests
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+import requests
+from PIL import Image
+
+from wms import (LAYER, WMS_URL, RateLimiter, chip_bbox, fetch_getmap, getmap_params,
+                 make_session, write_atomic)
+
+PORT = 8765
+MAX_MB = 1024
+CACHE_DIR = ".cache/chips-wms"
+# (size px, m/px): chip directories of the download scripts
+DIRS = ["125:0.20:true-orthophoto-125px", "125:0.20:unlabeled-orthophoto-125px",
+        "256:0.075:true-orthophoto-256px", "256:0.075:unlabeled-orthophoto-256px"]
+
+
+def parse_dir_spec(spec):
+    """'256:0.075:true-orthophoto-256px' -> ((256, 0.075), 'true-orthophoto-256px')."""
+    size, m_per_px, path = spec.split(":", 2)
+    return (int(size), round(float(m_per_px), 6)), path
+
+
+class ChipLRU:
+    """Thread-safe LRU of decoded chips, bounded by the total array bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            self._items[key] = img
+            self.bytes += img.nbytes
+            while self.bytes > self.max_bytes and len(self._items) > 1:
+                _, dropped = self._items.popitem(last=False)
+                self.bytes -= dropped.nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ChipService:
+    """LRU -> disk -> WMS lookup of chips keyed by (int x, int y, size, m/px)."""
+
+    def __init__(self, dirs=(), max_bytes=MAX_MB << 20, cache_dir=CACHE_DIR, url=WMS_URL,
+                 layer=LAYER, fetch=True, workers=8, rps=0.0, retries=5):
+        self.dirs = {}
+        for spec in dirs:
+            key, path = parse_dir_spec(spec)
+            self.dirs.setdefault(key, []).append(path)
+        self.lru = ChipLRU(max_bytes)
+        self.cache_dir = cache_dir
+        self.url, self.layer = url, layer
+        self.fetch = fetch
+        self.retries = retries
+        self.session = make_session(workers) if fetch else None
+        self.limiter = RateLimiter(rps)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {"memory": 0, "disk": 0, "wms": 0, "missing": 0, "errors": 0}
+
+    def _fetch_dir(self, size, m_per_px):
+        return os.path.join(self.cache_dir, f"{size}px_{m_per_px:g}m")
+
+    def path(self, key):
+        """Path of the chip on disk (configured dirs first, then the fetch cache), or None."""
+        x, y, size, m_per_px = key
+        name = f"ortho_{x}_{y}.png"
+        for d in self.dirs.get((size, m_per_px), []) + [self._fetch_dir(size, m_per_px)]:
+            p = os.path.join(d, name)
+            if os.path.isfile(p):
+                return p
+        return None
+
+    def _load(self, key):
+        """(decoded chip, source) from disk or the WMS; raises FileNotFoundError if unavailable."""
+        x, y, size, m_per_px = key
+        p = self.path(key)
+        if p is not None:
+            with Image.open(p) as im:
+                return np.asarray(im.convert("RGB")), "disk"
+        if not self.fetch:
+            raise FileNotFoundError(f"no chip ortho_{x}_{y}.png for {size}px at {m_per_px} m/px")
+        data = fetch_getmap(self.session,
+                            getmap_params(chip_bbox(x, y, size, m_per_px), size, size, self.layer),
+                            self.url, self.limiter, self.retries)
+        os.makedirs(self._fetch_dir(size, m_per_px), exist_ok=True)
+        write_atomic(os.path.join(self._fetch_dir(size, m_per_px), f"ortho_{x}_{y}.png"), data)
+        with Image.open(io.BytesIO(data)) as im:
+            return np.asarray(im.convert("RGB")), "wms"
+
+    def get(self, x, y, size=256, m_per_px=0.075):
+        """Decoded (size, size, 3) uint8 chip; concurrent misses share one load."""
+        key = (int(x), int(y), int(size), round(float(m_per_px), 6))
+        img = self.lru.get(key)
+        if img is not None:
+            self.count("memory")
+            return img
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner:
+                event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait()
+            img = self.lru.get(key)
+            if img is not None:
+                self.count("memory")
+                return img
+            # the owner failed (or the chip was evicted already): load it here
+        try:
+            img, source = self._load(key)
+            img.setflags(write=False)
+            self.lru.put(key, img)
+            self.count(source)
+            return img
+        finally:
+            if owner:
+                with self._lock:
+                    del self._inflight[key]
+                event.set()
+
+    def count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def summary(self):
+        served = sum(self.stats[k] for k in ("memory", "disk", "wms"))
+        return {**self.stats, "chips_cached": len(self.lru), "cache_mb": round(self.lru.bytes / 2**20, 1),
+                "hit_rate": self.stats["memory"] / served if served else 0.0}
+
+
+def make_server(service, port=PORT, host="127.0.0.1"):
+    """HTTP server around a ChipService (caller runs serve_forever, e.g. in a thread)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive for ChipClient sessions
+        disable_nagle_algorithm = True  # headers and body go out without waiting for ACKs
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status, body, ctype="text/plain", headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers:
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                self._send(200, json.dumps(service.summary()).encode(), "application/json")
+                return
+            if url.path != "/chip":
+                self._send(404, b"use /chip?x=&y=&size=&m= or /stats")
+                return
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                x, y = float(q["x"]), float(q["y"])
+                size, m_per_px = int(q.get("size", 256)), float(q.get("m", 0.075))
+            except (KeyError, ValueError) as e:
+                self._send(400, f"bad request: {e}".encode())
+                return
+            try:
+                img = service.get(x, y, size, m_per_px)
+            except FileNotFoundError as e:
+                service.count("missing")
+                self._send(404, str(e).encode())
+                return
+            except (requests.RequestException, OSError, ValueError) as e:
+                service.count("errors")
+                self._send(502, f"{type(e).__name__}: {e}".encode())
+                return
+            if q.get("format", "raw") == "png":
+                buf = io.BytesIO()
+                Image.fromarray(img).save(buf, format="PNG")
+                self._send(200, buf.getvalue(), "image/png",
+                           [("Cache-Control", "max-age=86400")])
+            else:
+                self._send(200, img.tobytes(), "application/octet-stream",
+                           [("X-Chip-Shape", ",".join(map(str, img.shape)))])
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class ChipClient:
+    """
+    Chips from a running chipserver.py. One keep-alive http.client connection per
+    thread: a hot chip costs a few hundred microseconds, several times less than
+    going through a requests.Session.
+    """
+
+    def __init__(self, url=f"http://127.0.0.1:{PORT}/", timeout=120):
+        u = urlparse(url)
+        self.host, self.port = u.hostname, u.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port,
+                                                                 timeout=self.timeout)
+        return conn
+
+    def get(self, x, y, size=256, m_per_px=0.075):
+        """(size, size, 3) uint8 chip; FileNotFoundError if the server has none."""
+        path = f"/chip?{urlencode({'x': x, 'y': y, 'size': size, 'm': m_per_px})}"
+        for attempt in (0, 1):
+            conn = self._conn()
+            try:
+                conn.request("GET", path)
+                r = conn.getresponse()
+                body = r.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # server restarted or closed the idle connection: reconnect once
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+        if r.status == 404:
+            raise FileNotFoundError(body.decode(errors="replace"))
+        if r.status != 200:
+            raise OSError(f"chip server answered {r.status}: {body[:200]!r}")
+        shape = tuple(int(v) for v in r.getheader("X-Chip-Shape").split(","))
+        return np.frombuffer(body, dtype=np.uint8).reshape(shape)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve decoded chips by LV95 coordinate")
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--dir", action="append", default=None,
+                    help="size:m_per_px:chip_dir, repeatable (default: the four download dirs)")
+    ap.add_argument("--max-mb", type=int, default=MAX_MB,
+                    help=f"In-memory LRU size in MB of decoded chips (default: {MAX_MB})")
+    ap.add_argument("--cache-dir", default=CACHE_DIR,
+                    help=f"Where chips fetched from the WMS are stored (default: {CACHE_DIR})")
+    ap.add_argument("--wms-url", default=WMS_URL,
+                    help="WMS endpoint (e.g. http://127.0.0.1:8089/ for stub_wms.py)")
+    ap.add_argument("--no-fetch", action="store_true", help="Serve only chips on disk")
+    ap.add_argument("--workers", type=int, default=8, help="Pooled WMS connections")
+    ap.add_argument("--rps", type=float, default=0.0, help="Max WMS requests per second")
+    args = ap.parse_args()
+
+    service = ChipService(args.dir or DIRS, args.max_mb << 20, args.cache_dir, args.wms_url,
+                          fetch=not args.no_fetch, workers=args.workers, rps=args.rps)
+    server = make_server(service, args.port)
+    print(f"[OK] Chip server on http://127.0.0.1:{args.port}/chip?x=&y=&size=&m= "
+          f"(LRU {args.max_mb} MB)")
+    t0 = time.perf_counter()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    s = service.summary()
+    print(f"[INFO] {time.perf_counter() - t0:.0f}s: {s['memory']} from memory, {s['disk']} from "
+          f"disk, {s['wms']} from the WMS, {s['missing']} missing ({s['hit_rate']:.1%} hit rate)")
+
+
+if __name__ == "__main__":
+    main()
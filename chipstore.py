@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Sharded binary chip store: packs loose ortho_{x}_{y}.png chips into
+fixed-size uint8 .npy shards plus a coordinate/label index.
+- Layout: <store>/store.json, <store>/index.npz (x, y, label, shard, offset),
+  <store>/shard-00000.npy ... each of shape (n, H, W, C)
+- Shards are opened with mmap, so store[i] is a zero-copy view and random
+  batches need no PNG decode
+- `bench` compares random batch reads against decoding the PNG directories
+
+Examples:
+  python chipstore.py pack --out chips-125px --dir true-orthophoto-125px:1 --dir unlabeled-orthophoto-125px:0
+  python chipstore.py bench --store chips-125px --dir true-orthophoto-125px:1 --dir unlabeled-orthophoto-125px:0
+Dep: pip install numpy pillow
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+SHARD_SIZE = 2048
+CHIP_RE = re.compile(r"ortho_(-?\d+)_(-?\d+)\.png$")
+
+
+def list_chips(chip_dir):
+    """Sorted [(path, x, y)] of the ortho_{x}_{y}.png files in chip_dir."""
+    out = []
+    for name in sorted(os.listdir(chip_dir)):
+        m = CHIP_RE.match(name)
+        if m:
+            out.append((os.path.join(chip_dir, name), int(m.group(1)), int(m.group(2))))
+    return out
+
+
+def parse_dir_spec(spec):
+    """'true-orthophoto-125px:1' -> ('true-orthophoto-125px', 1); label defaults to -1."""
+    path, sep, label = spec.rpartition(":")
+    if not sep or not label.lstrip("-").isdigit():
+        return spec, -1
+    return path, int(label)
+
+
+def decode_png(path):
+    with Image.open(path) as im:
+        return np.array(im.convert("RGB"))
+
+
+class ChipStoreWriter:
+    """Appends (H, W, C) uint8 chips to shards of shard_size chips each."""
+
+    def __init__(self, root, height, width, channels=3, shard_size=SHARD_SIZE,
+                 extra_meta=None):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.shape = (height, width, channels)
+        self.shard_size = shard_size
+        self.extra_meta = extra_meta or {}
+        self.cols = {"x": [], "y": [], "label": [], "shard": [], "offset": []}
+        self._shard = None
+        self._n = 0  # chips in the current shard
+        self._shards = 0
+
+    def _shard_path(self, i):
+        return os.path.join(self.root, f"shard-{i:05d}.npy")
+
+    def add(self, chip, x, y, label=-1):
+        if chip.shape != self.shape:
+            raise ValueError(f"chip shape {chip.shape} != store shape {self.shape}")
+        if self._shard is None:
+            self._shard = np.lib.format.open_memmap(
+                self._shard_path(self._shards), mode="w+", dtype=np.uint8,
+                shape=(self.shard_size, *self.shape))
+        self._shard[self._n] = chip
+        for k, v in zip(self.cols, (x, y, label, self._shards, self._n)):
+            self.cols[k].append(v)
+        self._n += 1
+        if self._n == self.shard_size:
+            self._finish_shard()
+
+    def _finish_shard(self):
+        if self._shard is None:
+            return
+        path = self._shard_path(self._shards)
+        if self._n < self.shard_size:
+            # rewrite the last shard with its real length instead of zero padding
+            data = np.array(self._shard[:self._n])
+            del self._shard
+            np.save(path, data)
+        else:
+            self._shard.flush()
+            del self._shard
+        self._shard = None
+        self._n = 0
+        self._shards += 1
+
+    def close(self):
+        self._finish_shard()
+        np.savez(os.path.join(self.root, "index.npz"),
+                 x=np.asarray(self.cols["x"], dtype=np.int32),
+                 y=np.asarray(self.cols["y"], dtype=np.int32),
+                 label=np.asarray(self.cols["label"], dtype=np.int8),
+                 shard=np.asarray(self.cols["shard"], dtype=np.int32),
+                 offset=np.asarray(self.cols["offset"], dtype=np.int32))
+        meta = {"height": self.shape[0], "width": self.shape[1],
+                "channels": self.shape[2], "shard_size": self.shard_size,
+                "count": len(self.cols["x"]), "shards": self._shards, **self.extra_meta}
+        with open(os.path.join(self.root, "store.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChipStore:
+    """Read side of a packed store; shards are memory-mapped on first use."""
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "store.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with np.load(os.path.join(root, "index.npz")) as idx:
+            self.x, self.y = idx["x"], idx["y"]
+            self.labels = idx["label"]
+            self.shard, self.offset = idx["shard"], idx["offset"]
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def shape(self):
+        return self.meta["height"], self.meta["width"], self.meta["channels"]
+
+    def _mmap(self, i):
+        arr = self._shards.get(i)
+        if arr is None:
+            arr = np.load(os.path.join(self.root, f"shard-{i:05d}.npy"), mmap_mode="r")
+            self._shards[i] = arr
+        return arr
+
+    def __getitem__(self, i):
+        """Zero-copy (H, W, C) view of chip i."""
+        return self._mmap(int(self.shard[i]))[self.offset[i]]
+
+    def get_batch(self, indices, out=None):
+        """Gather chips into one (B, H, W, C) array (optionally a preallocated out)."""
+        indices = np.asarray(indices)
+        if out is None:
+            out = np.empty((len(indices), *self.shape), dtype=np.uint8)
+        shards = self.shard[indices]
+        for s in np.unique(shards):
+            sel = np.nonzero(shards == s)[0]
+            # sorted offsets read each shard front to back
+            order = np.argsort(self.offset[indices[sel]])
+            out[sel[order]] = self._mmap(int(s))[self.offset[indices[sel[order]]]]
+        return out
+
+    def find(self, x, y):
+        """Index of the chip named ortho_{x}_{y}, or -1."""
+        hit = np.nonzero((self.x == int(x)) & (self.y == int(y)))[0]
+        return int(hit[0]) if len(hit) else -1
+
+
+def pack(dirs, out, shard_size=SHARD_SIZE, workers=8):
+    """Pack [(chip_dir, label)] into a store at out. Returns the store metadata."""
+    chips = [(path, x, y, label) for d, label in dirs for path, x, y in list_chips(d)]
+    if not chips:
+        raise ValueError("no ortho_{x}_{y}.png chips found")
+    h, w, c = decode_png(chips[0][0]).shape
+    skipped = 0
+    t0 = time.perf_counter()
+    writer = ChipStoreWriter(out, h, w, c, shard_size)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # decode in threads (Pillow releases the GIL), write in order;
+        # chunking keeps at most one chunk of decoded chips in memory
+        for start in range(0, len(chips), 512):
+            chunk = chips[start:start + 512]
+            for (path, x, y, label), img in zip(chunk, pool.map(decode_png, (p[0] for p in chunk))):
+                if img.shape != (h, w, c):
+                    skipped += 1
+                    print(f"[WARN] Skipping {path}: shape {img.shape} != {(h, w, c)}")
+                    continue
+                writer.add(img, x, y, label)
+    meta = writer.close()
+    elapsed = time.perf_counter() - t0
+    print(f"[OK] Packed {meta['count']} chips ({h}x{w}x{c}) into {meta['shards']} "
+          f"shards in {out} in {elapsed:.1f}s, {skipped} skipped")
+    return meta
+
+
+def bench(store_dir, dirs, batch=64, batches=50, seed=0):
+    """Random batch throughput: PNG directory decode vs memory-mapped store."""
+    rng = np.random.default_rng(seed)
+    store = ChipStore(store_dir)
+    paths = [p for d, _ in dirs for p, _, _ in list_chips(d)]
+    results = {}
+
+    t0 = time.perf_counter()
+    for _ in range(batches):
+        sel = rng.choice(len(paths), size=batch)
+        np.stack([decode_png(paths[i]) for i in sel])
+    results["png"] = batch * batches / (time.perf_counter() - t0)
+
+    out = np.empty((batch, *store.shape), dtype=np.uint8)
+    t0 = time.perf_counter()
+    for _ in range(batches):
+        store.get_batch(rng.choice(len(store), size=batch), out=out)
+    results["store"] = batch * batches / (time.perf_counter() - t0)
+
+    for k, v in results.items():
+        print(f"[INFO] {k:>5}: {v:,.0f} images/s (batch {batch})")
+    print(f"[INFO] speed-up: {results['store'] / results['png']:.1f}x")
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pack PNG chips into memory-mapped shards")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pack", help="Pack chip directories into a store")
+    p.add_argument("--dir", action="append", required=True,
+                   help="Chip directory with optional label, e.g. true-orthophoto-125px:1")
+    p.add_argument("--out", required=True, help="Output store directory")
+    p.add_argument("--shard-size", type=int, default=SHARD_SIZE,
+                   help=f"Chips per shard (default: {SHARD_SIZE})")
+    p.add_argument("--workers", type=int, default=8, help="PNG decode threads")
+    b = sub.add_parser("bench", help="Compare random batch reads: PNG vs store")
+    b.add_argument("--store", required=True)
+    b.add_argument("--dir", action="append", required=True)
+    b.add_argument("--batch", type=int, default=64)
+    b.add_argument("--batches", type=int, default=50)
+    args = ap.parse_args()
+
+    dirs = [parse_dir_spec(d) for d in args.dir]
+    missing = [d for d, _ in dirs if not os.path.isdir(d)]
+    if missing:
+        print(f"[ERROR] Directory not found: {', '.join(missing)}")
+        return
+    if args.cmd == "pack":
+        pack(dirs, args.out, args.shard_size, args.workers)
+    else:
+        bench(args.store, dirs, args.batch, args.batches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Columnar Parquet cache for the dataset/ CSVs.
+- First load converts the CSV once, with compact dtypes (integer and
+  whole-number columns without gaps downcast, e.g. coordinates to int32;
+  columns with missing values stay float64; repetitive strings as category)
+- The copy lives in .cache/parquet/<name>-<path hash>.parquet and is
+  invalidated when the CSV's mtime/size and SHA-1 no longer match
+- Concurrent cold loads each convert into their own temporary file and
+  atomically replace the cache; the last one wins, both are usable
+- load_csv/iter_csv read only the requested columns
+- Without pyarrow everything falls back to pandas.read_csv
+
+Convert ahead of time:
+  python datacache.py dataset/*.csv
+  python datacache.py dataset/*.csv --stamp .cache/parquet/dataset.json  # as pipeline.py does
+Dep: pip install pandas pyarrow
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # optional: plain CSV reads without it
+    pq = None
+
+CACHE_DIR = ".cache/parquet"
+
+
+def file_sha1(path, block=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compact_dtypes(df):
+    """Smallest lossless dtypes: downcast integers/whole floats, categorise repetitive strings."""
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_float_dtype(s):
+            if s.notna().all() and (s % 1 == 0).all():
+                df[col] = pd.to_numeric(s.astype("int64"), downcast="integer")
+        elif pd.api.types.is_integer_dtype(s):
+            df[col] = pd.to_numeric(s, downcast="integer")
+        elif s.dtype == object or pd.api.types.is_string_dtype(s):
+            if s.nunique(dropna=True) <= len(s) // 2:
+                df[col] = s.astype("category")
+    return df
+
+
+def cache_paths(csv_path, cache_dir=CACHE_DIR):
+    """(parquet, meta) paths for csv_path, keyed by a hash of its absolute path."""
+    path = os.path.normpath(os.path.abspath(csv_path))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    base = os.path.join(cache_dir, f"{stem}-{hashlib.sha1(path.encode()).hexdigest()[:10]}")
+    return base + ".parquet", base + ".json"
+
+
+def _replace_atomic(path, write):
+    """write(tmp_path) into a private temporary file next to path, then rename it over path."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_json(path, obj):
+    def write(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+    _replace_atomic(path, write)
+
+
+def _fresh(csv_path, meta_path):
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    st = os.stat(csv_path)
+    if meta.get("mtime") == st.st_mtime and meta.get("size") == st.st_size:
+        return True
+    # touched but possibly unchanged: fall back to the content hash
+    if meta.get("size") == st.st_size and meta.get("sha1") == file_sha1(csv_path):
+        meta["mtime"] = st.st_mtime
+        _write_json(meta_path, meta)
+        return True
+    return False
+
+
+def ensure_parquet(csv_path, cache_dir=CACHE_DIR, force=False):
+    """Path of an up-to-date Parquet copy of csv_path (converted if needed)."""
+    pq_path, meta_path = cache_paths(csv_path, cache_dir)
+    if not force and os.path.exists(pq_path) and _fresh(csv_path, meta_path):
+        return pq_path
+
+    t0 = time.perf_counter()
+    df = compact_dtypes(pd.read_csv(csv_path, low_memory=False))
+    os.makedirs(cache_dir, exist_ok=True)
+    _replace_atomic(pq_path, lambda tmp: df.to_parquet(tmp, index=False))
+    st = os.stat(csv_path)
+    _write_json(meta_path, {"csv": csv_path, "mtime": st.st_mtime, "size": st.st_size,
+                            "sha1": file_sha1(csv_path)})
+    print(f"[INFO] Cached {csv_path} -> {pq_path} "
+          f"({len(df)} rows, {time.perf_counter() - t0:.1f}s)", file=sys.stderr)
+    return pq_path
+
+
+def load_csv(csv_path, columns=None, cache_dir=CACHE_DIR):
+    """DataFrame of csv_path (only `columns` if given), served from the Parquet cache."""
+    if pq is None:
+        return pd.read_csv(csv_path, usecols=columns)
+    return pd.read_parquet(ensure_parquet(csv_path, cache_dir), columns=columns)
+
+
+def iter_csv(csv_path, columns=None, chunk_rows=200_000, cache_dir=CACHE_DIR):
+    """Yield DataFrame chunks of csv_path with bounded memory."""
+    if pq is None:
+        yield from pd.read_csv(csv_path, usecols=columns, chunksize=chunk_rows)
+        return
+    pf = pq.ParquetFile(ensure_parquet(csv_path, cache_dir))
+    for batch in pf.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield batch.to_pandas()
+
+
+def csv_columns(csv_path, cache_dir=CACHE_DIR):
+    """Column names of csv_path (Parquet schema when cached, else the CSV header)."""
+    pq_path, meta_path = cache_paths(csv_path, cache_dir)
+    if pq is not None and os.path.exists(pq_path) and _fresh(csv_path, meta_path):
+        return list(pq.read_schema(pq_path).names)
+    return list(pd.read_csv(csv_path, nrows=0).columns)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert dataset CSVs to the Parquet cache")
+    ap.add_argument("csv", nargs="+", help="CSV files to convert")
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    ap.add_argument("--force", action="store_true", help="Reconvert even if fresh")
+    ap.add_argument("--stamp", default="",
+                    help="Also write {csv: {parquet, sha1}} here; its content only changes "
+                         "with the CSVs, so pipeline stages can depend on it")
+    args = ap.parse_args()
+
+    if pq is None:
+        print("[ERROR] pyarrow is required: pip install pyarrow", file=sys.stderr)
+        sys.exit(1)
+    stamp = {}
+    for path in args.csv:
+        if not os.path.exists(path):
+            print(f"[WARN] File not found: {path}", file=sys.stderr)
+            continue
+        pq_path = ensure_parquet(path, args.cache_dir, args.force)
+        with open(cache_paths(path, args.cache_dir)[1], encoding="utf-8") as f:
+            stamp[path] = {"parquet": pq_path, "sha1": json.load(f)["sha1"]}
+        t0 = time.perf_counter()
+        df = pd.read_parquet(pq_path)
+        mem = df.memory_usage(deep=True).sum() / 1e6
+        print(f"[OK] {pq_path}: {len(df)} rows, {os.path.getsize(pq_path) / 1e6:.1f} MB "
+              f"on disk (CSV {os.path.getsize(path) / 1e6:.1f} MB), {mem:.1f} MB in memory, "
+              f"loaded in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    if args.stamp:
+        if len(stamp) < len(args.csv):
+            sys.exit(1)  # no stamp: a missing CSV must not look converted
+        os.makedirs(os.path.dirname(args.stamp) or ".", exist_ok=True)
+        _write_json(args.stamp, stamp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Pre-aggregated building density pyramid in LV95 (EPSG:2056).
+- Bins every building (buildings_BE.csv, "total") and every solar installation
+  (BernSolarPanelBuildings.csv, "solar") into a square grid, streamed in chunks
+- Level 0 uses --cell metres; each further level doubles the cell size, so a
+  canton-wide map needs only a few thousand cells whatever the point count
+- Stored as one .npy per level and count in .cache/density/, read memory-mapped;
+  rebuilt automatically when a source CSV changes
+- plotmap.py (--kind density) and folium_map.py (--mode density) draw from it
+
+Example:
+  python density.py --total dataset/buildings_BE.csv --solar dataset/BernSolarPanelBuildings.csv
+Dep: pip install numpy pandas (pyarrow for the Parquet cache)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from datacache import csv_columns, iter_csv
+
+TOTAL_PATH = "dataset/buildings_BE.csv"
+SOLAR_PATH = "dataset/BernSolarPanelBuildings.csv"
+DENSITY_DIR = ".cache/density"
+
+CELL_M = 50
+LEVELS = 8  # 50 m .. 6.4 km
+CHUNK_ROWS = 500_000
+
+# Coordinate column pairs tried in order (case-insensitive)
+CANDIDATES = [
+    ("gkode", "gkodn"),
+    ("_x", "_y"),
+    ("east_lv95", "north_lv95"),
+    ("x_lv95", "y_lv95"),
+    ("x", "y"),
+]
+
+VALUES = ("total", "solar", "ratio")
+
+
+def xy_columns(csv_path):
+    cols = {c.lower(): c for c in csv_columns(csv_path)}
+    for ex, ny in CANDIDATES:
+        if ex in cols and ny in cols:
+            return cols[ex], cols[ny]
+    raise ValueError(f"no LV95 coordinate columns in {csv_path}: {list(cols.values())}")
+
+
+def iter_xy(csv_path, chunk_rows=CHUNK_ROWS):
+    """Yield (x, y) float64 arrays of csv_path in chunks, rows with missing values dropped."""
+    x_col, y_col = xy_columns(csv_path)
+    for chunk in iter_csv(csv_path, [x_col, y_col], chunk_rows):
+        x = chunk[x_col].to_numpy(dtype=np.float64)
+        y = chunk[y_col].to_numpy(dtype=np.float64)
+        ok = np.isfinite(x) & np.isfinite(y)
+        yield x[ok], y[ok]
+
+
+def source_signature(paths, cell, levels):
+    sig = {"cell": cell, "levels": levels, "sources": {}}
+    for name, path in paths.items():
+        st = os.stat(path)
+        sig["sources"][name] = {"path": path, "mtime": st.st_mtime, "size": st.st_size}
+    return sig
+
+
+def coarsen(grid):
+    """Sum 2x2 blocks (grid dimensions are even)."""
+    ny, nx = grid.shape
+    return grid.reshape(ny // 2, 2, nx // 2, 2).sum(axis=(1, 3), dtype=grid.dtype)
+
+
+def build(total_path, solar_path, root=DENSITY_DIR, cell=CELL_M, levels=LEVELS,
+          chunk_rows=CHUNK_ROWS):
+    """Bin both sources into a pyramid under root; returns the metadata dict."""
+    t0 = time.perf_counter()
+    paths = {"total": total_path, "solar": solar_path}
+
+    # pass 1: extent, snapped to the coarsest cell so every level nests exactly
+    top = cell * 2 ** (levels - 1)
+    lo = np.array([np.inf, np.inf])
+    hi = -lo
+    for path in paths.values():
+        for x, y in iter_xy(path, chunk_rows):
+            if len(x):
+                lo = np.minimum(lo, [x.min(), y.min()])
+                hi = np.maximum(hi, [x.max(), y.max()])
+    if not np.isfinite(lo).all():
+        raise ValueError("no valid coordinates in the sources")
+    x0, y0 = np.floor(lo / top) * top
+    nx, ny = (np.floor((hi - [x0, y0]) / top).astype(int) + 1) * 2 ** (levels - 1)
+
+    # pass 2: counts at level 0 (row 0 = southernmost cells)
+    base = {}
+    rows = {}
+    for name, path in paths.items():
+        counts = np.zeros(ny * nx, dtype=np.int32)
+        rows[name] = 0
+        for x, y in iter_xy(path, chunk_rows):
+            ix = ((x - x0) // cell).astype(np.int64)
+            iy = ((y - y0) // cell).astype(np.int64)
+            counts += np.bincount(iy * nx + ix, minlength=ny * nx).astype(np.int32)
+            rows[name] += len(x)
+        base[name] = counts.reshape(ny, nx)
+
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    grids = base
+    for level in range(levels):
+        if level:
+            grids = {name: coarsen(g) for name, g in grids.items()}
+        for name, g in grids.items():
+            np.save(os.path.join(root, f"{name}_{level}.npy"), g)
+
+    meta = {"x0": float(x0), "y0": float(y0), "cell": cell, "levels": levels,
+            "shape": [int(ny), int(nx)], "rows": rows,
+            "signature": source_signature(paths, cell, levels)}
+    with open(os.path.join(root, "pyramid.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"[INFO] Built density pyramid {root}: {rows['total']} buildings, "
+          f"{rows['solar']} solar, {nx}x{ny} cells of {cell} m, {levels} levels, "
+          f"{time.perf_counter() - t0:.1f}s")
+    return meta
+
+
+class DensityPyramid:
+    """Memory-mapped density levels written by build()."""
+
+    def __init__(self, root=DENSITY_DIR):
+        self.root = root
+        with open(os.path.join(root, "pyramid.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.x0 = self.meta["x0"]
+        self.y0 = self.meta["y0"]
+        self.levels = self.meta["levels"]
+        self.cells = [self.meta["cell"] * 2 ** i for i in range(self.levels)]
+
+    def bounds(self):
+        """(xmin, ymin, xmax, ymax) of the whole grid in LV95."""
+        ny, nx = self.meta["shape"]
+        cell = self.meta["cell"]
+        return self.x0, self.y0, self.x0 + nx * cell, self.y0 + ny * cell
+
+    def level_for(self, cell_m):
+        """Finest level whose cells are at least cell_m wide (coarsest if none)."""
+        for level, c in enumerate(self.cells):
+            if c >= cell_m:
+                return level
+        return self.levels - 1
+
+    def counts(self, level, name):
+        return np.load(os.path.join(self.root, f"{name}_{level}.npy"), mmap_mode="r")
+
+    def grid(self, level, value="ratio"):
+        """
+        (values, x_edges, y_edges) of one level; rows run south to north.
+        value: total | solar | ratio (solar per building, NaN where a cell has none).
+        """
+        if value == "ratio":
+            total = self.counts(level, "total")
+            solar = self.counts(level, "solar")
+            with np.errstate(divide="ignore", invalid="ignore"):
+                values = np.where(total > 0, solar / np.maximum(total, 1), np.nan)
+        else:
+            values = self.counts(level, value)
+        ny, nx = values.shape
+        cell = self.cells[level]
+        return (values, self.x0 + np.arange(nx + 1) * cell,
+                self.y0 + np.arange(ny + 1) * cell)
+
+
+def ensure_pyramid(total_path=TOTAL_PATH, solar_path=SOLAR_PATH, root=DENSITY_DIR,
+                   cell=CELL_M, levels=LEVELS, rebuild=False):
+    """DensityPyramid for the sources, (re)building it when missing or stale."""
+    meta_path = os.path.join(root, "pyramid.json")
+    if not rebuild and os.path.exists(meta_path):
+        sig = source_signature({"total": total_path, "solar": solar_path}, cell, levels)
+        with open(meta_path, encoding="utf-8") as f:
+            if json.load(f).get("signature") == sig:
+                return DensityPyramid(root)
+    build(total_path, solar_path, root, cell, levels)
+    return DensityPyramid(root)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build the building density pyramid")
+    ap.add_argument("--total", default=TOTAL_PATH, help="CSV of all buildings")
+    ap.add_argument("--solar", default=SOLAR_PATH, help="CSV of solar installations")
+    ap.add_argument("--out", default=DENSITY_DIR, help="Pyramid directory")
+    ap.add_argument("--cell", type=float, default=CELL_M,
+                    help=f"Level 0 cell size in metres (default: {CELL_M})")
+    ap.add_argument("--levels", type=int, default=LEVELS,
+                    help=f"Number of levels, each doubling the cell size (default: {LEVELS})")
+    ap.add_argument("--rebuild", action="store_true", help="Rebuild even if fresh")
+    args = ap.parse_args()
+
+    pyramid = ensure_pyramid(args.total, args.solar, args.out, args.cell, args.levels,
+                             args.rebuild)
+    for level, cell in enumerate(pyramid.cells):
+        total = pyramid.counts(level, "total")
+        print(f"[INFO] level {level}: {cell:>6g} m cells, {total.shape[1]}x{total.shape[0]}, "
+              f"{np.count_nonzero(total)} non-empty")
+
+
+if __name__ == "__main__":
+    main()
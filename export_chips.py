@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Single-pass multi-resolution chip export.
+- Fetches one source tile per building at the finest requested m/px, large
+  enough to cover the widest requested footprint
+- Derives every (size, m/px) variant locally by resampling in a process pool
+- Adding a chip format later only re-runs the resampling, no network traffic
+  (the source geometry is kept in <source-dir>/source.json)
+- When the CSV has a split column (sample.py), each chip is also hard-linked
+  into <prefix>-<size>px/<split>/ for the YOLO data.yaml; chips whose split
+  changed are unlinked from the old one
+
+Examples:
+  # positives: true-orthophoto-125px (0.20 m/px) and true-orthophoto-256px (0.075 m/px)
+  python export_chips.py
+
+  # positives split like the negatives (sample.py --positives writes the _split.csv)
+  python export_chips.py --csv dataset/buildings_BE_matches_xy_split.csv
+
+  # negatives, plus a new 96px variant
+  python export_chips.py --csv dataset/building_sample_BE.csv --prefix unlabeled-orthophoto \
+      --out-dir unlabeled-orthophoto-source --variant 125:0.20 --variant 256:0.075 --variant 96:0.25
+Dep: pip install pandas requests pillow
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+from mosaic import download_mosaic
+from sample import SPLITS
+from wms import (LAYER, add_download_args, csv_jobs, download_options,
+                 download_tiles, open_manifest)
+
+CSV_PATH = "dataset/buildings_BE_matches_xy.csv"
+PREFIX = "true-orthophoto"
+SOURCE_DIR = "true-orthophoto-source"
+# (size px, m/px) of the chip sets produced so far by the per-size scripts
+VARIANTS = ["125:0.20", "256:0.075"]
+# geometry of the tiles in the source directory, written on first run
+SOURCE_META = "source.json"
+SPLIT_COL = "split"
+
+
+def parse_variant(spec):
+    """'125:0.20' -> (125, 0.2)"""
+    size, m_per_px = spec.split(":")
+    return int(size), float(m_per_px)
+
+
+def source_geometry(variants):
+    """Finest m/px and the pixel size needed to cover the widest variant at it."""
+    m_per_px = min(m for _, m in variants)
+    extent = max(size * m for size, m in variants)
+    return math.ceil(extent / m_per_px - 1e-9), m_per_px
+
+
+def load_source_geometry(src_dir, variants):
+    """
+    Source tile geometry for src_dir: read from its source.json when tiles were
+    already fetched (so new variants reuse them), otherwise derived from variants.
+    """
+    path = os.path.join(src_dir, SOURCE_META)
+    if not os.path.exists(path):
+        src_px, src_m_per_px = source_geometry(variants)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"px": src_px, "m_per_px": src_m_per_px}, f)
+        return src_px, src_m_per_px
+
+    with open(path, encoding="utf-8") as f:
+        meta = json.load(f)
+    src_px, src_m_per_px = meta["px"], meta["m_per_px"]
+    for size, m_per_px in variants:
+        if size * m_per_px > src_px * src_m_per_px + 1e-6:
+            raise ValueError(f"variant {size}px@{m_per_px} covers {size * m_per_px:.1f} m, "
+                             f"more than the {src_px * src_m_per_px:.1f} m source tiles "
+                             f"in {src_dir}; use a new --out-dir")
+        if m_per_px < src_m_per_px:
+            print(f"[WARN] Variant {size}px@{m_per_px} is finer than the source "
+                  f"({src_m_per_px} m/px) and will be upsampled")
+    return src_px, src_m_per_px
+
+
+def resample_chip(img, size, m_per_px, src_m_per_px):
+    """Centre crop of img covering size * m_per_px metres, resampled to size x size."""
+    half = size * m_per_px / src_m_per_px / 2.0
+    cx, cy = img.width / 2.0, img.height / 2.0
+    box = (cx - half, cy - half, cx + half, cy + half)
+    return img.resize((size, size), Image.LANCZOS, box=box)
+
+
+def derive_variants(src_file, outputs, src_m_per_px, force=False):
+    """Write every (out_file, size, m_per_px) variant of one source tile."""
+    todo = [o for o in outputs if force or not os.path.exists(o[0])]
+    if not todo:
+        return 0
+    with Image.open(src_file) as im:
+        img = im.convert("RGB")
+    for out_file, size, m_per_px in todo:
+        tmp = out_file + ".part"
+        resample_chip(img, size, m_per_px, src_m_per_px).save(tmp, format="PNG")
+        os.replace(tmp, out_file)
+    return len(todo)
+
+
+def link_splits(variant_dir, names_by_split):
+    """
+    Hard-link variant_dir/<name> into variant_dir/<split>/ for every split (a
+    copy where links are unsupported); removes chips no longer in a split.
+    """
+    linked = 0
+    present = [d for d in SPLITS if os.path.isdir(os.path.join(variant_dir, d))]
+    for split in sorted(set(present) | set(names_by_split)):
+        split_dir = os.path.join(variant_dir, split)
+        os.makedirs(split_dir, exist_ok=True)
+        names = names_by_split.get(split, set())
+        for name in set(os.listdir(split_dir)) - names:
+            os.remove(os.path.join(split_dir, name))
+        for name in names:
+            src, dst = os.path.join(variant_dir, name), os.path.join(split_dir, name)
+            if not os.path.exists(src):
+                continue
+            if os.path.exists(dst):
+                if os.path.samefile(src, dst):
+                    continue
+                os.remove(dst)  # chip re-derived (--force): link the new file
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+            linked += 1
+    return linked
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Fetch each building once and derive all chip sizes locally")
+    add_download_args(ap, CSV_PATH, SOURCE_DIR)
+    ap.add_argument("--prefix", default=PREFIX,
+                    help=f"Variant directories are <prefix>-<size>px (default: {PREFIX})")
+    ap.add_argument("--variant", action="append", default=None,
+                    help=f"size:m_per_px, repeatable, one per size (default: {' '.join(VARIANTS)})")
+    ap.add_argument("--procs", type=int, default=os.cpu_count(),
+                    help="Resampling processes (default: all cores)")
+    ap.add_argument("--skip-download", action="store_true",
+                    help="Only derive variants from source tiles already on disk")
+    ap.add_argument("--force", action="store_true",
+                    help="Re-derive variants that already exist")
+    ap.add_argument("--split-col", default=SPLIT_COL,
+                    help=f"CSV column with train/val/test; chips are also linked into "
+                         f"<prefix>-<size>px/<split>/ when present (default: {SPLIT_COL})")
+    args = ap.parse_args()
+
+    variants = [parse_variant(v) for v in (args.variant or VARIANTS)]
+    sizes = [size for size, _ in variants]
+    dup = sorted({size for size in sizes if sizes.count(size) > 1})
+    if dup:
+        # variants share <prefix>-<size>px: two m/px at one size would overwrite each other
+        ap.error(f"one --variant per size (duplicated: {', '.join(f'{s}px' for s in dup)}); "
+                 f"use another --prefix for a second m/px at the same size")
+    os.makedirs(args.out_dir, exist_ok=True)
+    try:
+        src_px, src_m_per_px = load_source_geometry(args.out_dir, variants)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    print(f"[INFO] Source tiles: {src_px}px at {src_m_per_px} m/px "
+          f"({src_px * src_m_per_px:.1f} m); variants: "
+          + ", ".join(f"{s}px@{m}" for s, m in variants))
+
+    df = pd.read_csv(args.csv)
+    jobs = csv_jobs(df, args.out_dir)
+
+    failed = 0
+    if not args.skip_download:
+        manifest = open_manifest(args)
+        opts = download_options(args, manifest)
+        try:
+            if args.mosaic:
+                stats = download_mosaic(jobs, src_px, src_px, src_m_per_px, layer=LAYER,
+                                        block_px=args.block_px, min_fill=args.min_fill,
+                                        **opts)
+            else:
+                stats = download_tiles(jobs, src_px, src_px, src_m_per_px, layer=LAYER,
+                                       **opts)
+            failed = stats["failed"]
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+    variant_dirs = [f"{args.prefix}-{size}px" for size, _ in variants]
+    for d in variant_dirs:
+        os.makedirs(d, exist_ok=True)
+
+    t0 = time.perf_counter()
+    sources, outputs = [], []
+    for _, _, src_file in jobs:
+        if not os.path.exists(src_file):
+            continue
+        name = os.path.basename(src_file)
+        sources.append(src_file)
+        outputs.append([(os.path.join(d, name), size, m)
+                        for d, (size, m) in zip(variant_dirs, variants)])
+
+    written = 0
+    with ProcessPoolExecutor(max_workers=args.procs) as pool:
+        for n in pool.map(derive_variants, sources, outputs,
+                          [src_m_per_px] * len(sources), [args.force] * len(sources),
+                          chunksize=64):
+            written += n
+    elapsed = time.perf_counter() - t0
+    print(f"[OK] Derived {written} chips from {len(sources)} source tiles in "
+          f"{elapsed:.1f}s into {', '.join(variant_dirs)}")
+
+    if args.split_col in df.columns:
+        names_by_split = {}
+        for split, (_, _, src_file) in zip(df[args.split_col].astype(str), jobs):
+            names_by_split.setdefault(split, set()).add(os.path.basename(src_file))
+        linked = sum(link_splits(d, names_by_split) for d in variant_dirs)
+        counts = {s: len(n) for s, n in names_by_split.items()}
+        print(f"[OK] Linked {linked} chips into <variant>/{{{','.join(sorted(counts))}}}/ "
+              f"(" + ", ".join(f"{s} {n}" for s, n in sorted(counts.items())) + " buildings)")
+    if failed:
+        # chips of the fetched tiles are derived anyway; the non-zero exit keeps
+        # pipeline.py from recording the stage as complete
+        print(f"[ERROR] {failed} source tiles failed; rerun (or --only-failed) to retry them")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Leaflet elements behind folium_map.py's canvas and lazy modes.
+- Kept out of folium_map.py so that branca/folium are only imported when a
+  map is actually built (not for --help or a failed column check)
+- Popups are rendered client-side by a JS function of [lat, lon, *fields]
+  (folium_map.POPUP_JS)
+Dep: pip install folium
+"""
+
+import json
+
+from branca.element import MacroElement, Template
+
+
+class CanvasPoints(MacroElement):
+    """All points as one JS array of circle markers on a shared canvas renderer."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var popup = {{ this.popup_js }};
+            var rows = {{ this.data }};
+            var renderer = L.canvas({padding: 0.5});
+            var style = {{ this.style }};
+            style.renderer = renderer;
+            for (var i = 0; i < rows.length; i++) {
+                var m = L.circleMarker([rows[i][0], rows[i][1]], style);
+                m.row = rows[i];
+                m.bindPopup(function (layer) { return popup(layer.row); }, {maxWidth: 350});
+                m.addTo({{ this._parent.get_name() }});
+            }
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, rows, popup_js, radius, alpha, color, fill):
+        super().__init__()
+        self._name = "CanvasPoints"
+        self.popup_js = popup_js
+        self.data = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+        self.style = json.dumps({"radius": radius, "color": color, "fill": True,
+                                 "fillColor": fill, "fillOpacity": alpha, "weight": 1})
+
+
+class LazyPoints(MacroElement):
+    """
+    Viewport points fetched from mapserver.py on every move; markers are diffed by
+    id, so the one with an open popup survives, and popups are fetched on open.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this.map_name }};
+            var group = {{ this._parent.get_name() }};
+            var server = {{ this.server }}, layer = {{ this.layer }};
+            var fields = {{ this.fields }};
+            var popup = {{ this.popup_js }};
+            var style = {{ this.style }};
+            style.renderer = L.canvas({padding: 0.5});
+            var markers = {}, seq = 0;
+
+            function render(rec) {
+                var row = [rec.lat, rec.lon];
+                fields.forEach(function (f) { row.push(rec[f] === undefined ? "N/A" : rec[f]); });
+                var html = popup(row);
+                if (rec.building) {
+                    html += "<div>Nearest building: EGID " + rec.building.EGID
+                        + " (" + rec.building.distance + " m)</div>";
+                }
+                return html;
+            }
+
+            function marker(p) {
+                var m = L.circleMarker([p[1], p[2]], style);
+                m.bindPopup("…", {maxWidth: 350});
+                m.on("popupopen", function (e) {
+                    fetch(server + "attrs?layer=" + layer + "&id=" + p[0])
+                        .then(function (r) { return r.json(); })
+                        .then(function (rec) { e.popup.setContent(render(rec)); })
+                        .catch(function (err) { e.popup.setContent("query server: " + err); });
+                });
+                return m;
+            }
+
+            function load() {
+                var b = map.getBounds(), id = ++seq;
+                var bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].join(",");
+                fetch(server + "points?layer=" + layer + "&limit={{ this.limit }}&bbox=" + bbox)
+                    .then(function (r) { return r.json(); })
+                    .then(function (d) {
+                        if (id !== seq) { return; }  // a newer viewport already asked
+                        var keep = {};
+                        d.rows.forEach(function (p) {
+                            keep[p[0]] = true;
+                            if (!markers[p[0]]) { markers[p[0]] = marker(p).addTo(group); }
+                        });
+                        for (var k in markers) {
+                            if (!keep[k]) { group.removeLayer(markers[k]); delete markers[k]; }
+                        }
+                    })
+                    .catch(function (err) { console.error("query server:", err); });
+            }
+
+            map.on("moveend", load);
+            load();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, map_name, server, layer, limit, fields, popup_js, radius, alpha,
+                 color, fill):
+        super().__init__()
+        self._name = "LazyPoints"
+        self.map_name = map_name
+        self.server = json.dumps(server.rstrip("/") + "/")
+        self.layer = json.dumps(layer)
+        self.limit = int(limit)
+        self.fields = json.dumps(fields)
+        self.popup_js = popup_js
+        self.style = json.dumps({"radius": radius, "color": color, "fill": True,
+                                 "fillColor": fill, "fillOpacity": alpha, "weight": 1})
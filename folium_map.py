@@ -2,18 +2,36 @@
 # -*- coding: utf-8 -*-
 """
 Shows ALL points from the BernSolarPanelBuildings CSV as Folium markers with detailed popups.
-Uses an iterative approach similar to GeoPandas for creating informative popups.
 - Input: CSV with LV95 coordinates (default columns: _x, _y)
 - Output: Interactive HTML with OSM/Esri layers and LayerControl
-Dep: pip install pandas pyproj folium
+- Render modes (--mode, picked from the point count with "auto"):
+    markers  one CircleMarker + pre-rendered popup per row (small sets)
+    cluster  client-side FastMarkerCluster, popups built in JS on click
+    canvas   one JS array drawn on a canvas renderer, popups built on click
+    density  colored grid from the density.py pyramid (no points, --csv unused)
+    lazy     no embedded data: viewport points and popups are fetched from a
+             running mapserver.py (--server) as the map moves (--csv unused)
+- --bench 10000,100000,477000 prints generation time and HTML size per mode
+- folium/branca are imported on first use and the LV95 -> WGS84 Transformer
+  is cached (projection.py), so --help and argument errors return at once;
+  mapd.py keeps them loaded across runs
+Dep: pip install pandas pyproj folium (pyarrow for the Parquet cache)
 """
 
 import argparse
+import json
 import os
 import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
 import pandas as pd
-from pyproj import Transformer
-import folium
+
+from datacache import csv_columns, load_csv
+from density import DENSITY_DIR, VALUES, DensityPyramid
+from projection import LV95, WGS84, get_transformer, transform
 
 # Candidate pairs (case-insensitive) for convenience
 CANDIDATES = [
@@ -25,6 +43,49 @@ CANDIDATES = [
     ("e", "n"),
 ]
 
+# Attributes shown in the popup, in row order after lat/lon
+POPUP_FIELDS = ["Address", "Municipality", "PostCode", "Canton",
+                "TotalPower", "BeginningOfOperation"]
+
+# auto mode: individual markers up to MARKER_LIMIT points, clusters up to CLUSTER_LIMIT
+MARKER_LIMIT = 2_000
+CLUSTER_LIMIT = 50_000
+
+# density mode: cell size of the pyramid level drawn (metres)
+DENSITY_CELL_M = 800
+
+# lazy mode: query server (mapserver.py) and max points drawn per viewport
+SERVER_URL = "http://127.0.0.1:8766/"
+LAZY_LIMIT = 20_000
+
+POPUP_STYLE = ("background-color:white; color:black; padding:12px; border-radius:8px; "
+               "font-family:sans-serif; font-size:13px; max-width:300px;")
+
+# Same popup as the markers mode, rendered from a [lat, lon, *POPUP_FIELDS] row
+POPUP_JS = """function (r) {
+    return "<div style='""" + POPUP_STYLE + """'>"
+        + "<b>🏠 Solar Panel Building</b><br><br>"
+        + "<b>Address:</b> " + r[2] + "<br>"
+        + "<b>Municipality:</b> " + r[3] + "<br>"
+        + "<b>PostCode:</b> " + r[4] + "<br>"
+        + "<b>Canton:</b> " + r[5] + "<br><br>"
+        + "<b>⚡ Power Info:</b><br>"
+        + "<b>Total Power:</b> " + r[6] + " kW<br>"
+        + "<b>Installation:</b> " + r[7] + "<br><br>"
+        + "<b>📍 Coordinates:</b><br>"
+        + "Lat: " + r[0].toFixed(6) + "<br>"
+        + "Lon: " + r[1].toFixed(6)
+        + "</div>";
+}"""
+
+
+def warm():
+    """Import the map libraries and build the Transformer ahead of the first run (mapd.py)."""
+    import branca.colormap
+    import folium.plugins
+    import folium_layers
+    get_transformer(LV95, WGS84)
+
 
 def pick_xy(cols):
     s = {c.lower(): c for c in cols}
@@ -34,6 +95,212 @@ def pick_xy(cols):
     return None, None
 
 
+def choose_mode(mode, n):
+    if mode != "auto":
+        return mode
+    if n <= MARKER_LIMIT:
+        return "markers"
+    return "cluster" if n <= CLUSTER_LIMIT else "canvas"
+
+
+def popup_rows(df):
+    """[lat, lon, *POPUP_FIELDS] per row, built column-wise (no iterrows)."""
+    cols = [df["lat"].round(6), df["lon"].round(6)]
+    for field in POPUP_FIELDS:
+        s = df[field] if field in df.columns else pd.Series("N/A", index=df.index)
+        cols.append(s.astype(str).where(s.notna(), "N/A"))
+    return [list(r) for r in zip(*(c.tolist() for c in cols))]
+
+
+def popup_html(df):
+    """Static popup HTML for every row, concatenated as vectorized string columns."""
+    def col(field):
+        s = df[field] if field in df.columns else pd.Series("N/A", index=df.index)
+        return s.astype(str).where(s.notna(), "N/A")
+
+    return ("<div style='" + POPUP_STYLE + "'><b>🏠 Solar Panel Building</b><br><br>"
+            + "<b>Address:</b> " + col("Address") + "<br>"
+            + "<b>Municipality:</b> " + col("Municipality") + "<br>"
+            + "<b>PostCode:</b> " + col("PostCode") + "<br>"
+            + "<b>Canton:</b> " + col("Canton") + "<br><br>"
+            + "<b>⚡ Power Info:</b><br>"
+            + "<b>Total Power:</b> " + col("TotalPower") + " kW<br>"
+            + "<b>Installation:</b> " + col("BeginningOfOperation") + "<br><br>"
+            + "<b>📍 Coordinates:</b><br>"
+            + "Lat: " + df["lat"].map("{:.6f}".format) + "<br>"
+            + "Lon: " + df["lon"].map("{:.6f}".format) + "</div>")
+
+
+def base_map(center_lat, center_lon, prefer_canvas=False):
+    """Empty map with the OSM and Esri base layers."""
+    import folium
+    m = folium.Map(location=[center_lat, center_lon],
+                   zoom_start=11, control_scale=True,
+                   prefer_canvas=prefer_canvas)
+
+    # Base layers (OSM + Esri)
+    folium.TileLayer("OpenStreetMap", name="OpenStreetMap",
+                     show=True).add_to(m)
+    folium.TileLayer(
+        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        attr="Tiles © Esri — Sources: Esri, USGS, IGN, etc.",
+        name="Esri Satellite",
+        show=False,
+    ).add_to(m)
+    return m
+
+
+def build_map(df, mode, radius=4.0, alpha=0.8, color="red", fill="red"):
+    """Folium map of df (with lat/lon columns) rendered in the given mode."""
+    import folium
+    from folium.plugins import FastMarkerCluster
+    from folium_layers import CanvasPoints
+    # Center map on average of points
+    m = base_map(float(df["lat"].mean()), float(df["lon"].mean()),
+                 prefer_canvas=mode == "canvas")
+
+    name = "Bern Solar Panel Buildings"
+    if mode == "cluster":
+        style = json.dumps({"radius": radius, "color": color, "fill": True,
+                            "fillColor": fill, "fillOpacity": alpha, "weight": 2})
+        callback = ("function (row) {\n"
+                    f"    var popup = {POPUP_JS};\n"
+                    f"    var marker = L.circleMarker([row[0], row[1]], {style});\n"
+                    "    marker.bindPopup(function () { return popup(row); }, {maxWidth: 350});\n"
+                    "    return marker;\n"
+                    "}")
+        FastMarkerCluster(popup_rows(df), callback=callback, name=name,
+                          chunkedLoading=True).add_to(m)
+    else:
+        # FeatureGroup for markers
+        fg = folium.FeatureGroup(name=name, show=True)
+        m.add_child(fg)
+        if mode == "canvas":
+            fg.add_child(CanvasPoints(popup_rows(df), POPUP_JS, radius, alpha, color, fill))
+        else:
+            for lat, lon, html in zip(df["lat"].tolist(), df["lon"].tolist(),
+                                      popup_html(df).tolist()):
+                folium.CircleMarker(
+                    location=[lat, lon],
+                    popup=folium.Popup(html=html, max_width=350),
+                    radius=radius,
+                    color=color,
+                    fill=True,
+                    fillColor=fill,
+                    fillOpacity=alpha,
+                    weight=2
+                ).add_to(fg)
+
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m
+
+
+def build_lazy_map(server, layer="solar", limit=LAZY_LIMIT, radius=4.0, alpha=0.8,
+                   color="red", fill="red"):
+    """Folium map without embedded points; mapserver.py answers viewport and popup queries."""
+    import folium
+    from folium_layers import LazyPoints
+    server = server.rstrip("/") + "/"
+    with urllib.request.urlopen(server + "stats", timeout=30) as r:
+        stats = json.load(r)
+    if layer not in stats["layers"]:
+        raise ValueError(f"query server has no layer {layer!r} ({sorted(stats['layers'])})")
+    m = base_map(*stats["center"], prefer_canvas=True)
+    fg = folium.FeatureGroup(name=f"Bern Solar Panel Buildings ({stats['layers'][layer]}, lazy)",
+                             show=True)
+    m.add_child(fg)
+    fg.add_child(LazyPoints(m.get_name(), server, layer, limit, POPUP_FIELDS, POPUP_JS,
+                            radius, alpha, color, fill))
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m
+
+
+def density_cells(root, value="ratio", cell_m=DENSITY_CELL_M):
+    """
+    GeoJSON cells (WGS84) of the pyramid level closest to cell_m, non-empty cells only,
+    with total/solar/ratio properties; cost depends on the cell count, not the points.
+    """
+    pyramid = DensityPyramid(root)
+    level = pyramid.level_for(cell_m)
+    values, xe, ye = pyramid.grid(level, value)
+    total = np.asarray(pyramid.counts(level, "total"))
+    solar = np.asarray(pyramid.counts(level, "solar"))
+    iy, ix = np.nonzero((total > 0) | (solar > 0))
+
+    # every cell corner reprojected once, then gathered per cell
+    gx, gy = np.meshgrid(xe, ye)
+    lon, lat = transform(gx.ravel(), gy.ravel(), LV95, WGS84)
+    lon = np.round(lon.reshape(gx.shape), 6)
+    lat = np.round(lat.reshape(gy.shape), 6)
+    v = np.asarray(values, dtype=np.float64)[iy, ix]
+    features = []
+    for i, (r, c) in enumerate(zip(iy.tolist(), ix.tolist())):
+        ring = [[lon[r, c], lat[r, c]], [lon[r, c + 1], lat[r, c + 1]],
+                [lon[r + 1, c + 1], lat[r + 1, c + 1]], [lon[r + 1, c], lat[r + 1, c]],
+                [lon[r, c], lat[r, c]]]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+            "properties": {"total": int(total[r, c]), "solar": int(solar[r, c]),
+                           "ratio": round(float(solar[r, c]) / total[r, c], 3)
+                           if total[r, c] else None,
+                           "value": None if np.isnan(v[i]) else float(v[i])},
+        })
+    return {"type": "FeatureCollection", "features": features}, pyramid.cells[level]
+
+
+def build_density_map(root, value="ratio", cell_m=DENSITY_CELL_M, alpha=0.6):
+    """Folium map of the density pyramid as a colored grid with per-cell tooltips."""
+    import folium
+    import branca.colormap as cm
+    cells, cell = density_cells(root, value, cell_m)
+    features = cells["features"]
+    if not features:
+        raise ValueError(f"density pyramid {root} has no non-empty cells")
+    vals = [f["properties"]["value"] for f in features if f["properties"]["value"] is not None]
+    colormap = cm.linear.YlOrRd_09.scale(min(vals), max(vals))
+    colormap.caption = ("solar installations per building" if value == "ratio"
+                        else f"{value} count") + f" ({cell:g} m cells)"
+    for f in features:
+        v = f["properties"]["value"]
+        f["properties"]["color"] = colormap(v) if v is not None else "#808080"
+
+    xmin, ymin, xmax, ymax = DensityPyramid(root).bounds()
+    lon, lat = transform([(xmin + xmax) / 2], [(ymin + ymax) / 2], LV95, WGS84)
+    m = base_map(float(lat[0]), float(lon[0]))
+    folium.GeoJson(
+        cells, name=f"Density ({value})",
+        style_function=lambda f: {"fillColor": f["properties"]["color"],
+                                  "fillOpacity": alpha, "weight": 0},
+        tooltip=folium.GeoJsonTooltip(fields=["total", "solar", "ratio"],
+                                      aliases=["Buildings", "Solar", "Solar/building"]),
+    ).add_to(m)
+    colormap.add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    return m
+
+
+def bench(df, sizes, modes=("markers", "cluster", "canvas"), marker_max=100_000):
+    """Generation time and HTML size per mode for synthetic sets resampled from df."""
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            sample = df.iloc[rng.integers(0, len(df), n)].copy()
+            # jitter resampled rows by up to ~50 m so points stay distinct
+            sample["lat"] += rng.uniform(-4.5e-4, 4.5e-4, n)
+            sample["lon"] += rng.uniform(-6.5e-4, 6.5e-4, n)
+            for mode in modes:
+                if mode == "markers" and n > marker_max:
+                    print(f"[INFO] n={n:>7} {mode:>7}: skipped (> {marker_max} markers)")
+                    continue
+                out = os.path.join(tmp, f"{mode}_{n}.html")
+                t0 = time.perf_counter()
+                build_map(sample, mode).save(out)
+                elapsed = time.perf_counter() - t0
+                print(f"[INFO] n={n:>7} {mode:>7}: {elapsed:6.2f}s, "
+                      f"{os.path.getsize(out) / 1e6:7.1f} MB HTML")
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--csv", default="dataset/BernSolarPanelBuildings.csv",
@@ -48,19 +315,64 @@ def main():
                     help="Marker radius (px, small=2)")
     ap.add_argument("--alpha", type=float, default=0.8,
                     help="Marker opacity [0..1]")
-    ap.add_argument("--color", default="#e41a1c",
+    ap.add_argument("--color", default="red",
                     help="Border color (hex or name)")
-    ap.add_argument("--fill", default="#e41a1c", help="Fill color")
+    ap.add_argument("--fill", default="red", help="Fill color")
+    ap.add_argument("--mode", choices=["auto", "markers", "cluster", "canvas", "density", "lazy"],
+                    default="auto",
+                    help=f"Rendering (auto: markers <= {MARKER_LIMIT}, "
+                         f"cluster <= {CLUSTER_LIMIT}, canvas above; density: "
+                         f"pre-aggregated grid from density.py; lazy: points and popups "
+                         f"fetched from mapserver.py)")
+    ap.add_argument("--density-dir", default=DENSITY_DIR,
+                    help=f"Pyramid built by density.py (default: {DENSITY_DIR})")
+    ap.add_argument("--value", choices=VALUES, default="ratio",
+                    help="Density value: total, solar or ratio (solar per building)")
+    ap.add_argument("--cell", type=float, default=DENSITY_CELL_M,
+                    help=f"Density cell size in metres (default: {DENSITY_CELL_M})")
+    ap.add_argument("--server", default=SERVER_URL,
+                    help=f"Lazy mode: mapserver.py URL (default: {SERVER_URL})")
+    ap.add_argument("--layer", default="solar", help="Lazy mode: server layer to draw")
+    ap.add_argument("--lazy-limit", type=int, default=LAZY_LIMIT,
+                    help=f"Lazy mode: max points per viewport (default: {LAZY_LIMIT})")
+    ap.add_argument("--bench", default="",
+                    help="Comma-separated point counts: time every mode instead of saving a map")
     args = ap.parse_args()
 
+    if args.mode == "density":
+        t0 = time.perf_counter()
+        try:
+            m = build_density_map(args.density_dir, args.value, args.cell, args.alpha)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] {e} (build the pyramid with: python density.py)", file=sys.stderr)
+            sys.exit(1)
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        m.save(args.out)
+        print(f"[OK] Map saved in {args.out} (density mode, "
+              f"{time.perf_counter() - t0:.1f}s, {os.path.getsize(args.out) / 1e6:.1f} MB)")
+        return
+
+    if args.mode == "lazy":
+        try:
+            m = build_lazy_map(args.server, args.layer, args.lazy_limit, args.radius,
+                               args.alpha, args.color, args.fill)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] {e} (start the query server with: python mapserver.py)",
+                  file=sys.stderr)
+            sys.exit(1)
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        m.save(args.out)
+        print(f"[OK] Map saved in {args.out} (lazy mode, "
+              f"{os.path.getsize(args.out) / 1e3:.0f} kB, data from {args.server})")
+        return
+
     # Read header to find columns
     try:
-        head = pd.read_csv(args.csv, nrows=0)
+        cols = csv_columns(args.csv)
     except Exception as e:
         print(f"[ERROR] Unable to read {args.csv}: {e}", file=sys.stderr)
         sys.exit(1)
 
-    cols = list(head.columns)
     x_col = args.x or ""
     y_col = args.y or ""
     if not x_col or not y_col:
@@ -72,8 +384,8 @@ def main():
         print("Pass explicitly: --x _x --y _y", file=sys.stderr)
         sys.exit(1)
 
-    # Read all columns to have more data for popups
-    df = pd.read_csv(args.csv)
+    # Only the coordinates plus the popup attributes
+    df = load_csv(args.csv, columns=[x_col, y_col] + [c for c in POPUP_FIELDS if c in cols])
     if args.limit > 0:
         df = df.head(args.limit).copy()
 
@@ -86,13 +398,12 @@ def main():
     print(f"[INFO] Valid rows after removing NaN: {len(df)}")
 
     # Transform LV95 (EPSG:2056) -> WGS84 (EPSG:4326)
-    tr = Transformer.from_crs(2056, 4326, always_xy=True)
-    lon, lat = tr.transform(df[x_col].values, df[y_col].values)
+    lon, lat = transform(df[x_col].values, df[y_col].values, LV95, WGS84)
     df["lon"] = lon
     df["lat"] = lat
 
     # Check for valid coordinates
-    df = df[df["lon"].notna() & df["lat"].notna()]
+    df = df[df["lon"].notna() & df["lat"].notna() & np.isfinite(df["lon"])]
     print(f"[INFO] Valid rows after transformation: {len(df)}")
 
     if df.empty:
@@ -100,65 +411,19 @@ def main():
             "[ERROR] No valid coordinates found after transformation.", file=sys.stderr)
         sys.exit(1)
 
-    # Center map on average of points
-    center_lat = float(df["lat"].mean())
-    center_lon = float(df["lon"].mean())
-
-    # Base map
-    m = folium.Map(location=[center_lat, center_lon],
-                   zoom_start=11, control_scale=True)
+    if args.bench:
+        bench(df, [int(n) for n in args.bench.split(",")])
+        return
 
-    # Base layers (OSM + Esri)
-    folium.TileLayer("OpenStreetMap", name="OpenStreetMap",
-                     show=True).add_to(m)
-    folium.TileLayer(
-        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
-        attr="Tiles © Esri — Sources: Esri, USGS, IGN, etc.",
-        name="Esri Satellite",
-        show=False,
-    ).add_to(m)
-
-    # FeatureGroup for markers
-    fg = folium.FeatureGroup(name="Bern Solar Panel Buildings", show=True)
-    m.add_child(fg)
-
-    # Iterazione su righe DataFrame per aggiungere marker con popup
-    # Following the requested pattern similar to GeoPandas approach
-    for _, row in df.iterrows():
-        # Create informative popup with building data
-        popup_html = f"""
-        <div style='background-color:white; color:black; padding:12px; border-radius:8px; font-family:sans-serif; font-size:13px; max-width:300px;'>
-            <b>🏠 Solar Panel Building</b><br><br>
-            <b>Address:</b> {row.get('Address', 'N/A')}<br>
-            <b>Municipality:</b> {row.get('Municipality', 'N/A')}<br>
-            <b>PostCode:</b> {row.get('PostCode', 'N/A')}<br>
-            <b>Canton:</b> {row.get('Canton', 'N/A')}<br><br>
-            <b>⚡ Power Info:</b><br>
-            <b>Total Power:</b> {row.get('TotalPower', 'N/A')} kW<br>
-            <b>Installation:</b> {row.get('BeginningOfOperation', 'N/A')}<br><br>
-            <b>📍 Coordinates:</b><br>
-            Lat: {row['lat']:.6f}<br>
-            Lon: {row['lon']:.6f}
-        </div>
-        """
-
-        folium.CircleMarker(
-            location=[row['lat'], row['lon']],
-            popup=folium.Popup(html=popup_html, max_width=350),
-            radius=args.radius,
-            color='red',
-            fill=True,
-            fillColor='red',
-            fillOpacity=args.alpha,
-            weight=2
-        ).add_to(fg)
-
-    folium.LayerControl(collapsed=False).add_to(m)
+    mode = choose_mode(args.mode, len(df))
+    t0 = time.perf_counter()
+    m = build_map(df, mode, args.radius, args.alpha, args.color, args.fill)
 
     # Save
     os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
     m.save(args.out)
-    print(f"[OK] Map saved in {args.out}")
+    print(f"[OK] Map saved in {args.out} ({mode} mode, {len(df)} points, "
+          f"{time.perf_counter() - t0:.1f}s, {os.path.getsize(args.out) / 1e6:.1f} MB)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Small on-disk cache for the remote layers used by plotmap.py.
+- One file per entry (name = SHA-1 of the key) under .cache/geo/
+- Entries expire after a TTL; offline mode serves them regardless of age
+- Size-bounded: least recently used files are evicted above max_bytes
+  (basemap tiles are entries too, one file per tile); the size is tracked as a
+  running total, so the directory is only walked on the first put and when
+  the limit is crossed (then evicted down to PRUNE_TO of it)
+- Entries are written through private temporary files, safe across processes
+
+Inspect or clear:
+  python geocache.py            # entries and total size
+  python geocache.py --clear
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+CACHE_DIR = ".cache/geo"
+TTL_S = 30 * 24 * 3600  # swisstopo boundaries and imagery change rarely
+MAX_BYTES = 500 * 1024 * 1024
+PRUNE_TO = 0.9  # eviction target as a fraction of max_bytes, so puts do not prune one by one
+
+
+class OfflineCacheMiss(LookupError):
+    """Raised when offline mode needs an entry that is not cached."""
+
+
+class GeoCache:
+    def __init__(self, root=CACHE_DIR, ttl=TTL_S, max_bytes=MAX_BYTES, offline=False):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._bytes = None  # running size of root, measured by the first put
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key, ext):
+        return os.path.join(self.root, hashlib.sha1(key.encode()).hexdigest()[:24] + ext)
+
+    def get(self, key, ext):
+        """Path of a usable cached entry, or None (OfflineCacheMiss when offline)."""
+        p = self.path(key, ext)
+        if os.path.exists(p):
+            age = time.time() - os.path.getmtime(p)
+            if self.offline or not self.ttl or age <= self.ttl:
+                os.utime(p, (time.time(), os.path.getmtime(p)))  # atime = last use
+                return p
+        if self.offline:
+            raise OfflineCacheMiss(f"not cached (offline mode): {key}")
+        return None
+
+    def put(self, key, ext, data):
+        """Store bytes under key; returns the entry path."""
+        p = self.path(key, ext)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            old = os.path.getsize(p) if os.path.exists(p) else 0
+            os.replace(tmp, p)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        if self._bytes is None:
+            self.prune()  # one walk per process, which also drops expired entries
+        else:
+            self._bytes += len(data) - old
+            if self._bytes > self.max_bytes:
+                self.prune()
+        return p
+
+    def entries(self):
+        """[(path, size, last_use)] for every file under root, tile cache included."""
+        out = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                out.append((p, st.st_size, max(st.st_atime, st.st_mtime)))
+        return out
+
+    def prune(self):
+        """
+        Drop expired entries (unless offline), then LRU entries until the total is
+        below PRUNE_TO * max_bytes if it exceeded max_bytes.
+        """
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        now = time.time()
+        total = sum(e[1] for e in entries)
+        limit = self.max_bytes if total <= self.max_bytes else self.max_bytes * PRUNE_TO
+        removed = 0
+        for p, size, last_use in entries:
+            expired = self.ttl and not self.offline and now - last_use > self.ttl
+            if not expired and total <= limit:
+                break
+            try:
+                os.remove(p)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._bytes = total
+        return removed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or clear the geo layer cache")
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    ap.add_argument("--clear", action="store_true", help="Delete every cached entry")
+    args = ap.parse_args()
+
+    if args.clear:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+        print(f"[OK] Cleared {args.cache_dir}")
+        return
+    entries = GeoCache(args.cache_dir).entries()
+    print(f"[INFO] {len(entries)} files, {sum(e[1] for e in entries) / 1e6:.1f} MB "
+          f"in {args.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+CPU batch inference: score every building of buildings_BE.csv for solar panels.
+- Building coordinates are streamed in chunks from the Parquet cache (datacache.py)
+- Chips are read from --chip-dir (ortho_{x}_{y}.png), fetched from the WMS by a
+  thread pool, or taken from a shared chipserver.py (--chip-server); a producer
+  thread assembles batches into a bounded prefetch queue while the main thread
+  runs the model under torch.inference_mode
+- Results (x, y, score) are appended as Parquet part files in --out, flushed
+  every --part-rows rows or --part-seconds seconds and on exit (also on errors
+  and Ctrl-C); a rerun skips buildings already scored, so an interrupted run
+  resumes where it stopped
+- Reports buildings/sec; --threads sets torch intra-op threads
+
+Example:
+  python infer.py --weights runs/classify/train/weights/best.pt --chip-dir true-orthophoto-256px --out scores
+  python infer.py --weights model.torchscript --wms-url http://127.0.0.1:8089/ --limit 5000
+Dep: pip install numpy pandas pyarrow pillow torch requests (ultralytics for YOLO weights)
+"""
+
+import argparse
+import glob
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+
+from chipserver import ChipClient
+from datacache import iter_csv
+from wms import (LAYER, WMS_URL, RateLimiter, bounded_map, chip_bbox, fetch_getmap,
+                 getmap_params, make_session, write_atomic)
+
+CSV_PATH = "dataset/buildings_BE.csv"
+OUT_DIR = "scores"
+SIZE = 256
+M_PER_PX = 0.075  # same chips as orto-256.py
+
+BATCH = 64
+PREFETCH = 4  # batches queued ahead of the model
+PART_ROWS = 20_000  # rows per Parquet part file
+PART_SECONDS = 60.0  # or fewer, at least once a minute
+POSITIVE_CLASS = 0  # 'solar-panel' in data.yaml
+
+
+def load_model(weights, imgsz=SIZE):
+    """
+    fn(images float NCHW in [0, 1]) -> solar score per image in [0, 1].
+    .torchscript/.ts/.jit: classifier logits (softmax class POSITIVE_CLASS, or sigmoid
+    for one output); anything else is loaded with ultralytics (classify: class
+    probability, detect: highest solar-panel box confidence).
+    """
+    if weights.endswith((".torchscript", ".ts", ".jit")):
+        net = torch.jit.load(weights, map_location="cpu").eval()
+
+        def score(x):
+            out = net(x)
+            if out.ndim == 2 and out.shape[1] > 1:
+                return out.softmax(1)[:, POSITIVE_CLASS]
+            return torch.sigmoid(out.reshape(-1))
+        return score
+
+    from ultralytics import YOLO
+    model = YOLO(weights)
+
+    def score(x):
+        scores = []
+        for r in model.predict(x, imgsz=imgsz, device="cpu", verbose=False):
+            if r.probs is not None:
+                scores.append(float(r.probs.data[POSITIVE_CLASS]))
+            else:
+                conf = r.boxes.conf[r.boxes.cls == POSITIVE_CLASS]
+                scores.append(float(conf.max()) if len(conf) else 0.0)
+        return torch.tensor(scores)
+    return score
+
+
+def scored_keys(out_dir):
+    """(x, y) pairs already present in the part files of out_dir."""
+    done = set()
+    for path in sorted(glob.glob(os.path.join(out_dir, "part-*.parquet"))):
+        df = pd.read_parquet(path, columns=["x", "y"])
+        done.update(zip(df["x"].tolist(), df["y"].tolist()))
+    return done
+
+
+def iter_buildings(csv_path, done, limit=0, chunk_rows=200_000):
+    """Yield (x, y) of every building not in done (first `limit` buildings if > 0)."""
+    seen = 0
+    for chunk in iter_csv(csv_path, ["GKODE", "GKODN"], chunk_rows):
+        chunk = chunk.dropna()
+        for x, y in zip(chunk["GKODE"].astype(np.float64).tolist(),
+                        chunk["GKODN"].astype(np.float64).tolist()):
+            if limit and seen >= limit:
+                return
+            seen += 1
+            if (x, y) not in done:
+                yield x, y
+
+
+class ChipSource:
+    """Chip for a building: local ortho_{x}_{y}.png if present, else a WMS GetMap."""
+
+    def __init__(self, chip_dir="", size=SIZE, m_per_px=M_PER_PX, layer=LAYER, url=WMS_URL,
+                 fetch=True, save=False, workers=8, rps=0.0, retries=5):
+        self.chip_dir = chip_dir
+        self.size = size
+        self.m_per_px = m_per_px
+        self.layer = layer
+        self.url = url
+        self.fetch = fetch
+        self.save = save and bool(chip_dir)
+        self.retries = retries
+        self.session = make_session(workers) if fetch else None
+        self.limiter = RateLimiter(rps) if rps > 0 else None
+        if self.save:
+            os.makedirs(chip_dir, exist_ok=True)
+
+    def __call__(self, xy):
+        x, y = xy
+        path = os.path.join(self.chip_dir, f"ortho_{int(x)}_{int(y)}.png") if self.chip_dir else ""
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+        elif self.fetch:
+            bbox = chip_bbox(x, y, self.size, self.m_per_px)
+            data = fetch_getmap(self.session, getmap_params(bbox, self.size, self.size, self.layer),
+                                self.url, self.limiter, self.retries)
+            if self.save:
+                write_atomic(path, data)
+        else:
+            raise FileNotFoundError(path)
+        with Image.open(io.BytesIO(data)) as im:
+            img = np.asarray(im.convert("RGB"))
+        if img.shape[:2] != (self.size, self.size):
+            raise ValueError(f"chip is {img.shape[1]}x{img.shape[0]}, expected {self.size}px")
+        return img
+
+
+def produce_batches(coords, source, batch, q, stats, workers=8):
+    """Fill q with (xs, ys, images NHWC uint8) batches; None marks the end."""
+    try:
+        xs, ys, imgs = [], [], []
+        for (x, y), img, err in bounded_map(source, coords, workers, workers * 4):
+            if err is not None:
+                stats["failed"] += 1
+                if stats["failed"] <= 10:
+                    print(f"[WARN] {x:.0f},{y:.0f}: {err}", file=sys.stderr)
+                continue
+            xs.append(x)
+            ys.append(y)
+            imgs.append(img)
+            if len(imgs) == batch:
+                q.put((xs, ys, np.stack(imgs)))
+                xs, ys, imgs = [], [], []
+        if imgs:
+            q.put((xs, ys, np.stack(imgs)))
+    except BaseException as e:  # surface producer crashes in the main thread
+        q.put(e)
+    finally:
+        q.put(None)
+
+
+def write_part(out_dir, index, rows):
+    """Atomically write one part file of (x, y, score) rows."""
+    path = os.path.join(out_dir, f"part-{index:05d}.parquet")
+    df = pd.DataFrame({"x": np.concatenate([r[0] for r in rows]),
+                       "y": np.concatenate([r[1] for r in rows]),
+                       "score": np.concatenate([r[2] for r in rows]).astype(np.float32)})
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False)
+    write_atomic(path, buf.getvalue())
+    return len(df)
+
+
+def run(score, coords, source, out_dir, batch=BATCH, prefetch=PREFETCH, part_rows=PART_ROWS,
+        workers=8, verbose=True, part_seconds=PART_SECONDS):
+    """Score coords into out_dir; returns a stats dict."""
+    os.makedirs(out_dir, exist_ok=True)
+    part = len(glob.glob(os.path.join(out_dir, "part-*.parquet")))
+    stats = {"scored": 0, "failed": 0, "parts": 0, "model_s": 0.0}
+    q = queue.Queue(maxsize=prefetch)
+    producer = threading.Thread(target=produce_batches,
+                                args=(coords, source, batch, q, stats, workers), daemon=True)
+    t_start = time.perf_counter()
+    producer.start()
+
+    rows, buffered = [], 0
+    last_report = last_flush = t_start
+
+    def flush():
+        nonlocal part, rows, buffered, last_flush
+        if rows:
+            write_part(out_dir, part, rows)
+            part += 1
+            stats["parts"] += 1
+        rows, buffered = [], 0
+        last_flush = time.perf_counter()
+
+    try:
+        with torch.inference_mode():
+            while True:
+                item = q.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                xs, ys, imgs = item
+                t0 = time.perf_counter()
+                x = torch.from_numpy(imgs).permute(0, 3, 1, 2).float().div_(255)
+                s = score(x).float().numpy()
+                stats["model_s"] += time.perf_counter() - t0
+                rows.append((np.asarray(xs), np.asarray(ys), s))
+                buffered += len(xs)
+                stats["scored"] += len(xs)
+                now = time.perf_counter()
+                if buffered >= part_rows or now - last_flush >= part_seconds:
+                    flush()
+                if verbose and now - last_report >= 10:
+                    last_report = now
+                    print(f"[INFO] {stats['scored']} scored, {stats['failed']} failed, "
+                          f"{stats['scored'] / (now - t_start):.1f} buildings/s")
+    finally:
+        # keep what was scored so far, also when the model or a batch raised
+        flush()
+    producer.join()
+    stats["elapsed"] = time.perf_counter() - t_start
+    stats["buildings_per_s"] = stats["scored"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Score buildings for solar panels on CPU")
+    ap.add_argument("--weights", required=True,
+                    help="Trained model: ultralytics .pt or TorchScript .torchscript")
+    ap.add_argument("--csv", default=CSV_PATH,
+                    help=f"Buildings CSV with GKODE/GKODN (default: {CSV_PATH})")
+    ap.add_argument("--out", default=OUT_DIR,
+                    help=f"Directory of Parquet part files (default: {OUT_DIR})")
+    ap.add_argument("--chip-dir", default="",
+                    help="Read ortho_{x}_{y}.png chips from here before fetching")
+    ap.add_argument("--no-fetch", action="store_true",
+                    help="Only use --chip-dir; buildings without a chip are counted as failed")
+    ap.add_argument("--chip-server", default="",
+                    help="Get chips from a running chipserver.py (e.g. http://127.0.0.1:8765/)")
+    ap.add_argument("--save-chips", action="store_true",
+                    help="Store fetched chips in --chip-dir")
+    ap.add_argument("--wms-url", default=WMS_URL,
+                    help="WMS endpoint (e.g. http://127.0.0.1:8089/ for stub_wms.py)")
+    ap.add_argument("--size", type=int, default=SIZE, help=f"Chip size in px (default: {SIZE})")
+    ap.add_argument("--m-per-px", type=float, default=M_PER_PX,
+                    help=f"Chip resolution (default: {M_PER_PX})")
+    ap.add_argument("--batch", type=int, default=BATCH, help=f"Batch size (default: {BATCH})")
+    ap.add_argument("--prefetch", type=int, default=PREFETCH,
+                    help=f"Batches prepared ahead of the model (default: {PREFETCH})")
+    ap.add_argument("--workers", type=int, default=8,
+                    help="Threads reading/fetching chips (default: 8)")
+    ap.add_argument("--rps", type=float, default=0.0,
+                    help="Max WMS requests per second (0 = no cap)")
+    ap.add_argument("--threads", type=int, default=os.cpu_count(),
+                    help="torch intra-op threads (default: all cores)")
+    ap.add_argument("--part-rows", type=int, default=PART_ROWS,
+                    help=f"Rows per Parquet part file (default: {PART_ROWS})")
+    ap.add_argument("--part-seconds", type=float, default=PART_SECONDS,
+                    help=f"Also write a part file after this many seconds (default: {PART_SECONDS:g})")
+    ap.add_argument("--limit", type=int, default=0,
+                    help="Only the first N buildings of the CSV (0 = all)")
+    ap.add_argument("--restart", action="store_true",
+                    help="Ignore existing results in --out (they are deleted)")
+    ap.add_argument("--quiet", action="store_true", help="Only print the final summary")
+    args = ap.parse_args()
+
+    if args.no_fetch and not args.chip_dir:
+        ap.error("--no-fetch needs --chip-dir")
+    # one inter-op thread: batches run one at a time, intra-op threads do the work
+    torch.set_num_threads(args.threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    if args.restart:
+        for path in glob.glob(os.path.join(args.out, "part-*.parquet")):
+            os.remove(path)
+    done = scored_keys(args.out)
+    if done:
+        print(f"[INFO] Resuming: {len(done)} buildings already scored in {args.out}")
+
+    score = load_model(args.weights, args.size)
+    if args.chip_server:
+        client = ChipClient(args.chip_server)
+
+        def source(xy):
+            return client.get(xy[0], xy[1], args.size, args.m_per_px)
+    else:
+        source = ChipSource(args.chip_dir, args.size, args.m_per_px, url=args.wms_url,
+                            fetch=not args.no_fetch, save=args.save_chips,
+                            workers=args.workers, rps=args.rps)
+    coords = iter_buildings(args.csv, done, args.limit)
+    stats = run(score, coords, source, args.out, args.batch, args.prefetch, args.part_rows,
+                args.workers, verbose=not args.quiet, part_seconds=args.part_seconds)
+    print(f"[OK] {stats['scored']} buildings scored, {stats['failed']} failed, "
+          f"{stats['parts']} part files in {args.out}; {stats['elapsed']:.1f}s, "
+          f"{stats['buildings_per_s']:.1f} buildings/s "
+          f"(model {stats['model_s']:.1f}s, {args.threads} threads)")
+
+
+if __name__ == "__main__":
+    main()
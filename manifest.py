@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+On-disk SQLite manifest of fetched WMS tiles, so downloads are resumable.
+- Keyed by (layer, bbox, size, resolution)
+- Stores status ("ok"/"failed", or a REJECTED reason), output path, byte size, SHA-1 and error reason
+- Reruns skip completed tiles and retry only the failures
+
+Inspect a manifest:
+  python manifest.py true-orthophoto-125px/manifest.sqlite
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+
+MANIFEST_NAME = "manifest.sqlite"
+
+# fetched but not stored by a download filter (phash.ChipFilter, quality.QualityFilter);
+# never refetched. Other filter reasons (e.g. "undecodable: ...") are recorded as
+# "failed" and retried.
+REJECTED = ("blank", "duplicate", "cloud", "nodata")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    layer    TEXT NOT NULL,
+    bbox     TEXT NOT NULL,
+    size     TEXT NOT NULL,
+    m_per_px REAL NOT NULL,
+    path     TEXT,
+    status   TEXT NOT NULL,
+    bytes    INTEGER,
+    sha1     TEXT,
+    error    TEXT,
+    updated  REAL NOT NULL,
+    PRIMARY KEY (layer, bbox, size, m_per_px)
+)
+"""
+
+
+def tile_key(layer, bbox, width, height, m_per_px):
+    # fixed precision so float noise in the bbox never produces a new key
+    return (layer, ",".join(f"{v:.3f}" for v in bbox), f"{width}x{height}",
+            round(float(m_per_px), 6))
+
+
+def sha1_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class Manifest:
+    """Tile manifest; all writes must come from one thread (the download loop's)."""
+
+    def __init__(self, path, commit_every=200):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.commit_every = commit_every
+        self._dirty = 0
+
+    def load(self):
+        """{key: (status, path, bytes)} for every recorded tile."""
+        rows = self.conn.execute(
+            "SELECT layer, bbox, size, m_per_px, status, path, bytes FROM tiles")
+        return {tuple(r[:4]): (r[4], r[5], r[6]) for r in rows}
+
+    def record(self, key, status, path=None, nbytes=None, sha1=None, error=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, path, status, nbytes, sha1, error, time.time()))
+        self._dirty += 1
+        if self._dirty >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._dirty = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def summary(self):
+        return dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM tiles GROUP BY status").fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_complete(entry, out_file):
+    """
+    True when the manifest says ok and the file on disk still has the recorded size,
+    or when the tile was fetched and deliberately not stored (REJECTED).
+    """
+    if entry is not None and entry[0] in REJECTED:
+        return True
+    if entry is None or entry[0] != "ok":
+        return False
+    try:
+        return os.path.getsize(out_file) == entry[2]
+    except OSError:
+        return False
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarise a tile manifest")
+    ap.add_argument("path", help="Path to manifest.sqlite")
+    ap.add_argument("--errors", type=int, default=10,
+                    help="Show up to N failed tiles with their error reason")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"[ERROR] File not found: {args.path}")
+        return
+    with Manifest(args.path) as m:
+        for status, n in sorted(m.summary().items()):
+            print(f"[INFO] {status}: {n}")
+        rows = m.conn.execute(
+            "SELECT bbox, error FROM tiles WHERE status = 'failed' LIMIT ?",
+            (args.errors,)).fetchall()
+        for bbox, error in rows:
+            print(f"[WARN] {bbox}: {error}")
+
+
+if __name__ == "__main__":
+    main()
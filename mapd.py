@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Long-lived worker for plotmap.py and folium_map.py: libraries stay imported
+and the pyproj Transformers built between runs.
+- `python mapd.py serve` imports both tools (their warm() functions) once and
+  runs requests one at a time on a local port
+- `python mapd.py plotmap ...` / `python mapd.py folium_map ...` send the
+  arguments and working directory to the daemon and print its output; the
+  client imports only the standard library, and without a running daemon the
+  tool runs in-process as before
+- Output of plotmap's --jobs worker processes goes to the daemon's terminal
+
+Example:
+  python mapd.py serve &
+  python mapd.py plotmap --csv dataset/BernSolarPanelBuildings.csv --kind hexbin --out a.png
+  python mapd.py folium_map --mode density --out maps/density.html
+Dep: as plotmap.py and folium_map.py
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+PORT = 8767
+TOOLS = ("plotmap", "folium_map")
+
+
+def run_tool(tool, argv, cwd=None):
+    """
+    (exit code, stdout, stderr) of `python <tool>.py argv`, run in this process.
+    Not thread-safe: sys.argv, the standard streams and the directory are swapped.
+    """
+    module = importlib.import_module(tool)
+    out, err = io.StringIO(), io.StringIO()
+    old_argv, old_cwd = sys.argv, os.getcwd()
+    code = 0
+    try:
+        sys.argv = [f"{tool}.py", *argv]
+        if cwd:
+            os.chdir(cwd)
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                module.main()
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    code = e.code or 0
+                else:  # sys.exit("message")
+                    print(e.code, file=sys.stderr)
+                    code = 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    finally:
+        sys.argv = old_argv
+        os.chdir(old_cwd)
+    return code, out.getvalue(), err.getvalue()
+
+
+def make_server(port=PORT, host="127.0.0.1"):
+    """Single-threaded HTTP server: POST /run {"tool", "argv", "cwd"} -> {"code", "stdout", "stderr"}."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_POST(self):
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if req.get("tool") not in TOOLS:
+                    raise ValueError(f"tool must be one of {TOOLS}")
+            except ValueError as e:
+                answer, status = {"code": 2, "stdout": "", "stderr": f"[ERROR] {e}\n"}, 400
+            else:
+                t0 = time.perf_counter()
+                code, out, err = run_tool(req["tool"], req.get("argv", []), req.get("cwd"))
+                answer, status = {"code": code, "stdout": out, "stderr": err,
+                                  "seconds": round(time.perf_counter() - t0, 3)}, 200
+            body = json.dumps(answer).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return HTTPServer((host, port), Handler)
+
+
+def request(tool, argv, port=PORT, timeout=3600):
+    """Run a tool through the daemon; the answer dict, or None if no daemon listens."""
+    body = json.dumps({"tool": tool, "argv": list(argv), "cwd": os.getcwd()}).encode()
+    req = urllib.request.Request(f"http://127.0.0.1:{port}/run", data=body,
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return json.load(r)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+    except (urllib.error.URLError, ConnectionError):
+        return None
+
+
+def serve(port=PORT):
+    t0 = time.perf_counter()
+    for tool in TOOLS:
+        importlib.import_module(tool).warm()
+    server = make_server(port)
+    print(f"[OK] mapd on 127.0.0.1:{port}: {', '.join(TOOLS)} loaded in "
+          f"{time.perf_counter() - t0:.1f}s", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    port = int(os.environ.get("MAPD_PORT", PORT))
+    if len(sys.argv) < 2 or sys.argv[1] not in ("serve", *TOOLS):
+        ap = argparse.ArgumentParser(
+            description="Run plotmap.py / folium_map.py through a warm daemon",
+            usage="mapd.py serve [--port N] | mapd.py {plotmap,folium_map} [tool args...]")
+        ap.add_argument("command", choices=["serve", *TOOLS])
+        ap.parse_args()
+    command, argv = sys.argv[1], sys.argv[2:]
+    if command == "serve":
+        ap = argparse.ArgumentParser(description="Start the map/plot daemon")
+        ap.add_argument("--port", type=int, default=port)
+        serve(ap.parse_args(argv).port)
+        return
+
+    answer = request(command, argv, port)
+    if answer is None:
+        print(f"[WARN] No mapd on port {port} (start: python mapd.py serve); running in-process",
+              file=sys.stderr)
+        sys.argv = [f"{command}.py", *argv]
+        importlib.import_module(command).main()
+        return
+    sys.stdout.write(answer["stdout"])
+    sys.stderr.write(answer["stderr"])
+    sys.exit(answer["code"])
+
+
+if __name__ == "__main__":
+    main()
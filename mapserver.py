@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Local spatial query service behind the lazy folium maps (folium_map.py --mode lazy).
+- Loads the solar and building tables once (Parquet cache, only the needed
+  columns) into GridIndex instances (spatial.py), with WGS84 coordinates
+  precomputed
+- GET /points?layer=solar&bbox=minlon,minlat,maxlon,maxlat[&limit=] returns
+  [id, lat, lon] rows in the viewport; above --limit a fixed random subset is
+  returned, so points shown at one zoom stay put while panning
+- GET /attrs?layer=&id= returns one record (popup attributes; solar records
+  include the nearest building), /attrs?layer=&field=&value= the records with
+  that attribute value
+- GET /nearest?layer=buildings&x=&y= (LV95) or &lat=&lon= the nearest point
+  within --radius metres; GET /stats row counts and the map centre
+- Answers carry Access-Control-Allow-Origin, so maps opened from file:// can query
+
+Example:
+  python mapserver.py --port 8766 &
+  python folium_map.py --mode lazy --server http://127.0.0.1:8766/ --out maps/lazy.html
+Dep: pip install numpy pandas pyproj (pyarrow for the Parquet cache)
+"""
+
+import argparse
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from datacache import csv_columns, load_csv
+from folium_map import POPUP_FIELDS, pick_xy
+from projection import LV95, WGS84, transform
+from spatial import GridIndex
+
+SOLAR_PATH = "dataset/BernSolarPanelBuildings.csv"
+BUILDINGS_PATH = "dataset/buildings_BE.csv"
+BUILDING_FIELDS = ["EGID", "GGDENR"]
+PORT = 8766
+LIMIT = 20_000  # max points per /points answer
+RADIUS_M = 100.0  # nearest-point search radius, also the index cell size
+# EPSG:2056 area of use (lon/lat); the transform is meaningless far outside it
+LV95_AREA = (5.96, 45.82, 10.49, 47.81)
+
+
+class PointTable:
+    """One CSV as LV95/WGS84 arrays, a grid index and its attribute columns; id = row position."""
+
+    def __init__(self, path, fields, x_col="", y_col="", cell=RADIUS_M, seed=0):
+        cols = csv_columns(path)
+        if not x_col or not y_col:
+            x_col, y_col = pick_xy(cols)
+            if x_col is None and {"GKODE", "GKODN"} <= set(cols):
+                x_col, y_col = "GKODE", "GKODN"
+        if x_col is None:
+            raise ValueError(f"{path}: no coordinate columns in {cols}")
+        self.fields = [f for f in fields if f in cols]
+        df = load_csv(path, columns=[x_col, y_col] + self.fields)
+        df = df.dropna(subset=[x_col, y_col]).reset_index(drop=True)
+        self.xs = df[x_col].to_numpy(dtype=np.float64)
+        self.ys = df[y_col].to_numpy(dtype=np.float64)
+        lon, lat = transform(self.xs, self.ys, LV95, WGS84)
+        self.lat, self.lon = np.round(lat, 6), np.round(lon, 6)
+        self.attrs = {f: df[f].astype(str).where(df[f].notna(), "N/A").to_numpy(dtype=object)
+                      for f in self.fields}
+        self.index = GridIndex(self.xs, self.ys, cell)
+        # a fixed random rank per point: truncated answers keep the lowest ranks
+        self.rank = np.random.default_rng(seed).permutation(len(self.xs))
+        self._values = {}
+
+    def __len__(self):
+        return len(self.xs)
+
+    def points(self, minx, miny, maxx, maxy, limit=LIMIT):
+        """(ids in the LV95 bbox, at most limit of them; total inside the bbox)."""
+        ids = self.index.bbox(minx, miny, maxx, maxy)
+        total = len(ids)
+        if total > limit:
+            ids = ids[np.argpartition(self.rank[ids], limit)[:limit]]
+        return ids, total
+
+    def nearest(self, x, y, radius=RADIUS_M):
+        """(id, distance) of the nearest point within radius of (x, y), or (None, None)."""
+        idx, dist = self.index.nearest([x], [y], radius)
+        if idx[0] < 0:
+            return None, None
+        return int(idx[0]), float(dist[0])
+
+    def record(self, i):
+        return {"id": int(i), "x": float(self.xs[i]), "y": float(self.ys[i]),
+                "lat": float(self.lat[i]), "lon": float(self.lon[i]),
+                **{f: self.attrs[f][i] for f in self.fields}}
+
+    def lookup(self, field, value):
+        """Ids whose field equals value (as string); the value map is built on first use."""
+        if field not in self.attrs:
+            raise KeyError(field)
+        if field not in self._values:
+            values = self.attrs[field]
+            order = np.argsort(values, kind="stable")
+            self._values[field] = (values[order], order)
+        values, order = self._values[field]
+        lo = np.searchsorted(values, value, side="left")
+        hi = np.searchsorted(values, value, side="right")
+        return np.sort(order[lo:hi])
+
+
+class QueryService:
+    """Named PointTables plus the queries the HTTP handler exposes."""
+
+    def __init__(self, solar_path=SOLAR_PATH, buildings_path=BUILDINGS_PATH, radius=RADIUS_M):
+        self.radius = radius
+        self.tables = {}
+        if solar_path:
+            self.tables["solar"] = PointTable(solar_path, POPUP_FIELDS, cell=radius)
+        if buildings_path and os.path.exists(buildings_path):
+            self.tables["buildings"] = PointTable(buildings_path, BUILDING_FIELDS, cell=radius)
+
+    def table(self, layer):
+        if layer not in self.tables:
+            raise KeyError(f"unknown layer {layer!r} (have {sorted(self.tables)})")
+        return self.tables[layer]
+
+    def points(self, layer, bbox, limit=LIMIT, crs=WGS84):
+        """
+        {'total', 'rows': [[id, lat, lon], ...]} for a bbox in WGS84 (lon/lat), LV95 or
+        any other EPSG code (reprojected through WGS84 and clipped to the LV95 area).
+        """
+        t = self.table(layer)
+        if not np.isfinite(bbox).all():
+            raise ValueError(f"bbox {bbox} is not finite")
+        minx, miny, maxx, maxy = bbox
+        if crs not in (LV95, WGS84):
+            lon, lat = transform([minx, maxx, maxx, minx], [miny, miny, maxy, maxy], crs, WGS84)
+            minx, miny, maxx, maxy, crs = lon.min(), lat.min(), lon.max(), lat.max(), WGS84
+        if crs == WGS84:
+            # zoomed-out viewports reach far beyond Switzerland: clip to the LV95 area first
+            a = LV95_AREA
+            minx, miny, maxx, maxy = max(minx, a[0]), max(miny, a[1]), min(maxx, a[2]), min(maxy, a[3])
+            if minx > maxx or miny > maxy:
+                return {"total": 0, "rows": []}
+            # the LV95 envelope of the four corners covers the (slightly rotated) viewport
+            xs, ys = transform([minx, maxx, maxx, minx], [miny, miny, maxy, maxy], crs, LV95)
+            if not (np.isfinite(xs).all() and np.isfinite(ys).all()):
+                raise ValueError(f"bbox {bbox} has no valid LV95 equivalent")
+            minx, miny, maxx, maxy = xs.min(), ys.min(), xs.max(), ys.max()
+        ids, total = t.points(minx, miny, maxx, maxy, limit)
+        rows = np.column_stack([ids, t.lat[ids], t.lon[ids]]).tolist()
+        return {"total": total, "rows": [[int(r[0]), r[1], r[2]] for r in rows]}
+
+    def nearest(self, layer, x, y, radius=None):
+        t = self.table(layer)
+        radius = self.radius if radius is None else min(radius, self.radius)
+        i, d = t.nearest(x, y, radius)
+        if i is None:
+            return None
+        return {**t.record(i), "distance": round(d, 2)}
+
+    def record(self, layer, i):
+        t = self.table(layer)
+        if not 0 <= i < len(t):
+            raise IndexError(f"{layer} has no id {i}")
+        rec = t.record(i)
+        if layer == "solar" and "buildings" in self.tables:
+            rec["building"] = self.nearest("buildings", rec["x"], rec["y"])
+        return rec
+
+    def lookup(self, layer, field, value, limit=100):
+        t = self.table(layer)
+        return [t.record(i) for i in t.lookup(field, value)[:limit]]
+
+    def summary(self):
+        stats = {"layers": {k: len(t) for k, t in self.tables.items()}}
+        t = self.tables.get("solar") or next(iter(self.tables.values()), None)
+        if t is not None and len(t):
+            stats["center"] = [float(np.mean(t.lat)), float(np.mean(t.lon))]
+            stats["bounds"] = [[float(t.lat.min()), float(t.lon.min())],
+                               [float(t.lat.max()), float(t.lon.max())]]
+        return stats
+
+
+def handle(service, path):
+    """(status, JSON-serializable answer) for a request path."""
+    url = urlparse(path)
+    q = {k: v[0] for k, v in parse_qs(url.query).items()}
+    try:
+        if url.path == "/stats":
+            return 200, service.summary()
+        layer = q.get("layer", "solar")
+        if url.path == "/points":
+            bbox = [float(v) for v in q["bbox"].split(",")]
+            if len(bbox) != 4:
+                raise ValueError("bbox needs minx,miny,maxx,maxy")
+            return 200, service.points(layer, bbox, int(q.get("limit", LIMIT)),
+                                       int(q.get("crs", WGS84)))
+        if url.path == "/nearest":
+            if "lat" in q:
+                x, y = transform([float(q["lon"])], [float(q["lat"])], WGS84, LV95)
+                x, y = float(x[0]), float(y[0])
+            else:
+                x, y = float(q["x"]), float(q["y"])
+            radius = float(q["radius"]) if "radius" in q else None
+            rec = service.nearest(layer, x, y, radius)
+            return (200, rec) if rec is not None else (404, {"error": "nothing within radius"})
+        if url.path == "/attrs":
+            if "field" in q:
+                return 200, service.lookup(layer, q["field"], q["value"])
+            return 200, service.record(layer, int(q["id"]))
+    except (KeyError, IndexError, ValueError) as e:
+        status = 404 if isinstance(e, IndexError) else 400
+        return status, {"error": f"{type(e).__name__}: {e}"}
+    return 404, {"error": "use /points, /nearest, /attrs or /stats"}
+
+
+def make_server(service, port=PORT, host="127.0.0.1"):
+    """HTTP server around a QueryService (caller runs serve_forever)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_GET(self):
+            status, answer = handle(service, self.path)
+            body = json.dumps(answer, ensure_ascii=False, separators=(",", ":")).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def bench(service, n=1000, seed=0):
+    """Mean milliseconds per query type over n random queries around the solar points."""
+    rng = np.random.default_rng(seed)
+    t = service.table("solar")
+    pick = rng.integers(0, len(t), n)
+    timings = {}
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        for i in pick:
+            fn(int(i))
+        timings[name] = (time.perf_counter() - t0) * 1000 / n
+
+    # a ~2 km viewport, typical of zoom 14-15
+    timed("points", lambda i: handle(service, f"/points?crs={LV95}&bbox={t.xs[i] - 1000},"
+                                              f"{t.ys[i] - 1000},{t.xs[i] + 1000},{t.ys[i] + 1000}"))
+    timed("attrs", lambda i: handle(service, f"/attrs?layer=solar&id={i}"))
+    if "buildings" in service.tables:
+        timed("nearest", lambda i: handle(service, f"/nearest?layer=buildings&x={t.xs[i]}&y={t.ys[i]}"))
+    return timings
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve bbox, nearest and attribute queries for lazy maps")
+    ap.add_argument("--solar", default=SOLAR_PATH)
+    ap.add_argument("--buildings", default=BUILDINGS_PATH,
+                    help="Building register (empty: solar layer only)")
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--radius", type=float, default=RADIUS_M,
+                    help=f"Max nearest-point distance in metres (default: {RADIUS_M:g})")
+    ap.add_argument("--bench", type=int, default=0,
+                    help="Time N random queries of each type instead of serving")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.solar):
+        print(f"[ERROR] File not found: {args.solar}")
+        return
+    t0 = time.perf_counter()
+    service = QueryService(args.solar, args.buildings, args.radius)
+    print("[INFO] Indexed " + ", ".join(f"{len(t)} {k}" for k, t in service.tables.items())
+          + f" in {time.perf_counter() - t0:.1f}s")
+    if args.bench:
+        timings = bench(service, args.bench)
+        print("[INFO] ms per query: " + ", ".join(f"{k} {v:.2f}" for k, v in timings.items()))
+        return
+
+    server = make_server(service, args.port)
+    print(f"[OK] Query server on http://127.0.0.1:{args.port}/ (/points, /nearest, /attrs, /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
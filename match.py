@@ -1,6 +1,22 @@
 #!/usr/bin/env python3
-import pandas as pd
+"""
+Match solar installations to building coordinates with a distance tolerance.
+- Streams buildings_BE.csv in chunks from the Parquet cache (datacache.py),
+  reading only GKODE/GKODN as float64
+- Grid-hash index (spatial.py) over the solar points; each solar building
+  keeps its nearest building within --tolerance metres across all chunks
+- Reports match rate and runtime; memory is bounded by the chunk size
+"""
+
+import argparse
 import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from datacache import iter_csv, load_csv
+from spatial import GridIndex
 
 # Dataset with building coordinates in GK
 BUILDINGS_PATH = "dataset/buildings_BE.csv"
@@ -9,52 +25,89 @@ BERN_PATH = "dataset/BernSolarPanelBuildings.csv"
 # Output dataset with matching x,y columns only
 OUTPUT_PATH = "dataset/buildings_BE_matches_xy.csv"
 
+TOLERANCE_M = 10.0
+CHUNK_ROWS = 200_000
+
+
+def read_xy(path, x_col, y_col):
+    """Read only the coordinate columns, numeric, rows with missing values dropped."""
+    df = load_csv(path, columns=[x_col, y_col])
+    return df.apply(pd.to_numeric, errors="coerce").dropna()
 
-def left_of_dot_to_int(series: pd.Series) -> pd.Series:
-    # Keep only the part before the decimal point, then cast to int
-    s = series.astype(str).str.split(".", n=1, expand=True)[0]
-    return pd.to_numeric(s, errors="coerce").astype("Int64")
+
+def match(buildings_path, bern_path, tolerance=TOLERANCE_M, chunk_rows=CHUNK_ROWS):
+    """
+    Nearest building within tolerance for every solar point.
+    Returns (solar _x/_y DataFrame, building x, building y, distance, rows scanned);
+    unmatched solar points have NaN coordinates and an infinite distance.
+    """
+    bern = read_xy(bern_path, "_x", "_y")
+    index = GridIndex(bern["_x"].to_numpy(), bern["_y"].to_numpy(),
+                      cell=max(tolerance, 1.0))
+
+    best_d = np.full(len(bern), np.inf)
+    best_x = np.full(len(bern), np.nan)
+    best_y = np.full(len(bern), np.nan)
+    rows = 0
+    for chunk in iter_csv(buildings_path, ["GKODE", "GKODN"], chunk_rows):
+        chunk = chunk.dropna()
+        rows += len(chunk)
+        bx = chunk["GKODE"].to_numpy(dtype=np.float64)
+        by = chunk["GKODN"].to_numpy(dtype=np.float64)
+        b, s, d = index.pairs_within(bx, by, tolerance)
+        if not len(s):
+            continue
+        # closest building per solar point within this chunk
+        o = np.lexsort((d, s))
+        b, s, d = b[o], s[o], d[o]
+        first = np.r_[True, s[1:] != s[:-1]]
+        b, s, d = b[first], s[first], d[first]
+        better = d < best_d[s]
+        s, b = s[better], b[better]
+        best_d[s] = d[better]
+        best_x[s] = bx[b]
+        best_y[s] = by[b]
+    return bern, best_x, best_y, best_d, rows
 
 
 def main():
-    if not os.path.exists(BUILDINGS_PATH):
-        print(f"File not found: {BUILDINGS_PATH}")
-        return
-    if not os.path.exists(BERN_PATH):
-        print(f"File not found: {BERN_PATH}")
-        return
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--buildings", default=BUILDINGS_PATH)
+    ap.add_argument("--bern", default=BERN_PATH)
+    ap.add_argument("--out", default=OUTPUT_PATH)
+    ap.add_argument("--tolerance", type=float, default=TOLERANCE_M,
+                    help=f"Max solar-to-building distance in metres (default: {TOLERANCE_M})")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                    help=f"Buildings read per chunk (default: {CHUNK_ROWS})")
+    args = ap.parse_args()
 
-    # buildings_BE.csv: expected GKODE, GKODN (with decimals)
-    bld = pd.read_csv(BUILDINGS_PATH, dtype=str)
-    if not {"GKODE", "GKODN"}.issubset(bld.columns):
-        print("Missing GKODE/GKODN columns in buildings_BE.csv")
-        return
-    bld["x_int"] = left_of_dot_to_int(bld["GKODE"])
-    bld["y_int"] = left_of_dot_to_int(bld["GKODN"])
-    bld = bld.dropna(subset=["x_int", "y_int"])
-
-    # BernSolarPanelBuildings.csv: expected _x, _y (integers)
-    bern = pd.read_csv(BERN_PATH)
-    if not {"_x", "_y"}.issubset(bern.columns):
-        print("Missing _x/_y columns in BernSolarPanelBuildings.csv")
-        return
-    bern["_x"] = pd.to_numeric(bern["_x"], errors="coerce").astype("Int64")
-    bern["_y"] = pd.to_numeric(bern["_y"], errors="coerce").astype("Int64")
-    bern = bern.dropna(subset=["_x", "_y"])
+    for path in (args.buildings, args.bern):
+        if not os.path.exists(path):
+            print(f"File not found: {path}")
+            return
 
-    # Match on x,y
-    merged = bld.merge(bern, left_on=["x_int", "y_int"], right_on=[
-                       "_x", "_y"], how="inner")
+    # buildings_BE.csv: expected GKODE, GKODN; BernSolarPanelBuildings.csv: _x, _y
+    t0 = time.perf_counter()
+    try:
+        bern, bx, by, dist, rows = match(args.buildings, args.bern,
+                                         args.tolerance, args.chunk_rows)
+    except ValueError as e:
+        print(f"Missing coordinate columns: {e}")
+        return
+    matched = np.isfinite(dist)
+    elapsed = time.perf_counter() - t0
 
-    # New dataset with only x,y columns (from matched values)
-    result = merged.rename(columns={"_x": "x", "_y": "y"})[
-        ["x", "y"]].drop_duplicates()
+    # New dataset with only x,y columns (building coordinates of the matches)
+    result = pd.DataFrame({"GKODE": bx[matched], "GKODN": by[matched]}).drop_duplicates()
 
-    # Save
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    result.to_csv(OUTPUT_PATH, index=False, encoding="utf-8")
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    result.to_csv(args.out, index=False, encoding="utf-8")
+    print(f"Buildings scanned: {rows} in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+    print(f"Solar buildings matched: {matched.sum()} / {len(bern)} "
+          f"({matched.mean():.1%}) within {args.tolerance} m, "
+          f"median distance {np.median(dist[matched]) if matched.any() else float('nan'):.2f} m")
     print(f"Matches found: {len(result)}")
-    print(f"File saved: {OUTPUT_PATH}")
+    print(f"File saved: {args.out}")
 
 
 if __name__ == "__main__":
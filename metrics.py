@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+In-process metrics for the download and processing stages.
+- Counters, gauges and fixed-bucket histograms with optional labels, kept in
+  one process-wide registry (METRICS) that wms.py/mosaic.py record into
+- Periodic one-line progress summaries (Reporter): tiles/s, MB/s, request
+  latency p50/p95/p99, retries, HTTP status mix, queue depth
+- JSON dump (--metrics-json) and an optional local Prometheus-style endpoint
+  (--metrics-port): GET /metrics (text format) or /metrics.json
+
+Inspect a dump:
+  python metrics.py metrics.json
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds; suits both local work (ms) and slow WMS requests
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last = above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket holding the q-th value."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / c, self.max)
+            seen += c
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "max": self.max,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+                "p99": self.quantile(0.99),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self.counters[k] = self.counters.get(k, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            h = self.histograms.get(k)
+            if h is None:
+                h = self.histograms[k] = Histogram()
+            h.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager observing the elapsed seconds into a histogram."""
+        return _Timer(self, name, labels)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self.counters.get(_key(name, labels), 0)
+
+    def by_label(self, name, label):
+        """{label value: count} over the counter series name{label="..."}."""
+        prefix = name + "{" + label + '="'
+        with self._lock:
+            return {k[len(prefix):].split('"', 1)[0]: v for k, v in self.counters.items()
+                    if k.startswith(prefix)}
+
+    def gauge(self, name, **labels):
+        with self._lock:
+            return self.gauges.get(_key(name, labels))
+
+    def histogram(self, name, **labels):
+        with self._lock:
+            return self.histograms.get(_key(name, labels))
+
+    def snapshot(self):
+        with self._lock:
+            return {"uptime_s": time.time() - self.started,
+                    "counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "histograms": {k: h.snapshot() for k, h in self.histograms.items()}}
+
+    def dump_json(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def prometheus(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for k, v in sorted(self.counters.items()):
+                lines.append(f"{k} {v}")
+            for k, v in sorted(self.gauges.items()):
+                lines.append(f"{k} {v}")
+            for k, h in sorted(self.histograms.items()):
+                name, _, labels = k.partition("{")
+                labels = labels.rstrip("}")
+                sep = "," if labels else ""
+                cum = 0
+                for b, c in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cum += c
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{b}"}} {cum}')
+                suffix = "{" + labels + "}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {h.sum}")
+                lines.append(f"{name}_count{suffix} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics, self.name, self.labels = metrics, name, labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.t0, **self.labels)
+
+
+METRICS = Metrics()
+
+
+def download_summary(m=METRICS):
+    """One-line progress of the WMS download counters and histograms."""
+    up = max(time.time() - m.started, 1e-9)
+    tiles = m.by_label("tiles_total", "status")
+    ok = tiles.get("ok", 0)
+    parts = [f"{ok} ok ({ok / up:.1f}/s)", f"{tiles.get('failed', 0)} failed",
+             f"{tiles.get('rejected', 0)} rejected",
+             f"{m.counter('wms_bytes_total') / up / 1e6:.2f} MB/s"]
+    lat = m.histogram("wms_request_seconds")
+    if lat is not None and lat.count:
+        parts.append(f"latency p50 {lat.quantile(0.5) * 1000:.0f} ms, "
+                     f"p95 {lat.quantile(0.95) * 1000:.0f} ms, "
+                     f"p99 {lat.quantile(0.99) * 1000:.0f} ms")
+    parts.append(f"{m.counter('wms_retries_total')} retries")
+    status = m.by_label("wms_responses_total", "status")
+    if status:
+        parts.append("HTTP " + " ".join(f"{k}:{v}" for k, v in sorted(status.items())))
+    depth = m.gauge("download_queue_depth")
+    if depth is not None:
+        parts.append(f"queue {depth}")
+    return "[PROGRESS] " + ", ".join(parts)
+
+
+class Reporter:
+    """Prints summary() every interval seconds from a daemon thread until stopped."""
+
+    def __init__(self, interval, summary=download_summary):
+        self.interval = interval
+        self.summary = summary
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.summary(), flush=True)
+
+    def __enter__(self):
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def serve(port, metrics=METRICS, host="127.0.0.1"):
+    """Start the /metrics endpoint in a daemon thread; returns the server (call shutdown())."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(metrics.snapshot()).encode(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, ctype = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarise a metrics JSON dump")
+    ap.add_argument("path")
+    args = ap.parse_args()
+
+    with open(args.path, encoding="utf-8") as f:
+        snap = json.load(f)
+    print(f"[INFO] uptime {snap['uptime_s']:.1f}s")
+    for k, v in sorted(snap["counters"].items()):
+        print(f"  {k} = {v}")
+    for k, v in sorted(snap["gauges"].items()):
+        print(f"  {k} = {v}")
+    for k, h in sorted(snap["histograms"].items()):
+        print(f"  {k}: n={h['count']} mean={h['mean'] * 1000:.1f} ms "
+              f"p50={h['p50'] * 1000:.1f} p95={h['p95'] * 1000:.1f} p99={h['p99'] * 1000:.1f} ms "
+              f"max={h['max'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
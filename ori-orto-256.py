@@ -1,58 +1,48 @@
 #!/usr/bin/env python3
+import argparse
 import os
+import sys
 import pandas as pd
-import requests
-from urllib.parse import urlencode
+from mosaic import download_mosaic
+from wms import (add_download_args, csv_jobs, download_options,
+                 download_tiles, open_manifest)
 
 # Input dataset: columns "GKODE","GKODN" in LV95 / EPSG:2056
 CSV_PATH = "dataset/building_sample_BE.csv"
 OUT_DIR = "unlabeled-orthophoto-256px"
 
 WIDTH = HEIGHT = 256
-# 20 cm per pixel (double the area compared to 0.10 m/px)
+# 7.5 cm per pixel: 19.2 m footprint (the 125px chips cover 25 m at 0.20 m/px)
 M_PER_PX = 0.075
 LAYER = "ch.swisstopo.swissimage-product"  # High-res orthophoto
-WMS_URL = "https://wms.geo.admin.ch/"
-
-
-def download_ortho(x, y, out_file):
-    half = (WIDTH * M_PER_PX) / 2.0
-    minx, miny, maxx, maxy = x - half, y - half, x + half, y + half
-
-    params = {
-        "SERVICE": "WMS",
-        "REQUEST": "GetMap",
-        "VERSION": "1.3.0",
-        "LAYERS": LAYER,
-        "STYLES": "",
-        "CRS": "EPSG:2056",
-        "BBOX": f"{minx},{miny},{maxx},{maxy}",
-        "WIDTH": WIDTH,
-        "HEIGHT": HEIGHT,
-        "FORMAT": "image/png"
-    }
-
-    url = f"{WMS_URL}?{urlencode(params)}"
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    with open(out_file, "wb") as f:
-        f.write(r.content)
 
 
 def main():
-    df = pd.read_csv(CSV_PATH)
-    os.makedirs(OUT_DIR, exist_ok=True)
-
-    for i, row in df.iterrows():
-        x, y = float(row["GKODE"]), float(row["GKODN"])
-        out_file = os.path.join(OUT_DIR, f"ortho_{int(x)}_{int(y)}.png")
-
-        try:
-            download_ortho(x, y, out_file)
-            print(f"[OK] Saved {out_file}")
-        except Exception as e:
-            print(f"[WARN] Failed {x},{y}: {e}")
+    ap = argparse.ArgumentParser(
+        description="Download 256px orthophoto chips for unlabeled buildings")
+    add_download_args(ap, CSV_PATH, OUT_DIR)
+    args = ap.parse_args()
+
+    df = pd.read_csv(args.csv)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    jobs = csv_jobs(df, args.out_dir)
+    manifest = open_manifest(args)
+    opts = download_options(args, manifest)
+    try:
+        if args.mosaic:
+            stats = download_mosaic(jobs, WIDTH, HEIGHT, M_PER_PX, layer=LAYER,
+                                    block_px=args.block_px, min_fill=args.min_fill, **opts)
+        else:
+            stats = download_tiles(jobs, WIDTH, HEIGHT, M_PER_PX, layer=LAYER, **opts)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    if stats["failed"]:
+        # non-zero exit keeps pipeline.py from recording the stage as complete
+        print(f"[ERROR] {stats['failed']} tiles failed; rerun (or --only-failed) to retry them")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash index for orthophoto chips: near-duplicates and blank tiles.
+- dHash (gradient) and pHash (DCT) per chip, each packed into one uint64
+- Multi-index hashing: the 64 bits are split into radius+1 blocks, so any hash
+  within Hamming distance `radius` shares at least one block exactly; lookups
+  touch only those buckets and verify with a popcount
+- Blank tiles: near-uniform images (WMS errors, areas outside coverage)
+- `scan` hashes every chip of several directories in one pass and writes the
+  index (.npz) plus an optional CSV report; ChipFilter lets wms.download_tiles
+  drop blank/duplicate chips before they are written (--skip-blank, --skip-duplicates)
+
+Example:
+  python phash.py scan --dir true-orthophoto-125px --dir true-orthophoto-256px \\
+      --dir unlabeled-orthophoto-125px --dir unlabeled-orthophoto-256px --report junk.csv
+Dep: pip install numpy pillow
+"""
+
+import argparse
+import csv
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from chipstore import list_chips
+
+INDEX_PATH = ".cache/phash.npz"
+RADIUS = 4  # max Hamming distance (of 64 bits) for a near-duplicate
+
+# blank: grey-level std below BLANK_STD, or one grey level covering UNIFORM_FRAC of pixels
+BLANK_STD = 2.0
+UNIFORM_FRAC = 0.95
+
+
+def _dct_matrix(n=32):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+_DCT = _dct_matrix()
+
+
+def to_u64(bits):
+    """64 booleans -> one uint64 (first bit = most significant)."""
+    return np.packbits(np.asarray(bits, dtype=bool).ravel()).view(">u8")[0].astype(np.uint64)
+
+
+def popcount(a):
+    """Set bits per element of a uint64 array."""
+    a = np.asarray(a, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(a)
+    return np.unpackbits(a.view(np.uint8).reshape(*a.shape, 8), axis=-1).sum(axis=-1)
+
+
+def hamming(a, b):
+    return popcount(np.bitwise_xor(a, b))
+
+
+def dhash(gray):
+    """Horizontal gradient hash of a PIL 'L' image."""
+    px = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return to_u64(px[:, 1:] > px[:, :-1])
+
+
+def phash(gray):
+    """DCT hash of a PIL 'L' image: low 8x8 frequencies against their median."""
+    px = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    low = (_DCT @ px @ _DCT.T)[:8, :8].ravel()
+    return to_u64(low > np.median(low[1:]))
+
+
+def blank_reason(gray):
+    """'blank' for near-uniform images, else None."""
+    px = np.asarray(gray)
+    if px.std() < BLANK_STD:
+        return "blank"
+    if np.bincount(px.ravel(), minlength=256).max() >= UNIFORM_FRAC * px.size:
+        return "blank"
+    return None
+
+
+def hash_image(data):
+    """(dhash, phash, blank reason or None) of encoded image bytes or a path."""
+    src = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    with Image.open(src) as im:
+        gray = im.convert("L")
+    return dhash(gray), phash(gray), blank_reason(gray)
+
+
+class HashIndex:
+    """Hamming-radius lookup over uint64 hashes by multi-index hashing."""
+
+    def __init__(self, radius=RADIUS):
+        self.radius = radius
+        edges = np.linspace(0, 64, radius + 2).astype(int)
+        self.blocks = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(edges[:-1], edges[1:])]
+        self.tables = [{} for _ in self.blocks]
+        # uint64 array grown by doubling: queries gather candidates without copying all hashes
+        self.hashes = np.zeros(1024, dtype=np.uint64)
+        self.ids = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _parts(self, h):
+        h = int(h)
+        return [(h >> shift) & mask for shift, mask in self.blocks]
+
+    def query(self, h):
+        """[(id, distance)] of indexed hashes within radius of h, closest first."""
+        cand = set()
+        for table, part in zip(self.tables, self._parts(h)):
+            cand.update(table.get(part, ()))
+        if not cand:
+            return []
+        cand = np.fromiter(cand, dtype=np.int64)
+        d = hamming(self.hashes[cand], np.uint64(h))
+        keep = d <= self.radius
+        order = np.argsort(d[keep], kind="stable")
+        return [(self.ids[i], int(dist)) for i, dist in zip(cand[keep][order], d[keep][order])]
+
+    def add(self, h, item_id):
+        n = len(self.ids)
+        if n == len(self.hashes):
+            self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+        self.hashes[n] = np.uint64(h)
+        self.ids.append(item_id)
+        for table, part in zip(self.tables, self._parts(h)):
+            table.setdefault(part, []).append(n)
+
+    def find_or_add(self, h, item_id):
+        """Id of an indexed near-duplicate of h (and h is not added), or None after adding it."""
+        with self._lock:
+            hits = self.query(h)
+            if hits:
+                return hits[0][0]
+            self.add(h, item_id)
+            return None
+
+
+class ChipFilter:
+    """
+    Download hook: fn(png bytes, name) -> rejection reason ('blank', 'duplicate') or None.
+    Duplicates are checked against the chips accepted so far (and an optional index).
+    """
+
+    def __init__(self, skip_blank=True, dup_radius=None, index_path=""):
+        self.skip_blank = skip_blank
+        self.index = HashIndex(dup_radius) if dup_radius is not None else None
+        if self.index is not None and index_path and os.path.exists(index_path):
+            with np.load(index_path) as z:
+                ok = ~z["blank"]
+                for h, path in zip(z["phash"][ok], z["path"][ok]):
+                    self.index.add(h, str(path))
+
+    def __call__(self, data, name=""):
+        src = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        try:
+            with Image.open(src) as im:
+                gray = im.convert("L")
+        except OSError as e:
+            if src is data:  # a file object
+                return f"undecodable: {e}"
+            return f"undecodable: {len(data)} bytes {bytes(data[:80])!r}"
+        return self.check_gray(gray, name)
+
+    def check_gray(self, gray, name=""):
+        """Same decision for an already decoded PIL 'L' image."""
+        if self.skip_blank:
+            blank = blank_reason(gray)
+            if blank:
+                return blank
+        if self.index is not None and self.index.find_or_add(phash(gray), name) is not None:
+            return "duplicate"
+        return None
+
+
+def scan(dirs, radius=RADIUS, workers=8):
+    """
+    Hash every chip in dirs. Returns a dict of arrays: path, dir, dhash, phash,
+    blank (bool), dup_of (index of the first near-duplicate, -1 if none).
+    """
+    paths, owners = [], []
+    for d in dirs:
+        for path, _, _ in list_chips(d):
+            paths.append(path)
+            owners.append(d)
+    n = len(paths)
+    dh = np.zeros(n, dtype=np.uint64)
+    ph = np.zeros(n, dtype=np.uint64)
+    blank = np.zeros(n, dtype=bool)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, (d, p, b) in enumerate(pool.map(hash_image, paths, chunksize=64)):
+            dh[i], ph[i], blank[i] = d, p, b is not None
+
+    index = HashIndex(radius)
+    dup_of = np.full(n, -1, dtype=np.int64)
+    for i in np.flatnonzero(~blank):
+        j = index.find_or_add(ph[i], int(i))
+        if j is not None:
+            dup_of[i] = j
+    return {"path": np.array(paths), "dir": np.array(owners), "dhash": dh, "phash": ph,
+            "blank": blank, "dup_of": dup_of}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Perceptual-hash index of chip directories")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("scan", help="Hash chips, flag blank tiles and near-duplicates")
+    p.add_argument("--dir", action="append", required=True, help="Chip directory (repeatable)")
+    p.add_argument("--out", default=INDEX_PATH, help=f"Index file (default: {INDEX_PATH})")
+    p.add_argument("--radius", type=int, default=RADIUS,
+                   help=f"Max Hamming distance for near-duplicates (default: {RADIUS})")
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--report", default="", help="CSV of flagged chips (path, reason, duplicate_of)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    res = scan(args.dir, args.radius, args.workers)
+    elapsed = time.perf_counter() - t0
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    np.savez(args.out, **res)
+
+    paths, owners, dup_of = res["path"], res["dir"], res["dup_of"]
+    dup = dup_of >= 0
+    cross = dup & (owners != owners[np.maximum(dup_of, 0)])
+    for d in args.dir:
+        sel = owners == d
+        print(f"[INFO] {d}: {sel.sum()} chips, {(res['blank'] & sel).sum()} blank, "
+              f"{(dup & sel).sum()} near-duplicates")
+    print(f"[INFO] {len(paths)} chips hashed in {elapsed:.1f}s "
+          f"({len(paths) / elapsed if elapsed else 0:.0f} chips/s); "
+          f"{res['blank'].sum()} blank, {dup.sum()} near-duplicates "
+          f"({cross.sum()} across directories) -> {args.out}")
+
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["path", "reason", "duplicate_of"])
+            for i in np.flatnonzero(res["blank"]):
+                w.writerow([paths[i], "blank", ""])
+            for i in np.flatnonzero(dup):
+                w.writerow([paths[i], "duplicate", paths[dup_of[i]]])
+        print(f"[OK] Report saved: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Dataset pipeline as a DAG of the repo's scripts, re-running only stale stages.
+- Each stage declares its command, input and output paths; dependencies follow
+  from which stage produces which input
+- A stage is stale when its command, an input fingerprint or an output changed
+  since its last successful run (or an output is missing); fingerprints are
+  SHA-1 for files (re-hashed only when mtime/size change) and count/size/mtime
+  for directories, kept in .cache/pipeline/state.json
+- The parquet stage converts the shared CSVs first, so the stages reading them
+  never race on a cold Parquet cache
+- Chips are exported with export_chips.py: one fetch per building for both
+  sizes, positives and negatives in parallel (--jobs), each also linked into
+  <dir>/train|val|test/ by the split sample.py assigned
+- Each stage's output goes to .cache/pipeline/logs/<stage>.log
+- Ends with a per-stage timing report
+
+Examples:
+  python pipeline.py                 # everything that is stale
+  python pipeline.py --dry-run       # what would run, and why
+  python pipeline.py negatives --jobs 2
+  python pipeline.py --list
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from datacache import file_sha1
+
+STATE_DIR = ".cache/pipeline"
+PY = sys.executable
+
+BUILDINGS = "dataset/buildings_BE.csv"
+SOLAR = "dataset/BernSolarPanelBuildings.csv"
+MATCHES = "dataset/buildings_BE_matches_xy.csv"
+SAMPLE = "dataset/building_sample_BE.csv"
+MATCHES_SPLIT = "dataset/buildings_BE_matches_xy_split.csv"
+PARQUET = ".cache/parquet/dataset.json"
+
+# name: (script + arguments, inputs, outputs); paths match the scripts' defaults
+STAGES = {
+    "parquet": (["datacache.py", BUILDINGS, SOLAR, "--stamp", PARQUET], [BUILDINGS, SOLAR],
+                [PARQUET]),
+    "match": (["match.py"], [BUILDINGS, SOLAR, PARQUET], [MATCHES]),
+    # --positives splits the matches with the negatives' blocks
+    "sample": (["sample.py", "--positives", MATCHES], [BUILDINGS, SOLAR, PARQUET, MATCHES],
+               [SAMPLE, MATCHES_SPLIT]),
+    "density": (["density.py"], [BUILDINGS, SOLAR, PARQUET], [".cache/density/pyramid.json"]),
+    "positives": (["export_chips.py", "--csv", MATCHES_SPLIT], [MATCHES_SPLIT],
+                  ["true-orthophoto-125px", "true-orthophoto-256px"]),
+    "negatives": (["export_chips.py", "--csv", SAMPLE, "--prefix", "unlabeled-orthophoto",
+                   "--out-dir", "unlabeled-orthophoto-source"], [SAMPLE],
+                  ["unlabeled-orthophoto-125px", "unlabeled-orthophoto-256px"]),
+    "temporal": (["temporal.py", "--store", "chips-temporal-256px"], [BUILDINGS, SOLAR, PARQUET],
+                 ["chips-temporal-256px/store.json"]),
+}
+
+
+def dependencies(stages):
+    """{stage: set of stages producing one of its inputs}."""
+    producer = {out: name for name, (_, _, outs) in stages.items() for out in outs}
+    return {name: {producer[i] for i in ins if i in producer and producer[i] != name}
+            for name, (_, ins, _) in stages.items()}
+
+
+def with_ancestors(targets, deps):
+    needed, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(deps[name])
+    return needed
+
+
+class State:
+    """Persisted fingerprints: per-file hash cache and per-stage last successful run."""
+
+    def __init__(self, root=STATE_DIR):
+        self.path = os.path.join(root, "state.json")
+        self.lock = threading.Lock()
+        self.data = {"files": {}, "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def fingerprint(self, path):
+        """Content fingerprint of a file or directory, None if missing."""
+        if os.path.isdir(path):
+            count = size = 0
+            newest = 0.0
+            for dirpath, _, files in os.walk(path):
+                for name in files:
+                    st = os.stat(os.path.join(dirpath, name))
+                    count += 1
+                    size += st.st_size
+                    newest = max(newest, st.st_mtime)
+            return f"dir:{count}:{size}:{newest}"
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        with self.lock:
+            cached = self.data["files"].get(path)
+        if cached and cached[:2] == [st.st_mtime, st.st_size]:
+            return cached[2]
+        digest = "sha1:" + file_sha1(path)
+        with self.lock:
+            self.data["files"][path] = [st.st_mtime, st.st_size, digest]
+        return digest
+
+    def stale_reason(self, name, cmd, inputs, outputs):
+        """Why the stage must run, or None when it is up to date."""
+        last = self.data["stages"].get(name)
+        if last is None:
+            return "never run"
+        if last["cmd"] != cmd:
+            return "command changed"
+        for path in inputs:
+            fp = self.fingerprint(path)
+            if fp is None:
+                return f"missing input {path}"
+            if last["inputs"].get(path) != fp:
+                return f"input changed: {path}"
+        for path in outputs:
+            fp = self.fingerprint(path)
+            if fp is None:
+                return f"missing output {path}"
+            if last["outputs"].get(path) != fp:
+                return f"output changed: {path}"
+        return None
+
+    def record(self, name, cmd, inputs, outputs):
+        entry = {"cmd": cmd, "time": time.time(),
+                 "inputs": {p: self.fingerprint(p) for p in inputs},
+                 "outputs": {p: self.fingerprint(p) for p in outputs}}
+        with self.lock:
+            self.data["stages"][name] = entry
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def run_stage(name, cmd, log_dir):
+    """Run one stage command with its output in <log_dir>/<name>.log; returns (code, seconds)."""
+    os.makedirs(log_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    with open(os.path.join(log_dir, f"{name}.log"), "w", encoding="utf-8") as log:
+        code = subprocess.call([PY] + cmd, stdout=log, stderr=subprocess.STDOUT)
+    return code, time.perf_counter() - t0
+
+
+def run_pipeline(stages, targets=None, jobs=2, force=False, dry_run=False, state_dir=STATE_DIR):
+    """Run stale stages needed for targets (all by default); returns {stage: (status, seconds, note)}."""
+    deps = dependencies(stages)
+    needed = with_ancestors(targets or list(stages), deps)
+    state = State(state_dir)
+    log_dir = os.path.join(state_dir, "logs")
+    report = {}
+    pending = {n for n in stages if n in needed}
+    forced = set(targets or stages) if force else set()
+
+    def check(name):
+        cmd, ins, outs = stages[name]
+        if name in forced:
+            return "forced"
+        # stages whose input was just rebuilt upstream see the new fingerprint here
+        return state.stale_reason(name, cmd, ins, outs)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        running = {}
+        while pending or running:
+            for name in sorted(pending):
+                if any(d in pending or d in running.values() for d in deps[name]):
+                    continue
+                pending.discard(name)
+                if dry_run and any(report[d][0] == "stale" for d in deps[name]):
+                    report[name] = ("stale", 0.0, "upstream stale")
+                    continue
+                failed = [d for d in deps[name] if report[d][0] in ("failed", "skipped")]
+                if failed:
+                    report[name] = ("skipped", 0.0, f"upstream {failed[0]} did not complete")
+                    continue
+                reason = check(name)
+                if reason is None:
+                    report[name] = ("up-to-date", 0.0, "")
+                    continue
+                if dry_run:
+                    report[name] = ("stale", 0.0, reason)
+                    continue
+                print(f"[INFO] Running {name} ({reason}): python {' '.join(stages[name][0])}")
+                running[pool.submit(run_stage, name, stages[name][0], log_dir)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                code, elapsed = fut.result()
+                cmd, ins, outs = stages[name]
+                if code == 0 and all(state.fingerprint(p) is not None for p in outs):
+                    state.record(name, cmd, ins, outs)
+                    report[name] = ("ran", elapsed, "")
+                    print(f"[OK] {name} finished in {elapsed:.1f}s")
+                else:
+                    note = f"exit code {code}" if code else "outputs missing"
+                    report[name] = ("failed", elapsed, f"{note}, see {log_dir}/{name}.log")
+                    print(f"[WARN] {name} failed ({note})")
+    state.save()
+    return report
+
+
+def print_report(report, stages, wall):
+    print(f"\n{'stage':<16} {'status':<11} {'seconds':>8}  note")
+    for name in stages:
+        if name in report:
+            status, elapsed, note = report[name]
+            print(f"{name:<16} {status:<11} {elapsed:>8.1f}  {note}")
+    busy = sum(r[1] for r in report.values())
+    print(f"[INFO] Wall time {wall:.1f}s, stage time {busy:.1f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the dataset pipeline incrementally")
+    ap.add_argument("targets", nargs="*", help="Stages to bring up to date (default: all)")
+    ap.add_argument("--jobs", type=int, default=2, help="Stages run in parallel (default: 2)")
+    ap.add_argument("--force", action="store_true", help="Run the selected stages even if fresh")
+    ap.add_argument("--dry-run", action="store_true", help="Only report stale stages")
+    ap.add_argument("--list", action="store_true", help="Show the stages and their dependencies")
+    ap.add_argument("--state-dir", default=STATE_DIR)
+    args = ap.parse_args()
+
+    if args.list:
+        deps = dependencies(STAGES)
+        for name, (cmd, ins, outs) in STAGES.items():
+            after = f" (after {', '.join(sorted(deps[name]))})" if deps[name] else ""
+            print(f"{name}{after}: {' '.join(cmd)}\n    in:  {', '.join(ins)}\n"
+                  f"    out: {', '.join(outs)}")
+        return
+    unknown = [t for t in args.targets if t not in STAGES]
+    if unknown:
+        ap.error(f"unknown stage(s) {unknown}; choose from {list(STAGES)}")
+
+    t0 = time.perf_counter()
+    report = run_pipeline(STAGES, args.targets, args.jobs, args.force, args.dry_run,
+                          args.state_dir)
+    print_report(report, STAGES, time.perf_counter() - t0)
+    if any(r[0] == "failed" for r in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,40 @@ Examples:
 
   # Scatter on satellite (dataset with east_lv95/north_lv95)
   python plotmap.py --csv bern_buildings.csv --x east_lv95 --y north_lv95 --out bern_scatter.png --kind scatter --s 0.5
+
+  # Batch: every CSV x kind x gridsize, each CSV reprojected once, rendered in a process pool
+  echo '{"csv": ["dataset/BernSolarPanelBuildings.csv", "dataset/building_sample_BE.csv"],
+         "kind": ["scatter", "hexbin"], "gridsize": [80, 120]}' > jobs.json
+  python plotmap.py --jobs jobs.json --procs 4
+
+  # Solar/total ratio from the pre-aggregated pyramid (python density.py first)
+  python plotmap.py --kind density --value ratio --gridsize 80 --out bern_ratio.png
+
+  # Repeated plots without the import cost: same arguments through the mapd.py daemon
+  python mapd.py serve &
+  python mapd.py plotmap --csv dataset/BernSolarPanelBuildings.csv --kind scatter --out bern_scatter.png
 """
 
 import argparse
+import io
+import itertools
+import json
 import os
 import sys
-import pandas as pd
-import matplotlib.pyplot as plt
-import geopandas as gpd
-import contextily as ctx
-from owslib.wfs import WebFeatureService
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
+from datacache import csv_columns, load_csv
+from density import DENSITY_DIR, VALUES, DensityPyramid
+from geocache import CACHE_DIR, MAX_BYTES, TTL_S, GeoCache, OfflineCacheMiss
+from projection import LV95, WEB_MERCATOR, get_transformer, transform
+
+
+# Per-plot options; batch jobs override any of them
+PLOT_DEFAULTS = {"x": "", "y": "", "kind": "hexbin", "sample": 0,
+                 "s": 1.0, "alpha": 0.5, "gridsize": 100,
+                 "density": DENSITY_DIR, "value": "ratio"}
 
 CANDIDATES = [
     ("east_lv95", "north_lv95"),
@@ -26,23 +49,137 @@ CANDIDATES = [
     ("_x", "_y"),
     ("x", "y"),
     ("east", "north"),
+    ("gkode", "gkodn"),
     ("e", "n"),
 ]
 
 
-def load_canton_boundary(canton_code="BE"):
+# matplotlib, geopandas, contextily and owslib take seconds to import: they are
+# loaded on first use, so --help and argument errors return at once
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")  # files only; also safe in worker processes
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def warm():
+    """Import the plotting libraries and build the Transformer ahead of the first plot (mapd.py)."""
+    _pyplot()
+    import contextily
+    import geopandas
+    import owslib.wfs
+    get_transformer(LV95, WEB_MERCATOR)
+
+
+def load_canton_boundary(canton_code="BE", cache=None):
     """Download canton boundary from swisstopo WFS and return GeoDataFrame in EPSG:3857"""
+    import geopandas as gpd
+    layer = "ch.swisstopo.swissboundaries3d-kanton-flaeche.fill"
+    key = f"wfs:{layer}:{canton_code}:EPSG:3857"
+    path = cache.get(key, ".geojson") if cache is not None else None
+    if path:
+        # stored pre-projected; GeoJSON readers assume WGS84, so restore the CRS
+        return gpd.read_file(path).set_crs(epsg=3857, allow_override=True)
+
+    from owslib.wfs import WebFeatureService
     url = "https://wfs.geo.admin.ch/?SERVICE=WFS&VERSION=2.0.0&REQUEST=GetCapabilities"
     wfs = WebFeatureService(url=url, version="2.0.0")
-    layer = "ch.swisstopo.swissboundaries3d-kanton-flaeche.fill"
 
     response = wfs.getfeature(typename=layer, outputFormat="application/json")
     gdf = gpd.read_file(response)
     gdf = gdf[gdf["KANTONSABK"] == canton_code]
     gdf = gdf.to_crs(epsg=3857)
+    if cache is not None:
+        cache.put(key, ".geojson", gdf.to_json().encode("utf-8"))
     return gdf
 
 
+def tile_zoom(w, s, e, n, max_zoom=19):
+    """Automatic XYZ zoom for a lon/lat extent (contextily's rule)."""
+    zoom = max(np.ceil(np.log2(720.0 / (e - w))), np.ceil(np.log2(720.0 / (n - s))))
+    return int(min(zoom, max_zoom))
+
+
+def fetch_tile(url, cache=None, timeout=30):
+    """RGB array of one XYZ tile; every tile is cached on its own, so any extent
+    whose tiles were fetched before can be drawn offline."""
+    key = f"tile:{url}"
+    path = cache.get(key, ".tile") if cache is not None else None
+    if path:
+        with open(path, "rb") as f:
+            data = f.read()
+    else:
+        import requests
+        r = requests.get(url, headers={"user-agent": "plotmap.py"}, timeout=timeout)
+        r.raise_for_status()
+        data = r.content
+        if cache is not None:
+            cache.put(key, ".tile", data)
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as im:
+        return np.asarray(im.convert("RGB"))
+
+
+def tile_mosaic(bounds, source, cache=None, zoom="auto"):
+    """(img, extent) stitched from the XYZ tiles covering EPSG:3857 bounds (w, s, e, n)."""
+    import mercantile as mt
+    w, s, e, n = bounds
+    lon0, lat0 = mt.lnglat(w, s)
+    lon1, lat1 = mt.lnglat(e, n)
+    if zoom == "auto":
+        zoom = tile_zoom(lon0, lat0, lon1, lat1, source.get("max_zoom") or 19)
+    tiles = list(mt.tiles(lon0, lat0, lon1, lat1, [zoom]))
+    x0, y0 = min(t.x for t in tiles), min(t.y for t in tiles)
+    x1, y1 = max(t.x for t in tiles) + 1, max(t.y for t in tiles) + 1
+    img = None
+    for t in tiles:
+        tile = fetch_tile(source.build_url(x=t.x, y=t.y, z=t.z), cache)
+        size = tile.shape[0]
+        if img is None:
+            img = np.zeros(((y1 - y0) * size, (x1 - x0) * size, 3), dtype=np.uint8)
+        img[(t.y - y0) * size:(t.y - y0 + 1) * size, (t.x - x0) * size:(t.x - x0 + 1) * size] = tile
+    left, top = mt.xy(*mt.ul(x0, y0, zoom))
+    right, bottom = mt.xy(*mt.ul(x1, y1, zoom))
+    return img, (left, right, bottom, top)
+
+
+def basemap_image(bounds, source, cache=None, zoom="auto"):
+    """
+    (img, extent) of the basemap for EPSG:3857 bounds (w, s, e, n), cached per
+    extent; a new extent is stitched from cached tiles, also offline.
+    """
+    w, s, e, n = bounds
+    url = source.build_url() if hasattr(source, "build_url") else str(source)
+    key = f"basemap:{url}:{zoom}:{w:.0f},{s:.0f},{e:.0f},{n:.0f}"
+    path = None
+    if cache is not None:
+        try:
+            path = cache.get(key, ".npz")
+        except OfflineCacheMiss:
+            pass  # offline: the tiles may still be cached
+    if path:
+        with np.load(path) as z:
+            return z["img"], tuple(z["extent"])
+    img, extent = tile_mosaic(bounds, source, cache, zoom)
+    if cache is not None:
+        buf = io.BytesIO()
+        np.savez_compressed(buf, img=img, extent=np.asarray(extent))
+        cache.put(key, ".npz", buf.getvalue())
+    return img, extent
+
+
+def add_basemap(ax, source, cache=None, zoom="auto"):
+    """Like ctx.add_basemap for EPSG:3857 axes, with the fetched image cached per extent."""
+    w, e = ax.get_xlim()
+    s, n = ax.get_ylim()
+    img, extent = basemap_image((w, s, e, n), source, cache, zoom)
+    ax.imshow(img, extent=extent, interpolation="bilinear", zorder=0)
+    ax.axis((w, e, s, n))
+
+
 def pick_xy(cols):
     s = {c.lower(): c for c in cols}
     for ex, ny in CANDIDATES:
@@ -51,90 +188,295 @@ def pick_xy(cols):
     return None, None
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("--csv", required=True,
-                    help="Input CSV with LV95 coordinates")
-    ap.add_argument("--x", default="", help="X column (LV95 eastings)")
-    ap.add_argument("--y", default="", help="Y column (LV95 northings)")
-    ap.add_argument("--out", default="plot.png",
-                    help="Output PNG path (saved under images/)")
-    ap.add_argument(
-        "--kind", choices=["scatter", "hexbin"], default="hexbin", help="Plot type")
-    ap.add_argument("--sample", type=int, default=0,
-                    help="Plot only first N rows (0 = all)")
-    ap.add_argument("--s", type=float, default=1.0,
-                    help="Marker size for scatter")
-    ap.add_argument("--alpha", type=float, default=0.5,
-                    help="Alpha for points/hexes")
-    ap.add_argument("--gridsize", type=int, default=100,
-                    help="Hexbin gridsize (higher = finer)")
-    args = ap.parse_args()
+def resolve_xy(csv, x_col="", y_col=""):
+    """Coordinate columns of csv (explicit or guessed); ValueError if not found."""
+    if x_col and y_col:
+        return x_col, y_col
+    cols = csv_columns(csv)
+    x_col, y_col = pick_xy(cols)
+    if not x_col or not y_col:
+        raise ValueError(f"Could not determine coordinate columns in {csv}. "
+                         f"Available columns: {cols}")
+    return x_col, y_col
 
-    # dataset header
-    head = pd.read_csv(args.csv, nrows=0)
-    cols = list(head.columns)
 
-    x_col = args.x or ""
-    y_col = args.y or ""
-    if not x_col or not y_col:
-        x_col, y_col = pick_xy(cols)
-    if not x_col or not y_col:
-        print("[ERROR] Could not determine coordinate columns.", file=sys.stderr)
-        print(f"Available columns: {cols}", file=sys.stderr)
-        print("Pass them explicitly, e.g.: --x _x --y _y", file=sys.stderr)
-        sys.exit(1)
+def load_points(csv, x_col, y_col, sample=0):
+    """LV95 columns of csv reprojected to EPSG:3857 as two NumPy arrays."""
+    df = load_csv(csv, columns=[x_col, y_col])
+    if sample and sample > 0:
+        df = df.head(sample)
+    df = df.dropna()
+    return transform(df[x_col].to_numpy(), df[y_col].to_numpy(), LV95, WEB_MERCATOR)
+
 
-    # only coordinates
-    df = pd.read_csv(args.csv, usecols=[x_col, y_col])
-    if args.sample and args.sample > 0:
-        df = df.head(args.sample)
+def plot_bounds(x, y, pad=0.02):
+    """(w, s, e, n) of the points plus a relative padding."""
+    x_min, x_max = float(x.min()), float(x.max())
+    y_min, y_max = float(y.min()), float(y.max())
+    pad_x = (x_max - x_min) * pad
+    pad_y = (y_max - y_min) * pad
+    return x_min - pad_x, y_min - pad_y, x_max + pad_x, y_max + pad_y
 
-    # GeoDataFrame in LV95 -> 3857 for web basemap
-    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(
-        df[x_col], df[y_col]), crs="EPSG:2056")
-    gdf3857 = gdf.to_crs(epsg=3857)
 
+def density_mesh(root, value="ratio", gridsize=100):
+    """
+    EPSG:3857 cell corners and masked values of the density pyramid level with about
+    gridsize cells across, cropped to non-empty cells; cost depends on cells, not points.
+    """
+    pyramid = DensityPyramid(root)
+    xmin, _, xmax, _ = pyramid.bounds()
+    level = pyramid.level_for((xmax - xmin) / gridsize)
+    values, xe, ye = pyramid.grid(level, value)
+    empty = (pyramid.counts(level, "total") == 0) & (pyramid.counts(level, "solar") == 0)
+    rows = np.flatnonzero(~empty.all(axis=1))
+    cols = np.flatnonzero(~empty.all(axis=0))
+    r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    gx, gy = np.meshgrid(xe[c0:c1 + 1], ye[r0:r1 + 1])
+    mx, my = transform(gx.ravel(), gy.ravel(), LV95, WEB_MERCATOR)
+    values = np.ma.masked_invalid(np.asarray(values[r0:r1, c0:c1], dtype=np.float64))
+    values[empty[r0:r1, c0:c1]] = np.ma.masked
+    return mx.reshape(gx.shape), my.reshape(gy.shape), values
+
+
+def render(job, x, y, cache=None, boundary=None):
+    """Draw one plot job from EPSG:3857 arrays; returns (out_path, timings in s)."""
+    import contextily as ctx
+    plt = _pyplot()
+    timings = {}
+    t0 = time.perf_counter()
     fig, ax = plt.subplots(figsize=(8, 8))
-    if args.kind == "scatter":
-        ax.scatter(gdf3857.geometry.x, gdf3857.geometry.y,
-                   s=args.s, alpha=args.alpha)
+    if job["kind"] == "scatter":
+        ax.scatter(x, y, s=job["s"], alpha=job["alpha"])
+    elif job["kind"] == "density":
+        x, y, values = density_mesh(job["density"], job["value"], job["gridsize"])
+        mesh = ax.pcolormesh(x, y, values, alpha=job["alpha"], shading="flat")
+        fig.colorbar(mesh, ax=ax, shrink=0.6,
+                     label="solar per building" if job["value"] == "ratio"
+                     else f"{job['value']} count")
     else:
-        hb = ax.hexbin(gdf3857.geometry.x, gdf3857.geometry.y,
-                       gridsize=args.gridsize)
-        hb.set_alpha(args.alpha)  # default colors
+        hb = ax.hexbin(x, y, gridsize=job["gridsize"])
+        hb.set_alpha(job["alpha"])  # default colors
 
     # limits + padding
-    x_min, x_max = gdf3857.geometry.x.min(), gdf3857.geometry.x.max()
-    y_min, y_max = gdf3857.geometry.y.min(), gdf3857.geometry.y.max()
-    pad_x = (x_max - x_min) * 0.02
-    pad_y = (y_max - y_min) * 0.02
-    ax.set_xlim(x_min - pad_x, x_max + pad_x)
-    ax.set_ylim(y_min - pad_y, y_max + pad_y)
+    w, s, e, n = plot_bounds(x, y)
+    ax.set_xlim(w, e)
+    ax.set_ylim(s, n)
+    timings["draw"] = time.perf_counter() - t0
 
     # satellite basemap
-    ctx.add_basemap(ax, source=ctx.providers.Esri.WorldImagery,
-                    crs=gdf3857.crs.to_string())
+    t0 = time.perf_counter()
+    try:
+        add_basemap(ax, ctx.providers.Esri.WorldImagery, cache)
+    except Exception as e:
+        print(f"[WARN] Could not load basemap: {e}", file=sys.stderr)
+    timings["basemap"] = time.perf_counter() - t0
 
     # attempt to plot Bern canton boundary
+    t0 = time.perf_counter()
     try:
-        canton_gdf = load_canton_boundary("BE")
-        canton_gdf.plot(ax=ax, facecolor="none",
-                        edgecolor="red", linewidth=2, zorder=10)
+        if boundary is None:
+            boundary = load_canton_boundary("BE", cache)
+        boundary.plot(ax=ax, facecolor="none",
+                      edgecolor="red", linewidth=2, zorder=10)
     except Exception as e:
         print(f"[WARN] Could not load canton boundary: {e}", file=sys.stderr)
+    timings["boundary"] = time.perf_counter() - t0
 
     ax.set_aspect("equal", adjustable="box")
-    ax.set_xlabel(f"{x_col} (LV95, m)")
-    ax.set_ylabel(f"{y_col} (LV95, m)")
+    ax.set_xlabel(f"{job['x']} (LV95, m)")
+    ax.set_ylabel(f"{job['y']} (LV95, m)")
     ax.set_title(
         "Buildings in Canton Bern on Satellite (LV95 -> Web Mercator)")
+    if job["kind"] == "density":
+        ax.set_xlabel("x (EPSG:3857, m)")
+        ax.set_ylabel("y (EPSG:3857, m)")
+        ax.set_title(f"Density ({job['value']}) in Canton Bern on Satellite")
 
+    t0 = time.perf_counter()
     plt.tight_layout()
     os.makedirs("images", exist_ok=True)
-    out_filename = os.path.basename(args.out)
+    out_filename = os.path.basename(job["out"])
     out_path = os.path.join("images", out_filename)
     fig.savefig(out_path, dpi=200)
+    plt.close(fig)
+    timings["save"] = time.perf_counter() - t0
+    return out_path, timings
+
+
+def expand_jobs(spec):
+    """
+    Plot jobs from a batch spec: an object (or list of objects) whose list-valued
+    keys are expanded as a cartesian product, e.g.
+      {"csv": ["a.csv", "b.csv"], "kind": ["scatter", "hexbin"], "gridsize": [80, 120]}
+    Missing "out" names become <csv stem>_<kind>[_g<gridsize>].png
+    (density_<value>_g<gridsize>.png for density jobs).
+    """
+    jobs, seen = [], set()
+    for entry in (spec if isinstance(spec, list) else [spec]):
+        keys = list(entry)
+        values = [v if isinstance(v, list) else [v] for v in entry.values()]
+        for combo in itertools.product(*values):
+            job = {**PLOT_DEFAULTS, **dict(zip(keys, combo))}
+            if "out" not in entry:
+                if job["kind"] == "density":
+                    stem = f"density_{job['value']}"
+                else:
+                    stem = os.path.splitext(os.path.basename(job["csv"]))[0]
+                    stem += f"_{job['kind']}"
+                suffix = f"_g{job['gridsize']}" if job["kind"] != "scatter" else ""
+                job["out"] = f"{stem}{suffix}.png"
+            if job["out"] not in seen:  # e.g. scatter does not vary with gridsize
+                seen.add(job["out"])
+                jobs.append(job)
+    return jobs
+
+
+# per-worker state, set by _init_worker
+_WORKER = {}
+
+
+def _init_worker(cache_opts, boundary, points):
+    _WORKER["cache"] = GeoCache(**cache_opts) if cache_opts else None
+    _WORKER["boundary"] = boundary
+    _WORKER["points"] = points
+
+
+def _render_job(job):
+    x = y = None
+    if job["kind"] != "density":
+        x, y = _WORKER["points"][(job["csv"], job["x"], job["y"], job["sample"])]
+    t0 = time.perf_counter()
+    out_path, timings = render(job, x, y, _WORKER["cache"], _WORKER["boundary"])
+    timings["total"] = time.perf_counter() - t0
+    return out_path, timings
+
+
+def run_batch(jobs, cache_opts, procs):
+    """Project every distinct CSV once, then render all jobs in a process pool."""
+    import contextily as ctx
+    cache = GeoCache(**cache_opts) if cache_opts else None
+    t_start = time.perf_counter()
+    points = {}
+    extents = []
+    for job in jobs:
+        if job["kind"] == "density":
+            x, y, _ = density_mesh(job["density"], job["value"], job["gridsize"])
+            extents.append(plot_bounds(x, y))
+            continue
+        job["x"], job["y"] = resolve_xy(job["csv"], job["x"], job["y"])
+        key = (job["csv"], job["x"], job["y"], job["sample"])
+        if key not in points:
+            t0 = time.perf_counter()
+            points[key] = load_points(*key)
+            print(f"[INFO] Projected {len(points[key][0])} points of {job['csv']} "
+                  f"in {time.perf_counter() - t0:.2f}s")
+
+    # fetch shared layers once here, so workers only read them
+    boundary = None
+    try:
+        boundary = load_canton_boundary("BE", cache)
+    except Exception as e:
+        print(f"[WARN] Could not load canton boundary: {e}", file=sys.stderr)
+    if cache is not None:
+        extents += [plot_bounds(x, y) for x, y in points.values()]
+        for bounds in dict.fromkeys(extents):
+            try:
+                basemap_image(bounds, ctx.providers.Esri.WorldImagery, cache)
+            except Exception as e:
+                print(f"[WARN] Could not prefetch basemap: {e}", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=procs, initializer=_init_worker,
+                             initargs=(cache_opts, boundary, points)) as pool:
+        for job, (out_path, t) in zip(jobs, pool.map(_render_job, jobs)):
+            print(f"[OK] Saved {out_path}: total {t['total']:.2f}s (draw {t['draw']:.2f}s, "
+                  f"basemap {t['basemap']:.2f}s, boundary {t['boundary']:.2f}s, "
+                  f"save {t['save']:.2f}s)")
+    print(f"[INFO] {len(jobs)} plots in {time.perf_counter() - t_start:.1f}s "
+          f"with {procs} processes")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", default="",
+                    help="Input CSV with LV95 coordinates")
+    ap.add_argument("--jobs", default="",
+                    help="Batch spec JSON (see expand_jobs); renders many plots in a process pool")
+    ap.add_argument("--procs", type=int, default=os.cpu_count(),
+                    help="Rendering processes for --jobs (default: all cores)")
+    ap.add_argument("--x", default="", help="X column (LV95 eastings)")
+    ap.add_argument("--y", default="", help="Y column (LV95 northings)")
+    ap.add_argument("--out", default="plot.png",
+                    help="Output PNG path (saved under images/)")
+    ap.add_argument(
+        "--kind", choices=["scatter", "hexbin", "density"], default="hexbin",
+        help="Plot type (density: pre-aggregated grid from density.py, no --csv needed)")
+    ap.add_argument("--sample", type=int, default=0,
+                    help="Plot only first N rows (0 = all)")
+    ap.add_argument("--s", type=float, default=1.0,
+                    help="Marker size for scatter")
+    ap.add_argument("--alpha", type=float, default=0.5,
+                    help="Alpha for points/hexes")
+    ap.add_argument("--gridsize", type=int, default=100,
+                    help="Hexbin gridsize / density cells across (higher = finer)")
+    ap.add_argument("--density-dir", default=DENSITY_DIR,
+                    help=f"Pyramid built by density.py (default: {DENSITY_DIR})")
+    ap.add_argument("--value", choices=VALUES, default="ratio",
+                    help="Density value: total, solar or ratio (solar per building)")
+    ap.add_argument("--offline", action="store_true",
+                    help="Render basemap/boundary only from the local cache (no network)")
+    ap.add_argument("--cache-dir", default=CACHE_DIR,
+                    help=f"Cache for boundary GeoJSON and basemap tiles (default: {CACHE_DIR})")
+    ap.add_argument("--cache-ttl-h", type=float, default=TTL_S / 3600,
+                    help="Refetch cached layers older than this many hours (0 = never)")
+    ap.add_argument("--cache-max-mb", type=float, default=MAX_BYTES / 1e6,
+                    help="Evict least recently used cache files above this size")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="Always fetch layers from the network")
+    args = ap.parse_args()
+
+    if not args.csv and not args.jobs and args.kind != "density":
+        ap.error("one of --csv or --jobs is required")
+
+    cache_opts = None
+    if not args.no_cache:
+        cache_opts = {"root": args.cache_dir, "ttl": args.cache_ttl_h * 3600,
+                      "max_bytes": args.cache_max_mb * 1e6, "offline": args.offline}
+
+    if args.jobs:
+        with open(args.jobs, encoding="utf-8") as f:
+            jobs = expand_jobs(json.load(f))
+        try:
+            run_batch(jobs, cache_opts, args.procs)
+        except ValueError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    job = {"csv": args.csv, "x": args.x, "y": args.y, "out": args.out, "kind": args.kind,
+           "sample": args.sample, "s": args.s, "alpha": args.alpha,
+           "gridsize": args.gridsize, "density": args.density_dir, "value": args.value}
+    cache = GeoCache(**cache_opts) if cache_opts else None
+    if args.kind == "density":
+        if not os.path.exists(os.path.join(args.density_dir, "pyramid.json")):
+            print(f"[ERROR] No density pyramid in {args.density_dir}; "
+                  f"build it with: python density.py", file=sys.stderr)
+            sys.exit(1)
+        out_path, _ = render(job, None, None, cache)
+        print(f"[OK] Saved {out_path}")
+        return
+
+    # dataset header
+    try:
+        x_col, y_col = resolve_xy(args.csv, args.x, args.y)
+    except ValueError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        print("Pass them explicitly, e.g.: --x _x --y _y", file=sys.stderr)
+        sys.exit(1)
+
+    # only coordinates, LV95 -> 3857 for web basemap
+    x, y = load_points(args.csv, x_col, y_col, args.sample)
+    job["x"], job["y"] = x_col, y_col
+    out_path, _ = render(job, x, y, cache)
     print(f"[OK] Saved {out_path}")
 
 
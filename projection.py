@@ -0,0 +1,26 @@
+"""
+Shared LV95 (EPSG:2056) reprojection on plain NumPy arrays.
+- One cached pyproj Transformer per (source, target) pair per process
+- No shapely/GeoDataFrame objects: transform() works on whole coordinate arrays
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+LV95 = 2056
+WGS84 = 4326
+WEB_MERCATOR = 3857
+
+
+@lru_cache(maxsize=None)
+def get_transformer(src=LV95, dst=WEB_MERCATOR):
+    from pyproj import Transformer
+    return Transformer.from_crs(src, dst, always_xy=True)
+
+
+def transform(xs, ys, src=LV95, dst=WEB_MERCATOR):
+    """Vectorized (xs, ys) -> (xs', ys') as float64 arrays."""
+    tx, ty = get_transformer(src, dst).transform(np.asarray(xs, dtype=np.float64),
+                                                 np.asarray(ys, dtype=np.float64))
+    return np.asarray(tx), np.asarray(ty)
@@ -1,29 +1,197 @@
 #!/usr/bin/env python3
-import pandas as pd
+"""
+Spatially aware negative sampler with block-based train/val/test splits.
+- Streams buildings_BE.csv in chunks (datacache.py); memory is bounded by the
+  chunk size plus the sample
+- Buildings within --exclude-m of a solar installation are never sampled
+  (GridIndex from spatial.py over BernSolarPanelBuildings.csv)
+- Stratified by grid cell (--strata cell) or municipality (--strata municipality),
+  proportional to the eligible buildings per stratum
+- Each --block-m block is assigned as a whole to train, val or test, so
+  neighbouring chips never leak across splits; --positives applies the same
+  blocks to the solar building file
+- export_chips.py links the chips of both files into per-split directories
+  (<dir>/train, <dir>/val, <dir>/test), which data.yaml trains on
+
+Example:
+  python sample.py --n 24000 --exclude-m 50 --strata cell --positives dataset/buildings_BE_matches_xy.csv
+Dep: pip install numpy pandas (pyarrow for the Parquet cache)
+"""
+
+import argparse
 import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from datacache import csv_columns, iter_csv, load_csv
+from spatial import GridIndex
 
 INPUT_FILE = "dataset/buildings_BE.csv"
+SOLAR_FILE = "dataset/BernSolarPanelBuildings.csv"
 OUTPUT_FILE = "dataset/building_sample_BE.csv"
 N_SAMPLES = 24000
 
+EXCLUDE_M = 50.0  # no negatives this close to a solar installation
+CELL_M = 5000.0  # strata cells for --strata cell
+BLOCK_M = 2000.0  # split blocks
+SPLITS = ("train", "val", "test")
+FRACTIONS = (0.8, 0.1, 0.1)
+MUNICIPALITY_COL = "GGDENR"  # BFS municipality number in the building register
+CHUNK_ROWS = 200_000
+
+
+def _mix(a):
+    """splitmix64 finaliser: uint64 -> well-spread uint64."""
+    a = (a ^ (a >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    a = (a ^ (a >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return a ^ (a >> np.uint64(31))
+
+
+def block_split(xs, ys, block_m=BLOCK_M, fractions=FRACTIONS, seed=42):
+    """Split name per point; all points of a block_m x block_m block share it."""
+    bx = np.floor(np.asarray(xs, dtype=np.float64) / block_m).astype(np.int64)
+    by = np.floor(np.asarray(ys, dtype=np.float64) / block_m).astype(np.int64)
+    with np.errstate(over="ignore"):
+        h = _mix(bx.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+                 ^ _mix(by.astype(np.uint64) + np.uint64(seed)))
+    u = (h >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+    edges = np.cumsum(fractions) / np.sum(fractions)
+    return np.asarray(SPLITS)[np.minimum(np.searchsorted(edges, u, side="right"), len(SPLITS) - 1)]
+
+
+def strata_keys(chunk, strata, cell_m=CELL_M, municipality_col=MUNICIPALITY_COL):
+    """Stratum label per row of a chunk."""
+    if strata == "municipality":
+        return chunk[municipality_col].astype(str).to_numpy()
+    cx = np.floor(chunk["GKODE"].to_numpy(dtype=np.float64) / cell_m).astype(np.int64)
+    cy = np.floor(chunk["GKODN"].to_numpy(dtype=np.float64) / cell_m).astype(np.int64)
+    return np.char.add(np.char.add(cx.astype(str), "_"), cy.astype(str))
+
+
+def eligible_chunks(input_file, solar, exclude_m, columns=None, chunk_rows=CHUNK_ROWS):
+    """Yield chunks of buildings with coordinates and no solar installation within exclude_m."""
+    for chunk in iter_csv(input_file, columns, chunk_rows):
+        chunk = chunk.dropna(subset=["GKODE", "GKODN"])
+        if solar is not None and exclude_m > 0 and len(chunk):
+            near = solar.any_within(chunk["GKODE"].to_numpy(dtype=np.float64),
+                                    chunk["GKODN"].to_numpy(dtype=np.float64), exclude_m)
+            chunk = chunk[~near]
+        yield chunk
+
+
+def allocate(counts, n):
+    """Proportional integer quota per stratum (largest remainder), capped by its count."""
+    labels = np.array(list(counts))
+    c = np.array([counts[k] for k in labels], dtype=np.float64)
+    if not len(c) or n >= c.sum():
+        return {k: int(v) for k, v in zip(labels, c)}
+    exact = c * n / c.sum()
+    quota = np.floor(exact).astype(np.int64)
+    rest = n - quota.sum()
+    quota[np.argsort(quota - exact, kind="stable")[:rest]] += 1
+    return {k: int(q) for k, q in zip(labels, np.minimum(quota, c))}
+
+
+def sample(input_file, solar_file, n=N_SAMPLES, exclude_m=EXCLUDE_M, strata="cell",
+           cell_m=CELL_M, municipality_col=MUNICIPALITY_COL, seed=42,
+           chunk_rows=CHUNK_ROWS):
+    """
+    Stratified sample of n eligible buildings (all columns) in two streaming passes:
+    count per stratum, then keep each row with a random key under its stratum's
+    threshold and trim to the quota. Returns (sample, eligible per stratum, quota).
+    """
+    solar = None
+    if solar_file and exclude_m > 0:
+        pts = load_csv(solar_file, columns=["_x", "_y"]).dropna()
+        solar = GridIndex(pts["_x"].to_numpy(dtype=np.float64),
+                          pts["_y"].to_numpy(dtype=np.float64), cell=max(exclude_m, 1.0))
+
+    key_cols = ["GKODE", "GKODN"] + ([municipality_col] if strata == "municipality" else [])
+    counts = {}
+    for chunk in eligible_chunks(input_file, solar, exclude_m, key_cols, chunk_rows):
+        keys, c = np.unique(strata_keys(chunk, strata, cell_m, municipality_col),
+                            return_counts=True)
+        for k, v in zip(keys.tolist(), c.tolist()):
+            counts[k] = counts.get(k, 0) + v
+    quota = allocate(counts, n)
+
+    # oversample by ~4 binomial standard deviations so shortfalls are rare, then trim
+    rate = {k: min(1.0, (q + 4 * np.sqrt(q) + 10) / counts[k]) for k, q in quota.items() if q}
+    rng = np.random.default_rng(seed)
+    picked = []
+    for chunk in eligible_chunks(input_file, solar, exclude_m, None, chunk_rows):
+        keys = strata_keys(chunk, strata, cell_m, municipality_col)
+        u = rng.random(len(chunk))
+        thresh = np.array([rate.get(k, 0.0) for k in keys.tolist()])
+        keep = u < thresh
+        if keep.any():
+            part = chunk[keep].copy()
+            part["_stratum"] = keys[keep]
+            part["_u"] = u[keep] / thresh[keep]
+            picked.append(part)
+    if not picked:
+        return pd.DataFrame(columns=csv_columns(input_file)), counts, quota
+    df = pd.concat(picked, ignore_index=True).sort_values("_u", kind="stable")
+    df = df[df.groupby("_stratum").cumcount() < df["_stratum"].map(quota)]
+    return df.drop(columns=["_stratum", "_u"]).sort_index(), counts, quota
+
+
 def main():
-    if not os.path.exists(INPUT_FILE):
-        print(f"[ERROR] File not found: {INPUT_FILE}")
+    ap = argparse.ArgumentParser(description="Sample negative buildings with spatial splits")
+    ap.add_argument("--input", default=INPUT_FILE)
+    ap.add_argument("--solar", default=SOLAR_FILE,
+                    help="Solar installations (_x/_y) to keep negatives away from")
+    ap.add_argument("--out", default=OUTPUT_FILE)
+    ap.add_argument("--n", type=int, default=N_SAMPLES, help=f"Sample size (default: {N_SAMPLES})")
+    ap.add_argument("--exclude-m", type=float, default=EXCLUDE_M,
+                    help=f"Min distance to any solar installation (default: {EXCLUDE_M})")
+    ap.add_argument("--strata", choices=["cell", "municipality", "none"], default="cell")
+    ap.add_argument("--cell-m", type=float, default=CELL_M,
+                    help=f"Strata cell size for --strata cell (default: {CELL_M})")
+    ap.add_argument("--municipality-col", default=MUNICIPALITY_COL)
+    ap.add_argument("--block-m", type=float, default=BLOCK_M,
+                    help=f"Split block size (default: {BLOCK_M})")
+    ap.add_argument("--fractions", default=",".join(map(str, FRACTIONS)),
+                    help="train,val,test fractions of blocks (default: 0.8,0.1,0.1)")
+    ap.add_argument("--positives", default="",
+                    help="Also write <name>_split.csv for this GKODE/GKODN file with the same blocks")
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"[ERROR] File not found: {args.input}")
         return
+    fractions = tuple(float(f) for f in args.fractions.split(","))
+    if len(fractions) != len(SPLITS):
+        ap.error("--fractions needs three values")
+    strata = "cell" if args.strata == "none" else args.strata
+    cell_m = float("inf") if args.strata == "none" else args.cell_m
 
-    # load dataset
-    df = pd.read_csv(INPUT_FILE)
+    t0 = time.perf_counter()
+    df, counts, quota = sample(args.input, args.solar if os.path.exists(args.solar) else "",
+                               args.n, args.exclude_m, strata, cell_m,
+                               args.municipality_col, args.seed)
+    eligible = sum(counts.values())
+    if eligible < args.n:
+        print(f"[WARN] Only {eligible} eligible buildings, saving all.")
+    df["split"] = block_split(df["GKODE"], df["GKODN"], args.block_m, fractions, args.seed)
+    df.to_csv(args.out, index=False, encoding="utf-8")
+    sizes = df["split"].value_counts()
+    print(f"[OK] Saved {len(df)} samples to {args.out} in {time.perf_counter() - t0:.1f}s "
+          f"({eligible} eligible, {len(quota)} strata; "
+          + ", ".join(f"{s} {sizes.get(s, 0)}" for s in SPLITS) + ")")
 
-    # random sample
-    if len(df) < N_SAMPLES:
-        print(f"[WARN] Dataset has only {len(df)} rows, saving all.")
-        df_sample = df
-    else:
-        df_sample = df.sample(n=N_SAMPLES, random_state=42)
+    if args.positives:
+        pos = load_csv(args.positives)
+        pos["split"] = block_split(pos["GKODE"], pos["GKODN"], args.block_m, fractions, args.seed)
+        out = os.path.splitext(args.positives)[0] + "_split.csv"
+        pos.to_csv(out, index=False, encoding="utf-8")
+        sizes = pos["split"].value_counts()
+        print(f"[OK] Saved {len(pos)} positives to {out} ("
+              + ", ".join(f"{s} {sizes.get(s, 0)}" for s in SPLITS) + ")")
 
-    # save sample
-    df_sample.to_csv(OUTPUT_FILE, index=False, encoding="utf-8")
-    print(f"[OK] Saved {len(df_sample)} samples to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Wall-to-wall solar panel detection over an LV95 extent, independent of the building register.
+- The extent (--bbox, --municipality or --canton, the latter two from the
+  buildings in buildings_BE.csv) is tiled into overlapping --size px windows
+  at the training resolution (0.075 m/px, as orto-256.py)
+- Windows are fetched as shared WMS blocks (--block-px) and cut locally;
+  blank windows (outside coverage) are skipped
+- Windows are streamed through the detector in batches; at most a few blocks
+  per worker are held in memory, whatever the extent
+- Boxes are converted to LV95 and merged across window borders with greedy
+  NMS on a spatial grid (--match ios also merges a box cut by a window edge
+  into the full box of the neighbouring window)
+- --procs splits the block rows across processes, each with its own model and
+  torch threads, so coverage per hour grows with the cores
+- Detectors: ultralytics detect weights (boxes) or a TorchScript/ultralytics
+  classifier, whose positive windows become window-sized boxes
+
+Example:
+  python scan.py --weights runs/detect/train/weights/best.pt --municipality 351 --procs 4 --out scan_351.csv
+  python scan.py --weights model.torchscript --bbox 2600000,1199000,2601000,1200000 --wms-url http://127.0.0.1:8089/
+Dep: pip install numpy pandas pillow torch requests (ultralytics for YOLO weights)
+"""
+
+import argparse
+import io
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+
+from datacache import iter_csv
+from infer import POSITIVE_CLASS, load_model
+from phash import blank_reason
+from wms import LAYER, WMS_URL, RateLimiter, bounded_map, fetch_getmap, getmap_params, make_session
+
+CSV_PATH = "dataset/buildings_BE.csv"
+OUT_PATH = "scan_detections.csv"
+SIZE = 256
+M_PER_PX = 0.075  # training resolution of the 256px chips
+OVERLAP = 32  # px shared by neighbouring windows
+BLOCK_PX = 2048
+BATCH = 32
+CONF = 0.25
+MATCH_THRESHOLD = 0.5
+MARGIN_M = 50.0  # around the buildings of a municipality/canton
+MUNICIPALITY_COL = "GGDENR"
+
+
+def parse_bbox(text):
+    minx, miny, maxx, maxy = (float(v) for v in text.split(","))
+    if maxx <= minx or maxy <= miny:
+        raise ValueError(f"empty bbox {text}")
+    return minx, miny, maxx, maxy
+
+
+def extent_from_buildings(csv_path, municipality=None, margin=MARGIN_M,
+                          municipality_col=MUNICIPALITY_COL):
+    """Bbox of the register's buildings (of one municipality if given), plus margin."""
+    cols = ["GKODE", "GKODN"] + ([municipality_col] if municipality is not None else [])
+    lo, hi = np.array([np.inf, np.inf]), np.array([-np.inf, -np.inf])
+    for chunk in iter_csv(csv_path, cols):
+        if municipality is not None:
+            chunk = chunk[chunk[municipality_col].astype(str) == str(municipality)]
+        xy = chunk[["GKODE", "GKODN"]].dropna().to_numpy(dtype=np.float64)
+        if len(xy):
+            lo = np.minimum(lo, xy.min(0))
+            hi = np.maximum(hi, xy.max(0))
+    if not np.isfinite(lo).all():
+        raise ValueError(f"no buildings for municipality {municipality} in {csv_path}")
+    return (float(lo[0] - margin), float(lo[1] - margin),
+            float(hi[0] + margin), float(hi[1] + margin))
+
+
+class WindowGrid:
+    """
+    Overlapping size x size px windows covering bbox, grouped into blocks of
+    per_block x per_block windows that are fetched with one GetMap each.
+    """
+
+    def __init__(self, bbox, size=SIZE, m_per_px=M_PER_PX, overlap=OVERLAP, block_px=BLOCK_PX):
+        if not 0 <= overlap < size:
+            raise ValueError("overlap must be in [0, size)")
+        self.minx, self.miny, self.maxx, self.maxy = bbox
+        self.size, self.m_per_px = size, m_per_px
+        self.stride = size - overlap  # px
+        span_x = (self.maxx - self.minx) / m_per_px
+        span_y = (self.maxy - self.miny) / m_per_px
+        self.nx = max(1, math.ceil((span_x - size) / self.stride) + 1)
+        self.ny = max(1, math.ceil((span_y - size) / self.stride) + 1)
+        self.per_block = max(1, (block_px - size) // self.stride + 1)
+        self.bx = math.ceil(self.nx / self.per_block)
+        self.by = math.ceil(self.ny / self.per_block)
+
+    def __len__(self):
+        return self.nx * self.ny
+
+    def blocks(self, part=0, parts=1):
+        """Yield (bi, bj) block indices row by row; block rows are dealt round-robin to parts."""
+        for bj in range(part, self.by, parts):
+            for bi in range(self.bx):
+                yield bi, bj
+
+    def block_geometry(self, block):
+        """(bbox, w_px, h_px, [(i, j, left, top)]) of a block and its windows."""
+        bi, bj = block
+        i0, j0 = bi * self.per_block, bj * self.per_block
+        ni = min(self.per_block, self.nx - i0)
+        nj = min(self.per_block, self.ny - j0)
+        w_px = (ni - 1) * self.stride + self.size
+        h_px = (nj - 1) * self.stride + self.size
+        left = self.minx + i0 * self.stride * self.m_per_px
+        top = self.maxy - j0 * self.stride * self.m_per_px
+        bbox = (left, top - h_px * self.m_per_px, left + w_px * self.m_per_px, top)
+        windows = [(i0 + a, j0 + b, a * self.stride, b * self.stride)
+                   for b in range(nj) for a in range(ni)]
+        return bbox, w_px, h_px, windows
+
+    def window_origin(self, i, j):
+        """LV95 (left, top) of window (i, j)."""
+        return (self.minx + i * self.stride * self.m_per_px,
+                self.maxy - j * self.stride * self.m_per_px)
+
+
+def load_detector(weights, imgsz=SIZE, conf=CONF):
+    """
+    fn(images float NCHW in [0, 1]) -> [(N, 5) arrays of x1, y1, x2, y2, score in px].
+    Detection weights return their boxes; classifiers (TorchScript or ultralytics
+    classify) return the whole window when its solar score reaches conf.
+    """
+    if not weights.endswith((".torchscript", ".ts", ".jit")):
+        from ultralytics import YOLO
+        model = YOLO(weights)
+        if model.task == "detect":
+            def detect(x):
+                out = []
+                for r in model.predict(x, imgsz=imgsz, conf=conf, device="cpu", verbose=False):
+                    keep = (r.boxes.cls == POSITIVE_CLASS).numpy()
+                    out.append(np.column_stack([r.boxes.xyxy.numpy()[keep],
+                                                r.boxes.conf.numpy()[keep]]))
+                return out
+            return detect
+
+    score = load_model(weights, imgsz)
+    full = np.array([0.0, 0.0, float(imgsz), float(imgsz)])
+
+    def classify(x):
+        s = score(x).float().numpy()
+        return [np.array([[*full, v]]) if v >= conf else np.empty((0, 5)) for v in s]
+    return classify
+
+
+def merge_detections(boxes, threshold=MATCH_THRESHOLD, metric="ios"):
+    """
+    Greedy NMS over LV95 boxes (N, 5: minx, miny, maxx, maxy, score), highest
+    score first. A box is dropped when it overlaps a kept one by more than
+    threshold (IoU, or intersection over the smaller box for "ios"). Candidates
+    come from a grid of the largest box size, so the cost grows with N, not N^2.
+    """
+    if not len(boxes):
+        return boxes
+    boxes = boxes[np.argsort(-boxes[:, 4], kind="stable")]
+    cell = float(max((boxes[:, 2] - boxes[:, 0]).max(), (boxes[:, 3] - boxes[:, 1]).max(), 1e-6))
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    cx = np.floor((boxes[:, 0] + boxes[:, 2]) / 2 / cell).astype(np.int64)
+    cy = np.floor((boxes[:, 1] + boxes[:, 3]) / 2 / cell).astype(np.int64)
+    grid = {}
+    keep = []
+    for k in range(len(boxes)):
+        cand = [c for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                for c in grid.get((cx[k] + dx, cy[k] + dy), ())]
+        if cand:
+            c = np.asarray(cand)
+            iw = np.minimum(boxes[c, 2], boxes[k, 2]) - np.maximum(boxes[c, 0], boxes[k, 0])
+            ih = np.minimum(boxes[c, 3], boxes[k, 3]) - np.maximum(boxes[c, 1], boxes[k, 1])
+            inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+            if metric == "ios":
+                overlap = inter / np.maximum(np.minimum(area[c], area[k]), 1e-12)
+            else:
+                overlap = inter / np.maximum(area[c] + area[k] - inter, 1e-12)
+            if (overlap > threshold).any():
+                continue
+        keep.append(k)
+        grid.setdefault((cx[k], cy[k]), []).append(k)
+    return boxes[keep]
+
+
+_WORKER = {}
+
+
+def _init_worker(weights, imgsz, conf, threads):
+    torch.set_num_threads(threads)
+    _WORKER["detect"] = load_detector(weights, imgsz, conf)
+
+
+def scan_part(grid, part, parts, opts, detect=None):
+    """
+    Detect over the blocks of one part; returns (raw LV95 boxes (N, 5), stats).
+    Blocks are fetched concurrently, at most opts["workers"] + 2 decoded at a time.
+    """
+    detect = detect or _WORKER["detect"]
+    session = make_session(opts["workers"])
+    limiter = RateLimiter(opts["rps"])
+    m = grid.m_per_px
+    stats = {"blocks": 0, "failed": 0, "windows": 0, "blank": 0, "model_s": 0.0}
+    found = []
+    batch, origins = [], []
+
+    def fetch(block):
+        bbox, w_px, h_px, windows = grid.block_geometry(block)
+        png = fetch_getmap(session, getmap_params(bbox, w_px, h_px, opts["layer"]),
+                           url=opts["url"], limiter=limiter, retries=opts["retries"],
+                           timeout=120)
+        with Image.open(io.BytesIO(png)) as im:
+            img = np.asarray(im.convert("RGB"))
+        if img.shape[:2] != (h_px, w_px):
+            raise ValueError(f"block returned {img.shape[1]}x{img.shape[0]}, expected {w_px}x{h_px}")
+        return img, windows
+
+    def flush():
+        t0 = time.perf_counter()
+        with torch.inference_mode():
+            x = torch.from_numpy(np.stack(batch)).permute(0, 3, 1, 2).float().div_(255)
+            for (left, top), det in zip(origins, detect(x)):
+                if len(det):
+                    # px (y down) -> LV95 (y up)
+                    found.append(np.column_stack([left + det[:, 0] * m, top - det[:, 3] * m,
+                                                  left + det[:, 2] * m, top - det[:, 1] * m,
+                                                  det[:, 4]]))
+        stats["model_s"] += time.perf_counter() - t0
+        batch.clear()
+        origins.clear()
+
+    try:
+        for block, res, err in bounded_map(fetch, grid.blocks(part, parts), opts["workers"],
+                                           opts["workers"] + 2):
+            if err is not None:
+                stats["failed"] += 1
+                print(f"[WARN] Block {block} failed: {err}")
+                continue
+            stats["blocks"] += 1
+            img, windows = res
+            s = grid.size
+            for i, j, left, top in windows:
+                win = img[top:top + s, left:left + s]
+                if opts["skip_blank"] and blank_reason(win.mean(axis=2).astype(np.uint8)):
+                    stats["blank"] += 1
+                    continue
+                batch.append(win)
+                origins.append(grid.window_origin(i, j))
+                stats["windows"] += 1
+                if len(batch) == opts["batch"]:
+                    flush()
+        if batch:
+            flush()
+    finally:
+        session.close()
+    boxes = np.concatenate(found) if found else np.empty((0, 5))
+    return boxes, stats
+
+
+def _scan_part(args):
+    return scan_part(*args)
+
+
+def run_scan(grid, weights, opts, procs=1, threads=None, conf=CONF):
+    """Scan the whole grid with procs processes; returns (raw boxes, summed stats)."""
+    threads = threads or max(1, (os.cpu_count() or 1) // procs)
+    if procs <= 1:
+        torch.set_num_threads(threads)
+        return scan_part(grid, 0, 1, opts, load_detector(weights, grid.size, conf))
+    found, total = [], {}
+    with ProcessPoolExecutor(procs, initializer=_init_worker,
+                             initargs=(weights, grid.size, conf, threads)) as pool:
+        for boxes, stats in pool.map(_scan_part, [(grid, p, procs, opts) for p in range(procs)]):
+            found.append(boxes)
+            for k, v in stats.items():
+                total[k] = total.get(k, 0) + v
+    return np.concatenate(found), total
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Wall-to-wall solar panel detection over an LV95 extent")
+    ap.add_argument("--weights", required=True,
+                    help="ultralytics detect/classify .pt or TorchScript classifier")
+    where = ap.add_mutually_exclusive_group(required=True)
+    where.add_argument("--bbox", help="LV95 minx,miny,maxx,maxy")
+    where.add_argument("--municipality", help=f"{MUNICIPALITY_COL} number (extent of its buildings)")
+    where.add_argument("--canton", action="store_true",
+                       help="Extent of every building in --csv")
+    ap.add_argument("--csv", default=CSV_PATH,
+                    help=f"Building register for --municipality/--canton (default: {CSV_PATH})")
+    ap.add_argument("--out", default=OUT_PATH, help=f"Detections CSV (default: {OUT_PATH})")
+    ap.add_argument("--wms-url", default=WMS_URL,
+                    help="WMS endpoint (e.g. http://127.0.0.1:8089/ for stub_wms.py)")
+    ap.add_argument("--layer", default=LAYER)
+    ap.add_argument("--size", type=int, default=SIZE, help=f"Window size in px (default: {SIZE})")
+    ap.add_argument("--m-per-px", type=float, default=M_PER_PX,
+                    help=f"Resolution, as in training (default: {M_PER_PX})")
+    ap.add_argument("--overlap", type=int, default=OVERLAP,
+                    help=f"Overlap between windows in px (default: {OVERLAP})")
+    ap.add_argument("--block-px", type=int, default=BLOCK_PX,
+                    help=f"GetMap block size in px (default: {BLOCK_PX})")
+    ap.add_argument("--batch", type=int, default=BATCH, help=f"Windows per batch (default: {BATCH})")
+    ap.add_argument("--conf", type=float, default=CONF, help=f"Min score (default: {CONF})")
+    ap.add_argument("--match", choices=["ios", "iou"], default="ios",
+                    help="Overlap measure for merging boxes across windows (default: ios)")
+    ap.add_argument("--threshold", type=float, default=MATCH_THRESHOLD,
+                    help=f"Overlap above which the weaker box is dropped (default: {MATCH_THRESHOLD})")
+    ap.add_argument("--workers", type=int, default=4, help="Concurrent block requests per process")
+    ap.add_argument("--rps", type=float, default=0.0, help="Max requests per second per process")
+    ap.add_argument("--retries", type=int, default=5)
+    ap.add_argument("--procs", type=int, default=1, help="Detector processes (default: 1)")
+    ap.add_argument("--threads", type=int, default=0,
+                    help="torch threads per process (default: cores / procs)")
+    ap.add_argument("--keep-blank", action="store_true", help="Also run blank windows")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        if args.bbox:
+            bbox = parse_bbox(args.bbox)
+        else:
+            bbox = extent_from_buildings(args.csv, args.municipality)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[ERROR] {e}")
+        return
+    grid = WindowGrid(bbox, args.size, args.m_per_px, args.overlap, args.block_px)
+    area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) / 1e6
+    print(f"[INFO] Extent {', '.join(f'{v:.0f}' for v in bbox)} ({area:.2f} km2): "
+          f"{len(grid)} windows in {grid.bx * grid.by} blocks, {args.procs} process(es)")
+
+    opts = {"url": args.wms_url, "layer": args.layer, "workers": args.workers, "rps": args.rps,
+            "retries": args.retries, "batch": args.batch, "skip_blank": not args.keep_blank}
+    raw, stats = run_scan(grid, args.weights, opts, args.procs, args.threads or None, args.conf)
+    boxes = merge_detections(raw, args.threshold, args.match)
+
+    df = pd.DataFrame(boxes, columns=["minx", "miny", "maxx", "maxy", "score"])
+    df.insert(0, "y", (df["miny"] + df["maxy"]) / 2)
+    df.insert(0, "x", (df["minx"] + df["maxx"]) / 2)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    df.to_csv(args.out, index=False, float_format="%.3f")
+    elapsed = time.perf_counter() - t0
+    print(f"[OK] {len(df)} detections ({len(raw)} before merging) saved in {args.out}; "
+          f"{stats['windows']} windows scored, {stats['blank']} blank, "
+          f"{stats['failed']} blocks failed; {elapsed:.1f}s, {area / elapsed * 3600:.1f} km2/h "
+          f"(model {stats['model_s']:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Grid-hash spatial index over LV95 points, pure NumPy.
+- Points are bucketed into square cells and sorted by cell key; lookups are
+  vectorized searchsorted calls over the 3x3 neighbourhood of each query
+- Used for tolerance matching (match.py), exclusion buffers (sample.py)
+  and bbox/nearest queries
+"""
+
+import numpy as np
+
+# cell keys pack (col, row) into one int64; LV95 coordinates stay far below this
+_ROW_SPAN = 1 << 31
+
+
+class GridIndex:
+    """Static index over (xs, ys); cell should be >= the largest query radius."""
+
+    def __init__(self, xs, ys, cell=50.0):
+        self.cell = float(cell)
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        keys = self._keys(xs, ys)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.xs = xs[self.order]
+        self.ys = ys[self.order]
+
+    def __len__(self):
+        return len(self.xs)
+
+    def _cells(self, xs, ys):
+        return (np.floor(xs / self.cell).astype(np.int64),
+                np.floor(ys / self.cell).astype(np.int64))
+
+    def _keys(self, xs, ys):
+        cx, cy = self._cells(xs, ys)
+        return cx * _ROW_SPAN + cy
+
+    def pairs_within(self, qx, qy, radius):
+        """
+        All (query_idx, point_idx, dist) with dist <= radius, as three arrays.
+        point_idx refers to the original order of the indexed points.
+        """
+        if radius > self.cell:
+            raise ValueError(f"radius {radius} exceeds index cell size {self.cell}")
+        qx = np.asarray(qx, dtype=np.float64)
+        qy = np.asarray(qy, dtype=np.float64)
+        cx, cy = self._cells(qx, qy)
+        q_parts, p_parts = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                key = (cx + dx) * _ROW_SPAN + (cy + dy)
+                start = np.searchsorted(self.keys, key, side="left")
+                end = np.searchsorted(self.keys, key, side="right")
+                counts = end - start
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # expand every [start, end) range into explicit candidate pairs
+                q = np.repeat(np.arange(len(qx)), counts)
+                within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                q_parts.append(q)
+                p_parts.append(np.repeat(start, counts) + within)
+        if not q_parts:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        q = np.concatenate(q_parts)
+        p = np.concatenate(p_parts)
+        d = np.hypot(self.xs[p] - qx[q], self.ys[p] - qy[q])
+        keep = d <= radius
+        return q[keep], self.order[p[keep]], d[keep]
+
+    def nearest(self, qx, qy, radius):
+        """(point_idx, dist) of the nearest point within radius per query; -1/inf if none."""
+        n = len(np.asarray(qx))
+        idx = np.full(n, -1, dtype=np.int64)
+        dist = np.full(n, np.inf)
+        q, p, d = self.pairs_within(qx, qy, radius)
+        if len(q):
+            # sort by (query, dist) and keep the first pair of each query
+            o = np.lexsort((d, q))
+            q, p, d = q[o], p[o], d[o]
+            first = np.r_[True, q[1:] != q[:-1]]
+            idx[q[first]] = p[first]
+            dist[q[first]] = d[first]
+        return idx, dist
+
+    def any_within(self, qx, qy, radius):
+        """Boolean mask: does any indexed point lie within radius of each query?"""
+        mask = np.zeros(len(np.asarray(qx)), dtype=bool)
+        q, _, _ = self.pairs_within(qx, qy, radius)
+        mask[q] = True
+        return mask
+
+    def bbox(self, minx, miny, maxx, maxy):
+        """Indices (original order) of points inside the bbox."""
+        c0x, c0y = self._cells(np.array([minx]), np.array([miny]))
+        c1x, c1y = self._cells(np.array([maxx]), np.array([maxy]))
+        hits = []
+        for col in range(int(c0x[0]), int(c1x[0]) + 1):
+            # one contiguous key range per column of cells
+            lo = np.searchsorted(self.keys, col * _ROW_SPAN + int(c0y[0]), side="left")
+            hi = np.searchsorted(self.keys, col * _ROW_SPAN + int(c1y[0]), side="right")
+            hits.append(np.arange(lo, hi))
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        p = np.concatenate(hits)
+        keep = ((self.xs[p] >= minx) & (self.xs[p] <= maxx)
+                & (self.ys[p] >= miny) & (self.ys[p] <= maxy))
+        return self.order[p[keep]]
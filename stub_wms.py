@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the swisstopo WMS, for testing the downloaders offline.
+- Answers GetMap with a deterministic PNG of the requested WIDTH x HEIGHT
+  (pixel colours depend only on LV95 world coordinates, so overlapping
+  bboxes return identical pixels)
+- Honours TIME: every epoch gets its own (equally deterministic) colours
+- Optional artificial latency, 429/503 error rate and rate of blank (white) tiles
+Dep: pip install numpy
+
+Example:
+  python stub_wms.py --port 8089 --latency 0.05 --error-rate 0.05 &
+  python orthophoto.py --wms-url http://127.0.0.1:8089/ --workers 16
+"""
+
+import argparse
+import random
+import struct
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+
+def encode_png(rgb):
+    """Minimal RGB8 PNG encoder (no Pillow needed)."""
+    h, w, _ = rgb.shape
+    raw = np.zeros((h, w * 3 + 1), dtype=np.uint8)  # filter byte 0 per row
+    raw[:, 1:] = rgb.reshape(h, w * 3)
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    ihdr = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr)
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 1)) + chunk(b"IEND", b""))
+
+
+def render(bbox, width, height, epoch=""):
+    """
+    Synthetic orthophoto: colours are a pure function of the pixel-centre LV95
+    coordinates and the requested TIME epoch.
+    """
+    minx, miny, maxx, maxy = bbox
+    px = minx + (np.arange(width) + 0.5) * (maxx - minx) / width
+    py = maxy - (np.arange(height) + 0.5) * (maxy - miny) / height
+    X, Y = np.meshgrid(px, py)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = (np.floor(X * 2) % 256).astype(np.uint8)
+    img[..., 1] = (np.floor(Y * 2) % 256).astype(np.uint8)
+    img[..., 2] = ((np.floor((X + Y) / 4) + zlib.crc32(epoch.encode())) % 256).astype(np.uint8)
+    return img
+
+
+class StubWMSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real service
+    latency = 0.0
+    error_rate = 0.0
+    blank_rate = 0.0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body, ctype="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        q = {k.upper(): v[0] for k, v in parse_qs(urlparse(self.path).query,
+                                                  keep_blank_values=True).items()}
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send(random.choice([429, 503]), b"try again")
+            return
+        if q.get("REQUEST", "").lower() != "getmap":
+            self._send(400, b"only GetMap is supported")
+            return
+        try:
+            bbox = tuple(float(v) for v in q["BBOX"].split(","))
+            width, height = int(q["WIDTH"]), int(q["HEIGHT"])
+        except (KeyError, ValueError) as e:
+            self._send(400, f"bad request: {e}".encode())
+            return
+        if self.blank_rate and random.random() < self.blank_rate:
+            # like areas outside coverage: a valid but uniform image
+            img = np.full((height, width, 3), 255, dtype=np.uint8)
+        else:
+            img = render(bbox, width, height, q.get("TIME", ""))
+        self._send(200, encode_png(img), "image/png")
+
+
+def serve(port=8089, latency=0.0, error_rate=0.0, host="127.0.0.1", blank_rate=0.0):
+    """Create the stub server (caller runs serve_forever, e.g. in a thread)."""
+    handler = type("Handler", (StubWMSHandler,),
+                   {"latency": latency, "error_rate": error_rate, "blank_rate": blank_rate})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stub WMS server")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.0,
+                    help="Seconds of delay per request")
+    ap.add_argument("--error-rate", type=float, default=0.0,
+                    help="Fraction of requests answered with 429/503")
+    ap.add_argument("--blank-rate", type=float, default=0.0,
+                    help="Fraction of GetMap answers that are uniform white images")
+    args = ap.parse_args()
+
+    server = serve(args.port, args.latency, args.error_rate, blank_rate=args.blank_rate)
+    print(f"[OK] Stub WMS on http://127.0.0.1:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
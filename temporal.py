@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Multi-epoch orthophoto acquisition around each installation's BeginningOfOperation.
+- For every solar installation picks the last flight year before the install
+  year ("before") and the first one after it ("after", or the current product)
+- Epochs come from the WMS TIME dimension of --layer (--epoch-mode time) or
+  from one layer per year (--epoch-mode layer, --layer-template)
+- Requests are deduplicated per (epoch, chip): installations on the same
+  building, or sharing a flight year, never fetch a chip twice
+- One directory and manifest per epoch (<out-dir>/<epoch>/), so reruns and
+  newly added installations only fetch epochs not cached yet
+- --store packs before/after chips as a (H, W, 3 * epochs) chip store
+  (chipstore.py) plus temporal.npz with the install and epoch years per chip
+
+Example:
+  python temporal.py --years 2010,2013,2016,2019,2022 --store chips-temporal-256px
+Dep: pip install numpy pandas requests pillow (pyarrow for the Parquet cache)
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from chipstore import ChipStoreWriter, decode_png
+from datacache import load_csv
+from manifest import MANIFEST_NAME, Manifest
+from match import match
+from mosaic import download_mosaic
+from wms import LAYER, add_download_args, csv_jobs, download_options, download_tiles
+
+SOLAR_PATH = "dataset/BernSolarPanelBuildings.csv"
+BUILDINGS_PATH = "dataset/buildings_BE.csv"
+OUT_DIR = "temporal-orthophoto-256px"
+
+WIDTH = HEIGHT = 256
+M_PER_PX = 0.075
+# swissimage flight years to consider; Bern is re-flown about every three years
+YEARS = (2004, 2007, 2010, 2013, 2016, 2019, 2022)
+CURRENT = "current"  # the latest product, requested without TIME
+SLOTS = ("before", "after")
+LAYER_TEMPLATE = LAYER + "_{year}"
+
+
+def install_years(df, col="BeginningOfOperation"):
+    """Install year per row (NaN where missing or unparseable)."""
+    return pd.to_datetime(df[col], errors="coerce").dt.year.astype("float64")
+
+
+def pick_epochs(years, flights=YEARS):
+    """
+    Before/after epoch per install year: the last flight strictly before the
+    install year, and the first flight after it (CURRENT if there is none).
+    Rows without a usable epoch get None.
+    """
+    flights = np.sort(np.asarray(flights))
+    before, after = [], []
+    for y in years:
+        if not np.isfinite(y):
+            before.append(None)
+            after.append(None)
+            continue
+        i = np.searchsorted(flights, y, side="left")  # flights[:i] < y
+        j = np.searchsorted(flights, y, side="right")  # flights[j:] > y
+        before.append(str(flights[i - 1]) if i else None)
+        after.append(str(flights[j]) if j < len(flights) else CURRENT)
+    return before, after
+
+
+def load_installations(solar_path, buildings_path="", tolerance=10.0):
+    """
+    Installations with chip centre (GKODE/GKODN) and install year. With a
+    building register the chip is centred on the matched building, like the
+    positive chips; otherwise on the installation point.
+    """
+    solar = load_csv(solar_path, columns=["_x", "_y", "BeginningOfOperation"])
+    solar["year"] = install_years(solar)
+    if buildings_path and os.path.exists(buildings_path):
+        pts, bx, by, dist, _ = match(buildings_path, solar_path, tolerance)
+        ok = np.isfinite(dist)
+        out = pd.DataFrame({"GKODE": bx[ok], "GKODN": by[ok]}, index=pts.index[ok])
+        out["year"] = solar.loc[out.index, "year"]
+    else:
+        solar = solar.dropna(subset=["_x", "_y"])
+        out = pd.DataFrame({"GKODE": solar["_x"], "GKODN": solar["_y"], "year": solar["year"]})
+    return out.reset_index(drop=True)
+
+
+def epoch_jobs(inst, out_dir):
+    """{epoch: deduplicated (x, y, out_file) jobs} over the before/after slots."""
+    jobs = {}
+    for slot in SLOTS:
+        for epoch, group in inst.dropna(subset=[slot]).groupby(slot):
+            jobs.setdefault(epoch, []).extend(csv_jobs(group, os.path.join(out_dir, epoch)))
+    # ortho_{x}_{y}.png names chips, so the same name is the same request
+    return {e: list({j[2]: j for j in js}.values()) for e, js in sorted(jobs.items())}
+
+
+def epoch_request(epoch, mode, layer=LAYER, template=LAYER_TEMPLATE):
+    """(layer, TIME value) for an epoch."""
+    if epoch == CURRENT:
+        return layer, None
+    if mode == "layer":
+        return template.format(year=epoch), None
+    return layer, epoch
+
+
+def chip_path(out_dir, epoch, x, y):
+    return os.path.join(out_dir, epoch, f"ortho_{int(x)}_{int(y)}.png")
+
+
+def pack_epochs(inst, out_dir, store_dir, workers=8):
+    """
+    Chip store of every installation with both slots on disk, channels stacked
+    as before RGB + after RGB; temporal.npz holds the years per chip.
+    Returns (chips packed, installations without complete epochs).
+    """
+    inst = inst.dropna(subset=list(SLOTS)).drop_duplicates(["GKODE", "GKODN", *SLOTS])
+    rows = []
+    for r in inst.itertuples(index=False):
+        paths = [chip_path(out_dir, getattr(r, s), r.GKODE, r.GKODN) for s in SLOTS]
+        if all(os.path.isfile(p) for p in paths):
+            rows.append((r, paths))
+    missing = len(inst) - len(rows)
+    if not rows:
+        return 0, missing
+
+    def stack(item):
+        return np.concatenate([decode_png(p) for p in item[1]], axis=2)
+
+    meta = {"epochs": list(SLOTS), "bands": [f"{s}_{c}" for s in SLOTS for c in "rgb"]}
+    writer = ChipStoreWriter(store_dir, HEIGHT, WIDTH, 3 * len(SLOTS), extra_meta=meta)
+    years = {"install": [], **{s: [] for s in SLOTS}}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(rows), 256):
+            chunk = rows[start:start + 256]
+            for (r, _), chip in zip(chunk, pool.map(stack, chunk)):
+                writer.add(chip, r.GKODE, r.GKODN, label=1)
+                years["install"].append(r.year)
+                for s in SLOTS:
+                    e = getattr(r, s)
+                    years[s].append(-1 if e == CURRENT else int(e))
+    writer.close()
+    # -1 marks the current product, whose flight year the WMS does not expose
+    np.savez(os.path.join(store_dir, "temporal.npz"),
+             install=np.asarray(years["install"], dtype=np.int16),
+             **{s: np.asarray(v, dtype=np.int16) for s, v in years.items() if s != "install"})
+    return len(rows), missing
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Download before/after orthophotos per installation")
+    add_download_args(ap, SOLAR_PATH, OUT_DIR)
+    ap.add_argument("--buildings", default=BUILDINGS_PATH,
+                    help="Building register to centre chips on (empty: installation points)")
+    ap.add_argument("--years", default=",".join(map(str, YEARS)),
+                    help="Flight years available for --layer (see its GetCapabilities)")
+    ap.add_argument("--epoch-mode", choices=["time", "layer"], default="time",
+                    help="Select years via the WMS TIME dimension or one layer per year")
+    ap.add_argument("--layer", default=LAYER)
+    ap.add_argument("--layer-template", default=LAYER_TEMPLATE,
+                    help="Per-year layer name for --epoch-mode layer")
+    ap.add_argument("--store", default="",
+                    help="Also pack before/after chips into this chip store")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.csv):
+        print(f"[ERROR] File not found: {args.csv}")
+        return
+    t0 = time.perf_counter()
+    inst = load_installations(args.csv, args.buildings)
+    flights = tuple(int(y) for y in args.years.split(","))
+    inst["before"], inst["after"] = pick_epochs(inst["year"].to_numpy(), flights)
+    no_year = int(inst["year"].isna().sum())
+    no_before = int(inst["before"].isna().sum()) - no_year
+    print(f"[INFO] {len(inst)} installations ({no_year} without a year, {no_before} "
+          f"installed before the first flight {min(flights)}) in {time.perf_counter() - t0:.1f}s")
+
+    jobs = epoch_jobs(inst, args.out_dir)
+    slots = int(inst[list(SLOTS)].notna().sum().sum())
+    unique = sum(len(j) for j in jobs.values())
+    print(f"[INFO] {slots} epoch chips needed, {unique} unique requests over "
+          f"{len(jobs)} epochs ({', '.join(f'{e}: {len(j)}' for e, j in jobs.items())})")
+
+    failed = 0
+    for epoch, todo in jobs.items():
+        epoch_dir = os.path.join(args.out_dir, epoch)
+        os.makedirs(epoch_dir, exist_ok=True)
+        layer, when = epoch_request(epoch, args.epoch_mode, args.layer, args.layer_template)
+        manifest = None if args.no_manifest else Manifest(os.path.join(epoch_dir, MANIFEST_NAME))
+        # one filter per epoch: the same roof in two years is not a duplicate
+        opts = download_options(args, manifest)
+        print(f"[INFO] Epoch {epoch}: {layer}" + (f" TIME={when}" if when else ""))
+        try:
+            if args.mosaic:
+                stats = download_mosaic(todo, WIDTH, HEIGHT, M_PER_PX, layer=layer, epoch=when,
+                                        block_px=args.block_px, min_fill=args.min_fill, **opts)
+            else:
+                stats = download_tiles(todo, WIDTH, HEIGHT, M_PER_PX, layer=layer,
+                                       epoch=when, **opts)
+        finally:
+            if manifest is not None:
+                manifest.close()
+        failed += stats["failed"]
+
+    if args.store:
+        t0 = time.perf_counter()
+        n, missing = pack_epochs(inst, args.out_dir, args.store, args.workers)
+        print(f"[OK] Packed {n} before/after stacks into {args.store} in "
+              f"{time.perf_counter() - t0:.1f}s ({missing} without both epochs)")
+    if failed:
+        # non-zero exit keeps pipeline.py from recording the stage as complete
+        print(f"[ERROR] {failed} chips failed; rerun to retry them")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Shared swisstopo WMS helpers for the orthophoto download scripts.
+- GetMap bbox/parameter construction for LV95 (EPSG:2056) chips
+- Concurrent downloader: bounded thread pool over one pooled keep-alive
+  session, global requests-per-second cap, exponential backoff on 429/5xx
+- Resumable via manifest.py: completed tiles are skipped on rerun
+- Optional inline filter (phash.ChipFilter): blank and near-duplicate tiles are
+  recorded in the manifest but not written (--skip-blank, --skip-duplicates)
+- Optional inline quality stage (quality.QualityFilter, --quality): decode,
+  reject blank/nodata/cloud/error images, normalize to the declared size and
+  sRGB before writing, in the download workers
+- Metrics (metrics.py): request latency, status mix, retries, bytes, queue
+  depth, check/write time; progress summaries, --metrics-json, --metrics-port
+- Reports tiles/sec; point --wms-url at stub_wms.py to test locally
+Dep: pip install requests pillow
+"""
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from manifest import MANIFEST_NAME, REJECTED, Manifest, is_complete, sha1_bytes, tile_key
+from metrics import METRICS, Reporter, serve as serve_metrics
+from phash import ChipFilter
+from quality import COLOR_MODES, QualityFilter, check_result
+
+WMS_URL = "https://wms.geo.admin.ch/"
+LAYER = "ch.swisstopo.swissimage-product"  # High-res orthophoto
+
+# HTTP status codes worth retrying (rate limiting / transient server errors)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def chip_bbox(x, y, width, m_per_px, height=None):
+    """BBOX of a width x height px chip at m_per_px centred on (x, y); square by default."""
+    half_w = (width * m_per_px) / 2.0
+    half_h = ((height or width) * m_per_px) / 2.0
+    return x - half_w, y - half_h, x + half_w, y + half_h
+
+
+def getmap_params(bbox, width, height, layer=LAYER, epoch=None):
+    """GetMap query; epoch sets the layer's TIME dimension (e.g. "2016")."""
+    minx, miny, maxx, maxy = bbox
+    params = {
+        "SERVICE": "WMS",
+        "REQUEST": "GetMap",
+        "VERSION": "1.3.0",
+        "LAYERS": layer,
+        "STYLES": "",
+        "CRS": "EPSG:2056",
+        "BBOX": f"{minx},{miny},{maxx},{maxy}",
+        "WIDTH": width,
+        "HEIGHT": height,
+        "FORMAT": "image/png"
+    }
+    if epoch is not None:
+        params["TIME"] = str(epoch)
+    return params
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at least 1/rps seconds apart (rps <= 0: off)."""
+
+    def __init__(self, rps=0.0):
+        self.interval = 1.0 / rps if rps and rps > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def make_session(pool_size=8):
+    """requests.Session whose connection pool holds one keep-alive socket per worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def fetch_getmap(session, params, url=WMS_URL, limiter=None, retries=5,
+                 backoff=0.5, timeout=30):
+    """GET one GetMap image, retrying 429/5xx and connection errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        t0 = time.perf_counter()
+        try:
+            r = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            METRICS.observe("wms_request_seconds", time.perf_counter() - t0)
+            METRICS.inc("wms_responses_total", status=type(e).__name__)
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+        else:
+            METRICS.observe("wms_request_seconds", time.perf_counter() - t0)
+            METRICS.inc("wms_responses_total", status=r.status_code)
+            if r.status_code not in RETRY_STATUS or attempt == retries:
+                r.raise_for_status()
+                METRICS.inc("wms_bytes_total", len(r.content))
+                return r.content
+            delay = _retry_after(r) or backoff * 2 ** attempt
+        METRICS.inc("wms_retries_total")
+        # small jitter so workers do not retry in lockstep
+        time.sleep(delay * (1.0 + 0.1 * random.random()))
+
+
+def bounded_map(fn, items, workers=8, max_pending=None, gauge=None):
+    """
+    Run fn over items in a thread pool, yielding (item, result, error) as tasks finish.
+    At most max_pending tasks are queued, so items may be a lazy generator of any size.
+    gauge names a METRICS gauge that tracks the number of queued tasks.
+    """
+    max_pending = max_pending or workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        it = iter(items)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(fn, item)] = item
+            if not pending:
+                break
+            if gauge:
+                METRICS.set(gauge, len(pending))
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                item = pending.pop(fut)
+                err = fut.exception()
+                yield item, (None if err else fut.result()), err
+
+
+def bind_check(check, width, height, m_per_px):
+    """Give a download hook that declares bind() the geometry of the chip set."""
+    if check is not None and hasattr(check, "bind"):
+        return check.bind(width, height, m_per_px)
+    return check
+
+
+def write_atomic(path, data):
+    # write-then-rename so a crash never leaves a truncated tile behind
+    tmp = path + ".part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def csv_jobs(df, out_dir, x_col="GKODE", y_col="GKODN"):
+    """(x, y, out_file) download jobs for every row of a coordinate DataFrame."""
+    xs = df[x_col].astype(float).to_numpy()
+    ys = df[y_col].astype(float).to_numpy()
+    return [(x, y, os.path.join(out_dir, f"ortho_{int(x)}_{int(y)}.png"))
+            for x, y in zip(xs, ys)]
+
+
+def pending_jobs(jobs, width, height, m_per_px, layer, manifest, only_failed, stats,
+                 epoch=None):
+    """Yield (x, y, out_file, key) jobs that the manifest does not mark as complete."""
+    known = manifest.load() if manifest is not None else {}
+    layer_key = layer if epoch is None else f"{layer}@{epoch}"
+    for x, y, out_file in jobs:
+        key = tile_key(layer_key, chip_bbox(x, y, width, m_per_px, height),
+                       width, height, m_per_px)
+        if manifest is not None:
+            entry = known.get(key)
+            if is_complete(entry, out_file):
+                stats["skipped"] += 1
+                continue
+            if entry is None and os.path.isfile(out_file) and os.path.getsize(out_file):
+                # adopt tiles downloaded before the manifest existed
+                with open(out_file, "rb") as f:
+                    data = f.read()
+                manifest.record(key, "ok", out_file, len(data), sha1_bytes(data))
+                stats["skipped"] += 1
+                continue
+            if only_failed and (entry is None or entry[0] != "failed"):
+                continue
+        yield x, y, out_file, key
+
+
+@contextmanager
+def metrics_run(progress=0.0, metrics_json="", metrics_port=0):
+    """
+    Observability around a download: fresh METRICS, progress summaries every
+    `progress` seconds, a /metrics endpoint on metrics_port while it runs and a
+    JSON dump at the end.
+    """
+    METRICS.reset()
+    server = serve_metrics(metrics_port) if metrics_port else None
+    try:
+        with Reporter(progress):
+            yield
+    finally:
+        if server is not None:
+            server.shutdown()
+        if metrics_json:
+            METRICS.dump_json(metrics_json)
+            print(f"[INFO] Metrics saved: {metrics_json}")
+
+
+def record_outcome(stats, manifest, job, res, err, verbose=True):
+    """
+    Count one finished tile (res = (bytes, sha1, reject reason)) and record it.
+    Reasons outside REJECTED (an undecodable response) count as failures.
+    """
+    x, y, out_file, key = job
+    if err is None and res[2] is not None and res[2] not in REJECTED:
+        err = res[2]
+    if err is None and res[2] is not None:
+        stats["rejected"] += 1
+        METRICS.inc("tiles_total", status="rejected")
+        if manifest is not None:
+            manifest.record(key, res[2], None, res[0], res[1])
+        if verbose:
+            print(f"[INFO] Skipped {out_file}: {res[2]}")
+    elif err is None:
+        stats["ok"] += 1
+        stats["bytes"] += res[0]
+        METRICS.inc("tiles_total", status="ok")
+        if manifest is not None:
+            manifest.record(key, "ok", out_file, res[0], res[1])
+        if verbose:
+            print(f"[OK] Saved {out_file}")
+    else:
+        stats["failed"] += 1
+        METRICS.inc("tiles_total", status="failed")
+        if manifest is not None:
+            manifest.record(key, "failed", out_file,
+                            error=err if isinstance(err, str) else f"{type(err).__name__}: {err}")
+        print(f"[WARN] Failed {x},{y}: {err}")
+
+
+def download_tiles(jobs, width, height, m_per_px, layer=LAYER, url=WMS_URL,
+                   workers=8, rps=0.0, retries=5, timeout=30, verbose=True,
+                   manifest=None, only_failed=False, check=None, progress=0.0,
+                   metrics_json="", metrics_port=0, epoch=None):
+    """
+    Download (x, y, out_file) jobs concurrently. Returns a stats dict.
+    With a Manifest, completed tiles are skipped and every outcome is recorded;
+    only_failed restricts the run to tiles the manifest lists as failed.
+    check(data, out_file) may return a REJECTED reason ("blank", "duplicate") to drop a tile
+    instead of writing it, or (reason, data) to also replace the bytes written
+    (quality.QualityFilter). epoch requests one epoch of the layer (WMS TIME).
+    Metrics: see metrics_run.
+    """
+    session = make_session(workers)
+    limiter = RateLimiter(rps)
+    stats = {"ok": 0, "failed": 0, "skipped": 0, "rejected": 0, "bytes": 0}
+    check = bind_check(check, width, height, m_per_px)
+
+    def work(job):
+        x, y, out_file, _ = job
+        params = getmap_params(chip_bbox(x, y, width, m_per_px, height),
+                               width, height, layer, epoch)
+        data = fetch_getmap(session, params, url=url, limiter=limiter,
+                            retries=retries, timeout=timeout)
+        reason = None
+        if check is not None:
+            with METRICS.timer("tile_check_seconds"):
+                reason, data = check_result(check, data, out_file)
+        if reason is None:
+            with METRICS.timer("tile_write_seconds"):
+                write_atomic(out_file, data)
+        return len(data), sha1_bytes(data), reason
+
+    todo = pending_jobs(jobs, width, height, m_per_px, layer,
+                        manifest, only_failed, stats, epoch)
+    t0 = time.perf_counter()
+    try:
+        with metrics_run(progress, metrics_json, metrics_port):
+            for job, res, err in bounded_map(work, todo, workers,
+                                             gauge="download_queue_depth"):
+                record_outcome(stats, manifest, job, res, err, verbose)
+    finally:
+        session.close()
+        if manifest is not None:
+            manifest.commit()
+
+    stats["elapsed"] = time.perf_counter() - t0
+    stats["tiles_per_s"] = stats["ok"] / stats["elapsed"] if stats["elapsed"] else 0.0
+    print(f"[INFO] {stats['ok']} tiles in {stats['elapsed']:.1f}s "
+          f"({stats['tiles_per_s']:.1f} tiles/s, "
+          f"{stats['bytes'] / 1e6:.1f} MB), {stats['failed']} failed, "
+          f"{stats['rejected']} rejected, {stats['skipped']} already complete")
+    return stats
+
+
+def add_download_args(ap, csv_path, out_dir):
+    """Common CLI options shared by the orthophoto download scripts."""
+    ap.add_argument("--csv", default=csv_path,
+                    help=f"Input CSV with GKODE/GKODN (default: {csv_path})")
+    ap.add_argument("--out-dir", default=out_dir,
+                    help=f"Output directory (default: {out_dir})")
+    ap.add_argument("--wms-url", default=WMS_URL,
+                    help="WMS endpoint (e.g. http://127.0.0.1:8089/ for stub_wms.py)")
+    ap.add_argument("--workers", type=int, default=8,
+                    help="Concurrent requests (default: 8)")
+    ap.add_argument("--rps", type=float, default=0.0,
+                    help="Max requests per second across workers (0 = no cap)")
+    ap.add_argument("--retries", type=int, default=5,
+                    help="Retries on 429/5xx/connection errors (exponential backoff)")
+    ap.add_argument("--quiet", action="store_true",
+                    help="Only print failures and the final summary")
+    ap.add_argument("--manifest", default="",
+                    help=f"Tile manifest (default: <out-dir>/{MANIFEST_NAME})")
+    ap.add_argument("--no-manifest", action="store_true",
+                    help="Re-download everything and do not record progress")
+    ap.add_argument("--only-failed", action="store_true",
+                    help="Retry only tiles the manifest lists as failed")
+    ap.add_argument("--mosaic", action="store_true",
+                    help="Fetch large blocks once and crop chips locally (see mosaic.py)")
+    ap.add_argument("--block-px", type=int, default=2048,
+                    help="Block size in pixels for --mosaic (default: 2048)")
+    ap.add_argument("--min-fill", type=float, default=0.1,
+                    help="Split --mosaic blocks until chips cover this fraction (default: 0.1)")
+    ap.add_argument("--skip-blank", action="store_true",
+                    help="Do not store blank/uniform tiles (see phash.py)")
+    ap.add_argument("--skip-duplicates", type=int, default=-1, metavar="RADIUS",
+                    help="Do not store tiles within this pHash Hamming distance "
+                         "of an already stored one (-1 = keep all)")
+    ap.add_argument("--phash-index", default="",
+                    help="Also treat chips of this phash.py index as already stored")
+    ap.add_argument("--quality", action="store_true",
+                    help="Decode each tile, reject blank/nodata/cloud/error images and "
+                         "write normalized sRGB PNGs (see quality.py)")
+    ap.add_argument("--max-cloud", type=float, default=0.6,
+                    help="--quality: max fraction of cloud-like pixels (default: 0.6)")
+    ap.add_argument("--max-nodata", type=float, default=0.3,
+                    help="--quality: max fraction of pure black/white pixels (default: 0.3)")
+    ap.add_argument("--color", choices=COLOR_MODES, default="srgb",
+                    help="--quality: sRGB only, or sRGB plus a per-chip percentile stretch")
+    ap.add_argument("--progress", type=float, default=10.0,
+                    help="Seconds between progress summaries (0 = off)")
+    ap.add_argument("--metrics-json", default="",
+                    help="Write latency histograms, status counts, etc. here at the end")
+    ap.add_argument("--metrics-port", type=int, default=0,
+                    help="Serve Prometheus-style /metrics on this local port while running")
+
+
+def download_options(args, manifest=None):
+    """download_tiles/download_mosaic keyword arguments from add_download_args options."""
+    check = None
+    if args.skip_blank or args.skip_duplicates >= 0:
+        check = ChipFilter(args.skip_blank,
+                           args.skip_duplicates if args.skip_duplicates >= 0 else None,
+                           args.phash_index)
+    if args.quality:
+        check = QualityFilter(args.max_nodata, args.max_cloud, args.color, dedup=check)
+    return {"url": args.wms_url, "workers": args.workers, "rps": args.rps,
+            "retries": args.retries, "verbose": not args.quiet,
+            "manifest": manifest, "only_failed": args.only_failed, "check": check,
+            "progress": args.progress, "metrics_json": args.metrics_json,
+            "metrics_port": args.metrics_port}
+
+
+def open_manifest(args):
+    """Manifest selected by add_download_args options, or None with --no-manifest."""
+    if args.no_manifest:
+        return None
+    return Manifest(args.manifest or os.path.join(args.out_dir, MANIFEST_NAME))
@@ -1,10 +1,133 @@
+#!/usr/bin/env python3
+"""
+YOLO training runner: one continuous run with resume and early stopping.
+- A single model.train call (no per-epoch restarts, so the dataset scan, cache
+  build and warm-up happen once)
+- Resumes automatically from <project>/<name>/weights/last.pt when present
+- Early stopping after --patience epochs without improvement
+- Images cached in RAM or on disk (--cache)
+- Dataset paths in data.yaml (a path or a list per split) are relative to the yaml file
+- Per-epoch training and validation time, and training images/sec (training
+  time only), printed and written to <run>/epoch_times.csv
+
+Example:
+  python yolo.py --epochs 50 --patience 10 --cache ram --batch 32
+Dep: pip install ultralytics pyyaml (pyyaml also comes with ultralytics)
+"""
+
+import argparse
+import os
+import time
+
+import yaml
 from ultralytics import YOLO
 
-# Carica un modello pre-addestrato o nuovo
-model = YOLO('yolov8n.pt')  # o .yaml
+DATA_PATH = "data.yaml"
+MODEL = "yolov8n.pt"  # pre-trained, or a .yaml for a new model
+RESOLVED_DATA = ".cache/yolo/data.yaml"
+
+
+def resolve_data(data_path, out_path=RESOLVED_DATA):
+    """Copy of data_path with its dataset paths made absolute (relative to the yaml file)."""
+    with open(data_path, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    base = os.path.join(os.path.dirname(os.path.abspath(data_path)), data.get("path", "."))
+    data["path"] = os.path.normpath(base)
+    for split in ("train", "val", "test"):
+        paths = data.get(split)
+        if isinstance(paths, str):
+            paths = [paths]
+        elif not isinstance(paths, list):
+            continue
+        paths = [os.path.normpath(os.path.join(data["path"], p)) for p in paths]
+        for p in paths:
+            if not os.path.exists(p):
+                print(f"[WARN] {split} path not found: {p}")
+        data[split] = paths[0] if isinstance(data[split], str) else paths
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+    return out_path
+
+
+def add_epoch_timer(model):
+    """
+    Print and log per-epoch training and validation time; images/sec is over
+    the training phase only, so a slow validation does not lower it.
+    """
+    state = {}
+
+    def on_train_epoch_start(trainer):
+        state["t0"] = time.perf_counter()
+
+    def on_train_epoch_end(trainer):  # last batch done, validation not started
+        state["t1"] = time.perf_counter()
+
+    def on_fit_epoch_end(trainer):  # after validation
+        t0 = state["t0"]
+        t1 = state.get("t1", t0)
+        train_s, val_s = t1 - t0, time.perf_counter() - t1
+        n_images = len(trainer.train_loader.dataset)
+        ips = n_images / train_s if train_s else 0.0
+        print(f"[INFO] Epoch {trainer.epoch + 1}/{trainer.epochs}: train {train_s:.1f}s "
+              f"({ips:.1f} images/s, {n_images} images), val {val_s:.1f}s")
+        log = os.path.join(trainer.save_dir, "epoch_times.csv")
+        new = not os.path.exists(log)
+        with open(log, "a", encoding="utf-8") as f:
+            if new:
+                f.write("epoch,train_seconds,val_seconds,images,train_images_per_s\n")
+            f.write(f"{trainer.epoch + 1},{train_s:.3f},{val_s:.3f},{n_images},{ips:.2f}\n")
+
+    model.add_callback("on_train_epoch_start", on_train_epoch_start)
+    model.add_callback("on_train_epoch_end", on_train_epoch_end)
+    model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Train YOLO on the orthophoto chips")
+    ap.add_argument("--data", default=DATA_PATH, help=f"Dataset yaml (default: {DATA_PATH})")
+    ap.add_argument("--model", default=MODEL, help=f"Initial weights or model yaml (default: {MODEL})")
+    ap.add_argument("--epochs", type=int, default=50)
+    ap.add_argument("--patience", type=int, default=10,
+                    help="Stop after this many epochs without improvement")
+    ap.add_argument("--imgsz", type=int, default=256)
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--cache", choices=["ram", "disk", "none"], default="ram",
+                    help="Image cache: decoded once per run instead of every epoch")
+    ap.add_argument("--workers", type=int, default=4, help="Dataloader workers")
+    ap.add_argument("--device", default="cpu")
+    ap.add_argument("--project", default="runs", help="Output root")
+    ap.add_argument("--name", default="train", help="Run name (resumed if it exists)")
+    ap.add_argument("--restart", action="store_true",
+                    help="Start a fresh run even if a checkpoint exists")
+    args = ap.parse_args()
+
+    last = os.path.join(args.project, args.name, "weights", "last.pt")
+    if os.path.exists(last) and not args.restart:
+        # resume restores epochs, optimizer and dataset settings from the checkpoint
+        print(f"[INFO] Resuming from {last}")
+        model = YOLO(last)
+        add_epoch_timer(model)
+        model.train(resume=True)
+        return
+
+    model = YOLO(args.model)
+    add_epoch_timer(model)
+    model.train(
+        data=resolve_data(args.data),
+        epochs=args.epochs,
+        patience=args.patience,
+        imgsz=args.imgsz,
+        batch=args.batch,
+        cache=False if args.cache == "none" else args.cache,
+        workers=args.workers,
+        device=args.device,
+        project=args.project,
+        name=args.name,
+        exist_ok=True,
+        verbose=False,
+    )
+
 
-# Avvia il training
-epochs = 5
-for epoch in range(epochs):
-    results = model.train(data='/Users/lucavisconti/Bern/bern-solar-panel-detection/data.yaml', epochs=5, imgsz=256, verbose=False)  # 1 epoca per volta
-    print(f"Epoca {epoch + 1} completata")
\ No newline at end of file
+if __name__ == "__main__":
+    main()